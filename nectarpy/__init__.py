@@ -1,3 +1,8 @@
 from .lib import Nectar
 from .lib_v1 import NectarClient
+from .lib_async import AsyncNectar, AsyncNectarClient
+from .common.blob_store import BlobStore, FileBlobStore, HttpBlobStore
+from .common.query_handle import QueryHandle
+from .common.transactions import BatchError
+from .session import NectarSession
 from .common import encryption,blockchain_init
\ No newline at end of file
@@ -0,0 +1,61 @@
+import threading
+
+
+class AllowanceLedger:
+    """
+    USDC that payQuery calls will still pull from the allowance.
+
+    ERC-20 approve overwrites the allowance rather than adding to it, so an
+    approve sent while other payments are on their way has to cover them
+    too. Payments count from the approve decision until their payQuery is
+    mined, or until they fail to send.
+    """
+
+    def __init__(self):
+        self._reserved = 0
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: int):
+        """Counts amount that is about to be paid"""
+        with self._lock:
+            self._reserved += amount
+
+    def unreserve(self, amount: int):
+        """Drops a reserved payment that will not be sent"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - amount)
+
+    def sent(self, amount: int, tx_hash):
+        """Moves a reserved payment to its payQuery transaction"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - amount)
+            self._sent[tx_hash] = amount
+
+    def settle(self, tx_hash):
+        """Drops a payment whose payQuery was mined"""
+        with self._lock:
+            self._sent.pop(tx_hash, None)
+
+    def pending_hashes(self) -> list:
+        """payQuery transactions not yet known to be mined"""
+        with self._lock:
+            return list(self._sent)
+
+    def total(self) -> int:
+        """USDC still to be pulled by payments counted here"""
+        with self._lock:
+            return self._reserved + sum(self._sent.values())
+
+
+def allowance_ledger(self) -> AllowanceLedger:
+    """Returns the client's ledger, creating it on first use"""
+    return self.__dict__.setdefault("_allowances", AllowanceLedger())
+
+
+def payment_sent(self, price: int, tx_hash):
+    allowance_ledger(self).sent(price, tx_hash)
+
+
+def payment_failed(self, price: int):
+    allowance_ledger(self).unreserve(price)
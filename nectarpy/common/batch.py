@@ -0,0 +1,174 @@
+import os
+import json
+import asyncio
+from web3.providers.async_rpc import AsyncHTTPProvider
+from web3.providers.rpc import HTTPProvider
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.request import async_make_post_request, make_post_request
+from nectarpy.common.rpc import FailoverHTTPProvider
+
+
+def _batch_size() -> int:
+    return int(os.getenv("NECTAR_RPC_BATCH_SIZE", "100"))
+
+
+def _supports_batch(web3) -> bool:
+    return web3 is not None and isinstance(getattr(web3, "provider", None), HTTPProvider)
+
+
+def _decode_output(web3, fn, return_data: str):
+    output_types = get_abi_output_types(fn.abi)
+    decoded = web3.codec.decode(output_types, bytes.fromhex(return_data[2:]))
+    normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+    if len(normalized) == 1:
+        return normalized[0]
+    return normalized
+
+
+def _call_one(fn, return_exceptions: bool):
+    try:
+        return fn.call()
+    except Exception as e:
+        if not return_exceptions:
+            raise
+        return e
+
+
+def _batch_payload(calls: list) -> bytes:
+    payload = [
+        {
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "eth_call",
+            "params": [
+                {"to": fn.address, "data": fn._encode_transaction_data()},
+                "latest",
+            ],
+        }
+        for i, fn in enumerate(calls)
+    ]
+    return json.dumps(payload).encode("utf-8")
+
+
+def _batch_responses(raw: bytes, calls: list) -> list:
+    responses = json.loads(raw)
+    if not isinstance(responses, list):
+        raise ValueError(f"RPC endpoint rejected batch request: {responses}")
+    by_id = {r.get("id"): r for r in responses}
+    return [by_id.get(i, {}) for i in range(len(calls))]
+
+
+def _post(web3, data: bytes, method: str) -> bytes:
+    """POSTs a raw JSON-RPC body, through endpoint failover when the provider has it"""
+    provider = web3.provider
+    if isinstance(provider, FailoverHTTPProvider):
+        return provider.post(data, method)
+    return make_post_request(provider.endpoint_uri, data, **provider.get_request_kwargs())
+
+
+def _send_batch(web3, calls: list) -> list:
+    return _batch_responses(_post(web3, _batch_payload(calls), "eth_call"), calls)
+
+
+def batch_call(web3, calls: list, return_exceptions: bool = False) -> list:
+    """Runs contract view calls as JSON-RPC batches, returning what .call() would"""
+    if not _supports_batch(web3):
+        return [_call_one(fn, return_exceptions) for fn in calls]
+
+    results = []
+    size = _batch_size()
+    for start in range(0, len(calls), size):
+        chunk = calls[start : start + size]
+        try:
+            responses = _send_batch(web3, chunk)
+        except Exception as e:
+            print("batch rpc failed, falling back to single calls:", e)
+            results.extend(_call_one(fn, return_exceptions) for fn in chunk)
+            continue
+        for fn, response in zip(chunk, responses):
+            try:
+                results.append(_decode_output(web3, fn, response["result"]))
+            except Exception:
+                # Re-issue failures alone so callers see web3's usual exception types.
+                results.append(_call_one(fn, return_exceptions))
+    return results
+
+
+def _block_payload(numbers: list) -> bytes:
+    payload = [
+        {
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "eth_getBlockByNumber",
+            "params": [hex(n), False],
+        }
+        for i, n in enumerate(numbers)
+    ]
+    return json.dumps(payload).encode("utf-8")
+
+
+def block_timestamps(web3, numbers) -> dict:
+    """Returns {block number: timestamp}, reading the headers as JSON-RPC batches"""
+    numbers = sorted(set(numbers))
+    if not _supports_batch(web3):
+        return {n: web3.eth.get_block(n)["timestamp"] for n in numbers}
+
+    times = {}
+    size = _batch_size()
+    for start in range(0, len(numbers), size):
+        chunk = numbers[start : start + size]
+        try:
+            raw = _post(web3, _block_payload(chunk), "eth_getBlockByNumber")
+            responses = _batch_responses(raw, chunk)
+        except Exception as e:
+            print("batch rpc failed, falling back to single calls:", e)
+            responses = [{} for _ in chunk]
+        for n, response in zip(chunk, responses):
+            block = response.get("result")
+            if block:
+                times[n] = int(block["timestamp"], 16)
+            else:
+                times[n] = web3.eth.get_block(n)["timestamp"]
+    return times
+
+
+async def _async_call_one(fn, return_exceptions: bool):
+    try:
+        return await fn.call()
+    except Exception as e:
+        if not return_exceptions:
+            raise
+        return e
+
+
+async def async_batch_call(web3, calls: list, return_exceptions: bool = False) -> list:
+    """batch_call counterpart for AsyncWeb3 clients"""
+    provider = getattr(web3, "provider", None)
+    if not isinstance(provider, AsyncHTTPProvider):
+        return list(
+            await asyncio.gather(
+                *[_async_call_one(fn, return_exceptions) for fn in calls]
+            )
+        )
+
+    results = []
+    size = _batch_size()
+    for start in range(0, len(calls), size):
+        chunk = calls[start : start + size]
+        try:
+            raw = await async_make_post_request(
+                provider.endpoint_uri,
+                _batch_payload(chunk),
+                **provider.get_request_kwargs(),
+            )
+            responses = _batch_responses(raw, chunk)
+        except Exception as e:
+            print("batch rpc failed, falling back to single calls:", e)
+            responses = [{} for _ in chunk]
+        for fn, response in zip(chunk, responses):
+            try:
+                results.append(_decode_output(web3, fn, response["result"]))
+            except Exception:
+                results.append(await _async_call_one(fn, return_exceptions))
+    return results
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import requests
+
+# Sealed payloads at least this large are stored off-chain when a store is set.
+OFFLOAD_MIN_BYTES = 4096
+
+
+class BlobStore(ABC):
+    """Content-addressed storage for sealed payloads; subclasses implement put and get"""
+
+    @abstractmethod
+    def put(self, digest: str, data: bytes) -> str:
+        """Stores data under its sha256 hex digest and returns a locator"""
+
+    @abstractmethod
+    def get(self, locator: str) -> bytes:
+        """Returns the bytes stored at locator"""
+
+
+class FileBlobStore(BlobStore):
+    """Stores blobs as files named by digest, e.g. on a shared volume"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, digest: str, data: bytes) -> str:
+        path = self.root / digest
+        if not path.exists():
+            # Write then rename, so readers never see a partial blob.
+            fd, tmp_path = tempfile.mkstemp(dir=self.root)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+        return path.resolve().as_uri()
+
+    def get(self, locator: str) -> bytes:
+        parsed = urlparse(locator)
+        if parsed.scheme != "file":
+            raise ValueError(f"Not a file locator: {locator}")
+        # as_uri() percent-encodes spaces and non-ASCII characters.
+        return Path(url2pathname(parsed.path)).read_bytes()
+
+
+class HttpBlobStore(BlobStore):
+    """Stores blobs with PUT {base_url}/{digest} and reads them back with GET"""
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        # One keep-alive session per thread, owned by this store.
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def put(self, digest: str, data: bytes) -> str:
+        locator = f"{self.base_url}/{digest}"
+        response = self._session().put(locator, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return locator
+
+    def get(self, locator: str) -> bytes:
+        response = self._session().get(locator, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+
+def offload_payload(store: BlobStore, payload: str, min_bytes: int = OFFLOAD_MIN_BYTES) -> str:
+    """
+    Moves a large payload into store and returns the on-chain reference to it.
+    Top-level metadata other than the ciphertext stays inline, since the
+    backend reads it without fetching the blob.
+    """
+    data = payload.encode("utf-8")
+    if len(data) < min_bytes:
+        return payload
+    digest = hashlib.sha256(data).hexdigest()
+    reference = {
+        key: value
+        for key, value in json.loads(payload).items()
+        if key not in ("cipher", "encapsulatedKey", "returnPubkey", "args", "kwargs")
+    }
+    reference["payloadRef"] = {
+        "sha256": digest,
+        "locator": store.put(digest, data),
+        "size": len(data),
+    }
+    return json.dumps(reference, separators=(",", ":"))
+
+
+def resolve_payload(store: BlobStore, reference: dict) -> str:
+    """Fetches the blob named by a payloadRef and checks it against its hash"""
+    if store is None:
+        raise RuntimeError("Result is stored off-chain but no blob store is configured")
+    data = store.get(reference["locator"])
+    if hashlib.sha256(data).hexdigest() != reference["sha256"]:
+        raise RuntimeError(
+            f"Off-chain payload at {reference['locator']} does not match its hash"
+        )
+    return data.decode("utf-8")
@@ -1,25 +1,75 @@
 import os
 import hpke
 import json
-from web3 import Web3
+from web3 import AsyncWeb3, Web3
 from pathlib import Path
-from web3.gas_strategies.rpc import rpc_gas_price_strategy
+from functools import lru_cache
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.backends import default_backend
+from nectarpy.common.fees import AsyncFeeOracle, FeeOracle, chain_id_from_config
+from nectarpy.common.rpc import (
+    AsyncFailoverHTTPProvider,
+    FailoverHTTPProvider,
+    endpoint_urls,
+)
+from nectarpy.common.nonce import AsyncNonceManager, NonceManager
 
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 
 def req_json(rel_path):
-    parent_folder_path =  Path(__file__).resolve().parent.parent
-    config_path = os.getenv('BLOCKCHAIN_CREDENTIAL',parent_folder_path)
-    file_path = config_path / rel_path
+    """Returns a parsed config file, read from disk once per process; do not mutate"""
+    parent_folder_path = Path(__file__).resolve().parent.parent
+    config_path = Path(os.getenv("BLOCKCHAIN_CREDENTIAL", parent_folder_path))
+    return _load_json(str((config_path / rel_path).resolve()))
+
+
+@lru_cache(maxsize=None)
+def _load_json(file_path: str):
     with open(file_path, 'r', encoding='utf-8') as file:
         jsonStr = file.read()
     return json.loads(jsonStr)
 
-def blockchain_init(self, api_secret: str, mode: str = "moonbeam"):
-    print("network mode:", mode)
+
+class LazyContract:
+    """Builds a client contract on first access, parsing its ABI only then"""
+
+    def __init__(self, address_key: str, abi_path: str):
+        self.address_key = address_key
+        self.abi_path = abi_path
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        source = obj.__dict__.get("contract_source")
+        if source is not None:
+            # Clients of a NectarSession share the session's contract objects.
+            contract = getattr(source, self.name)
+        else:
+            contract = obj.web3.eth.contract(
+                address=obj.blockchain_config[self.address_key],
+                abi=req_json(self.abi_path)["abi"],
+            )
+        # Instance attributes take precedence over this non-data descriptor,
+        # so later lookups skip __get__ entirely.
+        obj.__dict__[self.name] = contract
+        return contract
+
+
+class ContractsMixin:
+    """Contracts shared by every client, built lazily from blockchain_config"""
+
+    USDC = LazyContract("usdc", "config/USDC.json")
+    QueryManager = LazyContract("queryManager", "config/QueryManager.json")
+    EoaBond = LazyContract("eoaBond", "config/EoaBond.json")
+    UserRole = LazyContract("userRole", "config/UserRole.json")
+
+
+def _init_keys(self, api_secret: str):
+    """Derives the client encryption keys from the API secret"""
     self.suite = hpke.Suite__DHKEM_P256_HKDF_SHA256__HKDF_SHA256__AES_128_GCM
     hkdf = HKDF(
         algorithm=self.suite.KDF.HASH,
@@ -39,29 +89,58 @@ def blockchain_init(self, api_secret: str, mode: str = "moonbeam"):
     ).hex()
     sn_pubkey_bytes = bytes.fromhex(req_json("config/starnode.json")["public_key"])
     self.sn_pubkey = self.suite.KEM.decode_public_key(sn_pubkey_bytes)
-    
-    # blockchain
-    blockchain = req_json("config/blockchain.json")[mode]
-    qm_abi = req_json("config/QueryManager.json")["abi"]
-    eb_abi = req_json("config/EoaBond.json")["abi"]
-    nt_abi = req_json("config/USDC.json")["abi"]
-    user_role_abi = req_json("config/UserRole.json")["abi"]
-    
-    self.web3 = Web3(Web3.HTTPProvider(blockchain["url"]))
+
+
+def _init_identity(self, api_secret: str, mode: str) -> dict:
+    """Derives the client keys and returns the network config for mode"""
+    print("network mode:", mode)
+    _init_keys(self, api_secret)
+    return req_json("config/blockchain.json")[mode]
+
+
+def _init_contracts(self, api_secret: str, blockchain: dict):
     self.account = {
         "private_key": api_secret,
         "address": self.web3.eth.account.from_key(api_secret).address,
     }
-    self.web3.eth.set_gas_price_strategy(rpc_gas_price_strategy)
-    self.USDC = self.web3.eth.contract(address=blockchain["usdc"], abi=nt_abi)
-    self.QueryManager = self.web3.eth.contract(
-        address=blockchain["queryManager"], abi=qm_abi
-    )
-    self.EoaBond = self.web3.eth.contract(address=blockchain["eoaBond"], abi=eb_abi)
+    self.blockchain_config = blockchain
     self.qm_contract_addr = blockchain["queryManager"]
-    self.UserRole = self.web3.eth.contract(address=blockchain["userRole"], abi=user_role_abi)
+
+
+def _init_client(
+    self, api_secret: str, web3, blockchain: dict, fee_oracle, contract_source=None
+):
+    """
+    Sets up the account, nonce counter and fee cache of a sync client over
+    web3. NectarSession passes its own web3, fee_oracle and contracts so its
+    clients share them.
+    """
+    self.web3 = web3
+    _init_contracts(self, api_secret, blockchain)
+    self.nonce_manager = NonceManager(web3, self.account["address"])
+    self.fee_oracle = fee_oracle
+    if contract_source is not None:
+        self.contract_source = contract_source
+
+
+def blockchain_init(self, api_secret: str, mode: str = "moonbeam"):
+    blockchain = _init_identity(self, api_secret, mode)
+    web3 = Web3(FailoverHTTPProvider(endpoint_urls(blockchain)))
+    fee_oracle = FeeOracle(web3, chain_id_from_config(blockchain))
+    _init_client(self, api_secret, web3, blockchain, fee_oracle)
     print("api account address:", self.account["address"])
 
+
+def async_blockchain_init(self, api_secret: str, mode: str = "moonbeam"):
+    """Same as blockchain_init, but over an AsyncWeb3 failover provider"""
+    blockchain = _init_identity(self, api_secret, mode)
+    self.web3 = AsyncWeb3(AsyncFailoverHTTPProvider(endpoint_urls(blockchain)))
+    _init_contracts(self, api_secret, blockchain)
+    self.nonce_manager = AsyncNonceManager(self.web3, self.account["address"])
+    self.fee_oracle = AsyncFeeOracle(self.web3, chain_id_from_config(blockchain))
+    print("api account address:", self.account["address"])
+
+
 def sans_hex_prefix(self, hexval: str) -> str:
     """Returns a hex string without the 0x prefix"""
     if hexval.startswith("0x"):
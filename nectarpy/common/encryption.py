@@ -1,9 +1,26 @@
 import os
 import json
+import zlib
+import base64
+import codecs
 import dill
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 current_dir = os.path.dirname(__file__)
 
+# Payloads below this many bytes are sealed uncompressed.
+COMPRESS_MIN_BYTES = 1024
+
+# Plaintext bytes per chunk in chunked result envelopes.
+RESULT_CHUNK_BYTES = 64 * 1024
+
+# AAD marking a chunk as last, so a truncated chunk list fails to open.
+_CHUNK_AAD = (b"nectar-chunk", b"nectar-chunk-last")
+
 def hybrid_encrypt_v1(self, query_str, *args, **kwargs):
     """Encrypts plaintext using the public key"""
     func_bytes = dill.dumps(query_str)
@@ -39,4 +56,189 @@ def hybrid_decrypt_v1(self, secret) -> str:
         print("done")
         return msg
     except Exception as e:
-        print("Decryption failed: " + e)
\ No newline at end of file
+        print("Decryption failed: " + e)
+
+
+def envelope_version(self) -> int:
+    """Envelope written by hybrid_encrypt: the client's envelope_version, else NECTAR_ENVELOPE_VERSION"""
+    version = getattr(self, "envelope_version", None)
+    if version is None:
+        version = int(os.getenv("NECTAR_ENVELOPE_VERSION", "1"))
+    return version
+
+
+def compress_payload(data: bytes) -> tuple:
+    """Returns (codec, payload), codec None when compression is off or does not help"""
+    codec = os.getenv("NECTAR_COMPRESSION", "auto")
+    if codec == "none" or len(data) < int(
+        os.getenv("NECTAR_COMPRESS_MIN_BYTES", COMPRESS_MIN_BYTES)
+    ):
+        return None, data
+    if codec == "auto":
+        codec = "zstd" if zstandard is not None else "zlib"
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("NECTAR_COMPRESSION=zstd requires the zstandard package")
+        compressed = zstandard.ZstdCompressor(level=3).compress(data)
+    elif codec == "zlib":
+        compressed = zlib.compress(data, 6)
+    else:
+        raise ValueError(f"Unsupported NECTAR_COMPRESSION codec: {codec}")
+    if len(compressed) >= len(data):
+        return None, data
+    return codec, compressed
+
+
+def _decompressor(codec):
+    if codec is None:
+        return None
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed payload requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported payload codec: {codec}")
+
+
+def decompress_payload(codec, data: bytes) -> bytes:
+    """Reverses compress_payload for the codec named in an envelope"""
+    if codec is None:
+        return data
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed payload requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported payload codec: {codec}")
+
+
+def hybrid_encrypt_v2(self, query_str, *args, **kwargs):
+    """Encrypts plaintext like hybrid_encrypt_v1, with base64 fields in compact JSON"""
+    codec, func_bytes = compress_payload(dill.dumps(query_str))
+    enc, ciphertext = self.suite.seal(
+        peer_pubkey=self.sn_pubkey,
+        info=b"",
+        aad=b"",
+        message=func_bytes
+    )
+    secret = {
+        "v": 2,
+        "cipher": base64.b64encode(ciphertext).decode("ascii"),
+        "encapsulatedKey": base64.b64encode(enc).decode("ascii"),
+        "returnPubkey": base64.b64encode(bytes.fromhex(self.hex_pubkey)).decode("ascii"),
+        "args": args,
+        "kwargs": kwargs
+    }
+    if codec is not None:
+        # Tells the reader to decompress after opening the ciphertext.
+        secret["z"] = codec
+    print("Encryption completed using the public key")
+    return json.dumps(secret, separators=(",", ":"))
+
+
+def hybrid_decrypt_v2(self, secret) -> bytes:
+    """Decrypts a v2 envelope using the API secret-derived key"""
+    data = json.loads(secret) if isinstance(secret, (str, bytes)) else secret
+    msg = self.suite.open(
+        encap=base64.b64decode(data["encapsulatedKey"]),
+        our_privatekey=self.skey,
+        info=b"",
+        aad=b"",
+        ciphertext=base64.b64decode(data["cipher"]))
+    print("done")
+    return decompress_payload(data.get("z"), msg)
+
+
+def hybrid_encrypt(self, query_str, *args, **kwargs):
+    """Encrypts plaintext into the envelope version selected for this client"""
+    if envelope_version(self) >= 2:
+        return hybrid_encrypt_v2(self, query_str, *args, **kwargs)
+    return hybrid_encrypt_v1(self, query_str, *args, **kwargs)
+
+
+def hybrid_decrypt(self, secret):
+    """Decrypts a v1 or v2 envelope, telling them apart by the "v" field"""
+    data = json.loads(secret) if isinstance(secret, (str, bytes)) else secret
+    if isinstance(data, dict) and data.get("v") == 2:
+        return hybrid_decrypt_v2(self, data)
+    return hybrid_decrypt_v1(self, secret)
+
+
+def seal_chunked(
+    self,
+    message: bytes,
+    content_type: str,
+    peer_pubkey=None,
+    chunk_size: int = RESULT_CHUNK_BYTES,
+) -> str:
+    """
+    Seals message as a chunked v2 envelope, the format large results use.
+    All chunks share one HPKE context, so their order is authenticated.
+    """
+    codec, message = compress_payload(message)
+    encap, ctx = self.suite.setup_send(peer_pubkey or self.sn_pubkey, b"")
+    view = memoryview(message)
+    chunks = []
+    for start in range(0, max(len(view), 1), chunk_size):
+        last = start + chunk_size >= len(view)
+        chunk = ctx.aead.seal(_CHUNK_AAD[last], bytes(view[start:start + chunk_size]))
+        chunks.append(base64.b64encode(chunk).decode("ascii"))
+    secret = {
+        "v": 2,
+        "contentType": content_type,
+        "encapsulatedKey": base64.b64encode(encap).decode("ascii"),
+        "chunks": chunks,
+    }
+    if codec is not None:
+        secret["z"] = codec
+    return json.dumps(secret, separators=(",", ":"))
+
+
+def open_chunked(self, data: dict) -> bytearray:
+    """Opens a chunked v2 envelope one chunk at a time into a single buffer"""
+    ctx = self.suite.setup_recv(
+        base64.b64decode(data["encapsulatedKey"]), self.skey, b""
+    )
+    decompressor = _decompressor(data.get("z"))
+    chunks = data["chunks"]
+    out = bytearray()
+    for i, chunk in enumerate(chunks):
+        plain = ctx.aead.open(_CHUNK_AAD[i == len(chunks) - 1], base64.b64decode(chunk))
+        out += decompressor.decompress(plain) if decompressor is not None else plain
+    if decompressor is not None and hasattr(decompressor, "flush"):
+        out += decompressor.flush()
+    return out
+
+
+def decode_content(content_type: str, payload):
+    """Decodes a plaintext buffer by its content type, without copying it first"""
+    if content_type == "application/json":
+        return json.loads(payload)
+    if content_type == "application/x-dill":
+        return dill.loads(payload)
+    if content_type == "text/plain":
+        return codecs.decode(payload, "utf-8")
+    if content_type == "application/octet-stream":
+        return bytes(payload)
+    raise ValueError(f"Unsupported result content type: {content_type}")
+
+
+def open_result_envelope(self, data: dict):
+    """Decrypts and decodes a v2 result envelope that names its content type"""
+    if "chunks" in data:
+        payload = open_chunked(self, data)
+    else:
+        payload = hybrid_decrypt_v2(self, data)
+    return decode_content(data["contentType"], payload)
+
+
+def open_result(self, secret, decode):
+    """Decrypts a posted result: by content type for typed v2 envelopes, else through decode"""
+    data = secret
+    if isinstance(data, str) and '"contentType"' in data:
+        data = json.loads(data)
+    if isinstance(data, dict) and "contentType" in data:
+        return open_result_envelope(self, data)
+    return decode(hybrid_decrypt(self, secret))
@@ -0,0 +1,133 @@
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from nectarpy.common.rpc import pinned
+
+
+def event_topics(contract, event_names: list) -> dict:
+    """Maps the topic0 hex of each named event in the contract ABI to its name"""
+    topics = {}
+    for item in contract.abi:
+        if item.get("type") == "event" and item.get("name") in event_names:
+            topics[Web3.to_hex(event_abi_to_log_topic(item))] = item["name"]
+    missing = set(event_names) - set(topics.values())
+    if missing:
+        raise ValueError(f"Events not found in contract ABI: {sorted(missing)}")
+    return topics
+
+
+def decode_log(contract, topics: dict, log):
+    """Decodes a raw log whose topic0 is in topics, otherwise returns None"""
+    topic = log["topics"][0]
+    if not isinstance(topic, str):
+        topic = Web3.to_hex(topic)
+    name = topics.get(topic.lower())
+    if name is None:
+        return None
+    return getattr(contract.events, name)().process_log(log)
+
+
+class EventWatcher:
+    """Follows contract events through a log filter, falling back to eth_getLogs"""
+
+    def __init__(self, web3, contract, event_names: list, from_block=None):
+        self.web3 = web3
+        self.contract = contract
+        self.topics = event_topics(contract, event_names)
+        if from_block is None:
+            from_block = self.web3.eth.block_number
+        self.next_block = from_block
+        self._filter = None
+        try:
+            self._filter = self.web3.eth.filter(self._filter_params(from_block))
+        except Exception as e:
+            print("log filter unavailable, using eth_getLogs:", e)
+
+    def _filter_params(self, from_block, to_block=None) -> dict:
+        params = {
+            "address": self.contract.address,
+            "topics": [list(self.topics)],
+            "fromBlock": from_block,
+        }
+        if to_block is not None:
+            params["toBlock"] = to_block
+        return params
+
+    def _decode(self, log):
+        return decode_log(self.contract, self.topics, log)
+
+    def _fetch_logs(self) -> list:
+        if self._filter is not None:
+            try:
+                logs = self._filter.get_new_entries()
+            except Exception as e:
+                # Filters expire on most public nodes after a few minutes idle;
+                # resume after the last block seen, callers must tolerate repeats.
+                print("log filter lost, using eth_getLogs:", e)
+                self._filter = None
+            else:
+                # The filter delivers blocks in order, so everything up to the
+                # newest log's block has been seen.
+                if logs:
+                    seen = max(log["blockNumber"] for log in logs)
+                    self.next_block = max(self.next_block, seen + 1)
+                return logs
+        # A node that lags behind the head it reported would skip blocks for good.
+        with pinned(self.web3):
+            latest = self.web3.eth.block_number
+            if latest < self.next_block:
+                return []
+            logs = self.web3.eth.get_logs(self._filter_params(self.next_block, latest))
+        self.next_block = latest + 1
+        return logs
+
+    def poll(self) -> list:
+        """Returns the events emitted since the previous poll"""
+        events = []
+        for log in self._fetch_logs():
+            event = self._decode(log)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def uninstall(self):
+        """Removes the node-side log filter, if any"""
+        if self._filter is None:
+            return
+        try:
+            self.web3.eth.uninstall_filter(self._filter.filter_id)
+        except Exception:
+            pass
+        self._filter = None
+
+
+class AsyncEventWatcher:
+    """EventWatcher counterpart for AsyncWeb3 clients, polling with eth_getLogs"""
+
+    def __init__(self, web3, contract, event_names: list, from_block=None):
+        self.web3 = web3
+        self.contract = contract
+        self.topics = event_topics(contract, event_names)
+        self.next_block = from_block
+
+    async def poll(self) -> list:
+        """Returns the events emitted since the previous poll"""
+        latest = await self.web3.eth.block_number
+        if self.next_block is None:
+            self.next_block = latest
+        if latest < self.next_block:
+            return []
+        logs = await self.web3.eth.get_logs(
+            {
+                "address": self.contract.address,
+                "topics": [list(self.topics)],
+                "fromBlock": self.next_block,
+                "toBlock": latest,
+            }
+        )
+        self.next_block = latest + 1
+        events = []
+        for log in logs:
+            event = decode_log(self.contract, self.topics, log)
+            if event is not None:
+                events.append(event)
+        return events
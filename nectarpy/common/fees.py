@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+
+# Writes whose gas use does not depend on their arguments; their estimate is
+# reused for later calls from the same account.
+FIXED_SHAPE_FUNCTIONS = {"approve", "deactivatePolicy"}
+# Head-room over a memoized estimate: a proportional margin, plus the cost of
+# a storage slot going from zero to non-zero (e.g. approving from a spent
+# allowance after estimating with a remaining one).
+GAS_LIMIT_MARGIN = 1.2
+GAS_LIMIT_HEADROOM = 20_000
+
+
+def _fee_ttl() -> float:
+    return float(os.getenv("NECTAR_FEE_TTL", "6"))
+
+
+class FeeOracle:
+    """
+    Fills in the fee, gas and chain id fields of transactions from local caches.
+
+    EIP-1559 fees are read at most once per fee_ttl seconds, about one block
+    on Moonbeam. maxFeePerGas allows the base fee to double, so a cached
+    estimate stays valid for several blocks. Chains without a base fee get a
+    cached legacy gasPrice instead.
+    """
+
+    def __init__(self, web3, chain_id: int = None, fee_ttl: float = None):
+        self.web3 = web3
+        self.chain_id = chain_id
+        self.fee_ttl = _fee_ttl() if fee_ttl is None else fee_ttl
+        self._fees = None
+        self._fees_at = 0.0
+        self._gas_limits = {}
+        self._block_gas_limit = None
+        self._lock = threading.Lock()
+
+    def _read_fees(self) -> dict:
+        block = self.web3.eth.get_block("latest")
+        self._block_gas_limit = block.get("gasLimit", self._block_gas_limit)
+        base_fee = block.get("baseFeePerGas")
+        if base_fee is None:
+            return {"gasPrice": self.web3.eth.gas_price}
+        priority = self.web3.eth.max_priority_fee
+        return {
+            "maxFeePerGas": 2 * base_fee + priority,
+            "maxPriorityFeePerGas": priority,
+        }
+
+    def fees(self) -> dict:
+        """Returns the cached fee fields, refreshing them once they are older than fee_ttl"""
+        with self._lock:
+            if self._fees is None or time.monotonic() - self._fees_at >= self.fee_ttl:
+                self._fees = self._read_fees()
+                self._fees_at = time.monotonic()
+            return dict(self._fees)
+
+    def invalidate(self):
+        """Drops the cached fees, e.g. after a transaction was rejected as underpriced"""
+        with self._lock:
+            self._fees = None
+
+    def block_gas_limit(self) -> int:
+        """Returns the gas limit of a recent block, read once and then kept"""
+        if self._block_gas_limit is None:
+            self._block_gas_limit = self.web3.eth.get_block("latest")["gasLimit"]
+        return self._block_gas_limit
+
+    def gas_limit(self, contract_fn, sender: str):
+        """Returns a memoized gas limit for fixed-shape calls, otherwise None"""
+        if contract_fn.fn_name not in FIXED_SHAPE_FUNCTIONS:
+            return None
+        key = (contract_fn.address, contract_fn.fn_name, sender)
+        with self._lock:
+            limit = self._gas_limits.get(key)
+        if limit is None:
+            estimate = contract_fn.estimate_gas({"from": sender})
+            limit = int(estimate * GAS_LIMIT_MARGIN) + GAS_LIMIT_HEADROOM
+            with self._lock:
+                self._gas_limits[key] = limit
+        return limit
+
+    def tx_params(self, contract_fn, sender: str, tx_params: dict = None) -> dict:
+        """Returns tx_params completed with cached fees, chain id and gas limit"""
+        params = dict(tx_params or {})
+        if "gasPrice" not in params and "maxFeePerGas" not in params:
+            try:
+                params.update(self.fees())
+            except Exception as e:
+                print("fee estimate failed, leaving fees to web3:", e)
+        if self.chain_id is not None:
+            params.setdefault("chainId", self.chain_id)
+        if "gas" not in params:
+            limit = self.gas_limit(contract_fn, sender)
+            if limit is not None:
+                params["gas"] = limit
+        return params
+
+
+class AsyncFeeOracle(FeeOracle):
+    """
+    FeeOracle counterpart for AsyncWeb3 clients.
+
+    Node reads are awaited outside the lock, so concurrent sends that find
+    the cache stale may each refresh it once.
+    """
+
+    async def _read_fees(self) -> dict:
+        block = await self.web3.eth.get_block("latest")
+        self._block_gas_limit = block.get("gasLimit", self._block_gas_limit)
+        base_fee = block.get("baseFeePerGas")
+        if base_fee is None:
+            return {"gasPrice": await self.web3.eth.gas_price}
+        priority = await self.web3.eth.max_priority_fee
+        return {
+            "maxFeePerGas": 2 * base_fee + priority,
+            "maxPriorityFeePerGas": priority,
+        }
+
+    async def fees(self) -> dict:
+        """Returns the cached fee fields, refreshing them once they are older than fee_ttl"""
+        with self._lock:
+            fees, fees_at = self._fees, self._fees_at
+        if fees is None or time.monotonic() - fees_at >= self.fee_ttl:
+            fees = await self._read_fees()
+            with self._lock:
+                self._fees = fees
+                self._fees_at = time.monotonic()
+        return dict(fees)
+
+    async def block_gas_limit(self) -> int:
+        """Returns the gas limit of a recent block, read once and then kept"""
+        if self._block_gas_limit is None:
+            block = await self.web3.eth.get_block("latest")
+            self._block_gas_limit = block["gasLimit"]
+        return self._block_gas_limit
+
+    async def gas_limit(self, contract_fn, sender: str):
+        """Returns a memoized gas limit for fixed-shape calls, otherwise None"""
+        if contract_fn.fn_name not in FIXED_SHAPE_FUNCTIONS:
+            return None
+        key = (contract_fn.address, contract_fn.fn_name, sender)
+        with self._lock:
+            limit = self._gas_limits.get(key)
+        if limit is None:
+            estimate = await contract_fn.estimate_gas({"from": sender})
+            limit = int(estimate * GAS_LIMIT_MARGIN) + GAS_LIMIT_HEADROOM
+            with self._lock:
+                self._gas_limits[key] = limit
+        return limit
+
+    async def tx_params(self, contract_fn, sender: str, tx_params: dict = None) -> dict:
+        """Returns tx_params completed with cached fees, chain id and gas limit"""
+        params = dict(tx_params or {})
+        if "gasPrice" not in params and "maxFeePerGas" not in params:
+            try:
+                params.update(await self.fees())
+            except Exception as e:
+                print("fee estimate failed, leaving fees to web3:", e)
+        if self.chain_id is not None:
+            params.setdefault("chainId", self.chain_id)
+        if "gas" not in params:
+            limit = await self.gas_limit(contract_fn, sender)
+            if limit is not None:
+                params["gas"] = limit
+        return params
+
+
+def chain_id_from_config(blockchain: dict):
+    """Reads the chain id of a blockchain.json network entry, if present"""
+    chain_id = blockchain.get("chainId")
+    if chain_id is None:
+        return None
+    return int(chain_id, 16) if isinstance(chain_id, str) else int(chain_id)
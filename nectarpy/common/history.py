@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import threading
+import warnings
+from datetime import datetime
+from web3 import Web3
+from nectarpy.common.batch import batch_call, block_timestamps
+from nectarpy.common.events import decode_log, event_topics
+from nectarpy.common.rpc import pinned
+
+HISTORY_EVENTS = ["PaidQuery", "SuccessfulQuery", "RefundQuery"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query_index INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    status TEXT NOT NULL,
+    paid TEXT,
+    refunded TEXT,
+    paid_block INTEGER,
+    paid_at INTEGER,
+    settled_block INTEGER,
+    settled_at INTEGER,
+    tx_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS query_buckets (
+    query_index INTEGER NOT NULL,
+    bucket_id TEXT NOT NULL,
+    policy_index INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS query_buckets_bucket ON query_buckets (bucket_id);
+CREATE INDEX IF NOT EXISTS queries_paid_at ON queries (paid_at);
+CREATE TABLE IF NOT EXISTS sync_checkpoint (
+    contract TEXT NOT NULL,
+    user TEXT NOT NULL,
+    next_block INTEGER NOT NULL,
+    PRIMARY KEY (contract, user)
+);
+"""
+
+_STATUS = {"SuccessfulQuery": "succeeded", "RefundQuery": "refunded"}
+
+
+def _log_range() -> int:
+    return int(os.getenv("NECTAR_LOG_RANGE", "2000"))
+
+
+def deployment_block(web3, address: str) -> int:
+    """
+    Finds the block a contract was deployed in by bisecting eth_getCode,
+    which needs a node serving historical state. Warns and returns 0 when
+    the node cannot, so the caller scans from genesis.
+    """
+    try:
+        low, high = 0, web3.eth.block_number
+        if not web3.eth.get_code(address, high):
+            raise ValueError(f"no contract code at {address}")
+        while low < high:
+            middle = (low + high) // 2
+            if web3.eth.get_code(address, middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+    except Exception as e:
+        warnings.warn(
+            f"cannot find the deployment block of {address}, scanning from"
+            f" genesis; set queryManagerBlock in blockchain.json to avoid it: {e}",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+        return 0
+
+
+def _timestamp(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    raise TypeError(f"Expected a datetime or unix time, got {type(value).__name__}")
+
+
+class QueryHistory:
+    """
+    Local SQLite index of QueryManager payments and settlements.
+
+    sync() ingests PaidQuery, SuccessfulQuery and RefundQuery logs from the
+    last checkpointed block, so later lookups never scan the chain. Only
+    queries paid by user are kept, unless user is None. Amounts are stored
+    as decimal strings since they are uint256 on-chain. A new index starts
+    at start_block, or at the QueryManager deployment block when it is None.
+    """
+
+    def __init__(
+        self,
+        web3,
+        query_manager,
+        path,
+        user: str = None,
+        start_block: int = None,
+        confirmations: int = 0,
+    ):
+        self.web3 = web3
+        self.query_manager = query_manager
+        self.user = user
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.topics = event_topics(query_manager, HISTORY_EVENTS)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database"""
+        self._db.close()
+
+    @property
+    def _checkpoint_key(self) -> tuple:
+        # Indexes of different users can share one file, each with its own progress.
+        return self.query_manager.address, (self.user or "").lower()
+
+    @property
+    def next_block(self) -> int:
+        """First block the next sync will read"""
+        row = self._db.execute(
+            "SELECT next_block FROM sync_checkpoint WHERE contract = ? AND user = ?",
+            self._checkpoint_key,
+        ).fetchone()
+        if row is not None:
+            return row["next_block"]
+        if self.start_block is None:
+            self.start_block = deployment_block(self.web3, self.query_manager.address)
+        return self.start_block
+
+    def _mine(self, args) -> bool:
+        return self.user is None or args["user"].lower() == self.user.lower()
+
+    def _ingest(self, events: list, to_block: int):
+        paid = [e for e in events if e["event"] == "PaidQuery"]
+        # Bucket and policy ids are not in the event, read them in one batch.
+        details = batch_call(
+            self.web3,
+            [
+                self.query_manager.functions.getQuery(e["args"]["queryIndex"])
+                for e in paid
+            ],
+        )
+        times = block_timestamps(self.web3, {e["blockNumber"] for e in events})
+        with self._db:
+            for event, query in zip(paid, details):
+                args = event["args"]
+                self._db.execute(
+                    "INSERT OR IGNORE INTO queries (query_index, user, status,"
+                    " paid, paid_block, paid_at, tx_hash)"
+                    " VALUES (?, ?, 'paid', ?, ?, ?, ?)",
+                    (
+                        args["queryIndex"],
+                        args["user"],
+                        str(args["value"]),
+                        event["blockNumber"],
+                        times[event["blockNumber"]],
+                        Web3.to_hex(event["transactionHash"]),
+                    ),
+                )
+                self._db.execute(
+                    "DELETE FROM query_buckets WHERE query_index = ?",
+                    (args["queryIndex"],),
+                )
+                self._db.executemany(
+                    "INSERT INTO query_buckets VALUES (?, ?, ?)",
+                    [
+                        (args["queryIndex"], str(bucket_id), policy_index)
+                        for bucket_id, policy_index in zip(query[5], query[6])
+                    ],
+                )
+            for event in events:
+                if event["event"] not in _STATUS:
+                    continue
+                args = event["args"]
+                # Settlements of queries paid before start_block get a partial row.
+                self._db.execute(
+                    "INSERT OR IGNORE INTO queries (query_index, user, status)"
+                    " VALUES (?, ?, 'paid')",
+                    (args["queryIndex"], args["user"]),
+                )
+                self._db.execute(
+                    "UPDATE queries SET status = ?, settled_block = ?, settled_at = ?,"
+                    " refunded = ? WHERE query_index = ?",
+                    (
+                        _STATUS[event["event"]],
+                        event["blockNumber"],
+                        times[event["blockNumber"]],
+                        str(args["value"]) if "value" in args else None,
+                        args["queryIndex"],
+                    ),
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_checkpoint VALUES (?, ?, ?)",
+                (*self._checkpoint_key, to_block + 1),
+            )
+
+    def sync(self) -> int:
+        """Ingests logs up to the latest confirmed block and returns how many were new"""
+        with self._lock, pinned(self.web3):
+            latest = self.web3.eth.block_number - self.confirmations
+            start = self.next_block
+            count = 0
+            while start <= latest:
+                end = min(start + _log_range() - 1, latest)
+                logs = self.web3.eth.get_logs(
+                    {
+                        "address": self.query_manager.address,
+                        "topics": [list(self.topics)],
+                        "fromBlock": start,
+                        "toBlock": end,
+                    }
+                )
+                events = [decode_log(self.query_manager, self.topics, log) for log in logs]
+                events = [e for e in events if e is not None and self._mine(e["args"])]
+                # Each range commits with its checkpoint, so a crash resumes cleanly.
+                self._ingest(events, end)
+                count += len(events)
+                start = end + 1
+            return count
+
+    def queries(
+        self,
+        bucket_id: int = None,
+        since=None,
+        until=None,
+        status: str = None,
+        user: str = None,
+    ) -> list:
+        """
+        Returns indexed queries, oldest first, filtered by bucket, payment time
+        (datetime or unix time, until is exclusive), status ("paid",
+        "succeeded" or "refunded") and paying user
+        """
+        clauses, params = [], []
+        if bucket_id is not None:
+            clauses.append(
+                "query_index IN (SELECT query_index FROM query_buckets WHERE bucket_id = ?)"
+            )
+            params.append(str(bucket_id))
+        if since is not None:
+            clauses.append("paid_at >= ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            clauses.append("paid_at < ?")
+            params.append(_timestamp(until))
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if user is not None:
+            clauses.append("lower(user) = ?")
+            params.append(user.lower())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM queries{where} ORDER BY query_index", params
+            ).fetchall()
+            return [self._row(row) for row in rows]
+
+    def pending(self) -> list:
+        """Paid queries without a result or refund yet, e.g. to resume after a crash"""
+        return self.queries(status="paid")
+
+    def _row(self, row) -> dict:
+        query = dict(row)
+        for key in ("paid", "refunded"):
+            if query[key] is not None:
+                query[key] = int(query[key])
+        buckets = self._db.execute(
+            "SELECT bucket_id, policy_index FROM query_buckets WHERE query_index = ?"
+            " ORDER BY rowid",
+            (row["query_index"],),
+        ).fetchall()
+        query["bucket_ids"] = [int(b["bucket_id"]) for b in buckets]
+        query["policy_indexes"] = [b["policy_index"] for b in buckets]
+        return query
@@ -0,0 +1,162 @@
+import copy
+import time
+import threading
+from nectarpy.common.batch import batch_call
+from nectarpy.common.events import EventWatcher
+from nectarpy.common.metadata import (
+    _bucket_calls,
+    _bucket_rows,
+    _policy_calls,
+    _policy_rows,
+)
+
+INVENTORY_EVENTS = [
+    "BucketAdded",
+    "PolicyAdded",
+    "PolicyAddedToBucket",
+    "BucketDeactivated",
+    "PolicyDeactivated",
+    "PolicyIdentityDisclosureOperationsUpdated",
+    "AddressAddedToPolicy",
+]
+
+
+class Inventory:
+    """
+    Local copy of every bucket and policy a Data Owner has on-chain.
+
+    The first sync loads everything with batched reads. Later syncs follow
+    EoaBond events and re-read only the buckets and policies they name, or
+    reload everything if the events cannot be followed.
+    """
+
+    def __init__(self, client, event_poll: float = 6):
+        self.client = client
+        self.owner = client.account["address"]
+        self.event_poll = event_poll
+        self.with_disclosure_operations = client._contract_supports_function(
+            "getIdentityDisclosureOperations", arg_count=1
+        )
+        self.buckets = {}
+        self.policies = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._last_poll = None
+
+    def _read_buckets(self, bucket_ids: list) -> list:
+        results = batch_call(self.client.web3, _bucket_calls(self.client, bucket_ids))
+        return _bucket_rows(bucket_ids, results)
+
+    def _read_policies(self, policy_ids: list) -> list:
+        results = batch_call(
+            self.client.web3,
+            _policy_calls(self.client, policy_ids, self.with_disclosure_operations),
+        )
+        policies = _policy_rows(policy_ids, results, self.with_disclosure_operations)
+        for policy in policies:
+            policy.setdefault("identity_disclosure_operations", [])
+        return policies
+
+    def _store(self, buckets: list, policies: list):
+        self.buckets.update((b["bucket_id"], b) for b in buckets)
+        self.policies.update((p["policy_id"], p) for p in policies)
+
+    def reload(self):
+        """Reads the full inventory again and restarts event following"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        eoa_bond = self.client.EoaBond
+        if self._watcher is not None:
+            self._watcher.uninstall()
+        # Watch from the snapshot block, so nothing between the reads and the
+        # first poll is missed; events seen twice only cause a re-read.
+        self._watcher = None
+        try:
+            self._watcher = EventWatcher(self.client.web3, eoa_bond, INVENTORY_EVENTS)
+        except Exception as e:
+            print("inventory events unavailable, reloading on every sync:", e)
+        call = {"from": self.owner}
+        bucket_ids = eoa_bond.functions.getAllBucketIdsByOwner().call(call)
+        policy_ids = eoa_bond.functions.getPolicyIdByOwner().call(call)
+        self.buckets.clear()
+        self.policies.clear()
+        self._store(
+            self._read_buckets(list(dict.fromkeys(bucket_ids))),
+            self._read_policies(list(dict.fromkeys(policy_ids))),
+        )
+        self._last_poll = time.monotonic()
+
+    def _is_mine(self, args) -> bool:
+        return args["owner"].lower() == self.owner.lower()
+
+    def _apply(self, events: list):
+        buckets, policies = set(), set()
+        for event in events:
+            name, args = event["event"], event["args"]
+            if name == "BucketDeactivated":
+                if args["bucketId"] in self.buckets:
+                    self.buckets[args["bucketId"]]["deactivated"] = True
+            elif name == "PolicyDeactivated":
+                if args["policyId"] in self.policies:
+                    self.policies[args["policyId"]]["deactivated"] = True
+            elif name == "BucketAdded":
+                if self._is_mine(args):
+                    buckets.add(args["bucketId"])
+            elif name == "PolicyAdded":
+                if self._is_mine(args):
+                    policies.add(args["policyId"])
+            elif name == "PolicyAddedToBucket":
+                if args["bucketId"] in self.buckets:
+                    buckets.add(args["bucketId"])
+            elif args["policyId"] in self.policies:
+                policies.add(args["policyId"])
+        if buckets or policies:
+            self._store(self._read_buckets(list(buckets)), self._read_policies(list(policies)))
+
+    def sync(self):
+        """Loads the inventory on first use, then applies events seen since the last sync"""
+        with self._lock:
+            if self._last_poll is None:
+                self._reload()
+                return
+            if time.monotonic() - self._last_poll < self.event_poll:
+                return
+            if self._watcher is None:
+                self._reload()
+                return
+            self._last_poll = time.monotonic()
+            try:
+                events = self._watcher.poll()
+            except Exception as e:
+                print("inventory event polling failed, reloading:", e)
+                self._reload()
+                return
+            self._apply(events)
+
+    def list_buckets(self, include_deactivated: bool = False, policy_id: int = None) -> list:
+        """Returns the owner's buckets, optionally only those using policy_id"""
+        self.sync()
+        with self._lock:
+            return [
+                copy.deepcopy(b)
+                for b in self.buckets.values()
+                if (include_deactivated or not b["deactivated"])
+                and (policy_id is None or policy_id in b["policy_ids"])
+            ]
+
+    def list_policies(self, include_deactivated: bool = False, bucket_id: int = None) -> list:
+        """Returns the owner's policies, optionally only those attached to bucket_id"""
+        self.sync()
+        with self._lock:
+            attached = None
+            if bucket_id is not None:
+                bucket = self.buckets.get(bucket_id)
+                attached = set(bucket["policy_ids"]) if bucket is not None else set()
+            return [
+                copy.deepcopy(p)
+                for p in self.policies.values()
+                if (include_deactivated or not p["deactivated"])
+                and (attached is None or p["policy_id"] in attached)
+            ]
@@ -0,0 +1,225 @@
+import copy
+import time
+import threading
+from nectarpy.common.batch import async_batch_call, batch_call
+from nectarpy.common.cache import TTLCache
+from nectarpy.common.events import EventWatcher
+
+INVALIDATING_EVENTS = [
+    "PolicyDeactivated",
+    "PolicyIdentityDisclosureOperationsUpdated",
+    "BucketDeactivated",
+    "PolicyAddedToBucket",
+]
+
+
+class MetadataCache:
+    """Caches policy and bucket reads, dropping entries named by EoaBond events"""
+
+    def __init__(
+        self,
+        web3,
+        eoa_bond,
+        ttl: float = 300,
+        maxsize: int = 1024,
+        event_poll: float = 6,
+    ):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.event_poll = event_poll
+        self._lock = threading.Lock()
+        self._last_poll = time.monotonic()
+        self._watcher = None
+        try:
+            self._watcher = EventWatcher(web3, eoa_bond, INVALIDATING_EVENTS)
+        except Exception as e:
+            print("metadata cache events unavailable, relying on ttl:", e)
+
+    def sync(self):
+        """Applies invalidation events seen since the last sync"""
+        with self._lock:
+            if self._watcher is None:
+                return
+            if time.monotonic() - self._last_poll < self.event_poll:
+                return
+            self._last_poll = time.monotonic()
+            try:
+                events = self._watcher.poll()
+            except Exception as e:
+                print("metadata cache event polling failed, relying on ttl:", e)
+                self._watcher = None
+                self.entries.clear()
+                return
+        for event in events:
+            args = event["args"]
+            if "policyId" in args:
+                self.invalidate_policy(args["policyId"])
+            if "bucketId" in args:
+                self.invalidate_bucket(args["bucketId"])
+
+    def get(self, key):
+        self.sync()
+        return copy.deepcopy(self.entries.get(key))
+
+    def set(self, key, value):
+        self.entries.set(key, copy.deepcopy(value))
+
+    def invalidate_policy(self, policy_id: int):
+        self.entries.pop(("policy", policy_id, False))
+        self.entries.pop(("policy", policy_id, True))
+
+    def invalidate_bucket(self, bucket_id: int):
+        self.entries.pop(("bucket", bucket_id))
+        self.entries.pop(("bucket_policy_ids", bucket_id))
+
+    def clear(self):
+        self.entries.clear()
+
+
+def _cached(self, keys: list, fetch) -> list:
+    """Returns values for keys, fetching only cache misses through fetch(missing_keys)"""
+    cache = getattr(self, "metadata_cache", None)
+    unique_keys = list(dict.fromkeys(keys))
+    values = {}
+    if cache is not None:
+        for k in unique_keys:
+            v = cache.get(k)
+            if v is not None:
+                values[k] = v
+    missing = [k for k in unique_keys if k not in values]
+    if missing:
+        for k, v in zip(missing, fetch(missing)):
+            if cache is not None and not isinstance(v, Exception):
+                cache.set(k, v)
+            values[k] = v
+    return [values[k] for k in keys]
+
+
+def _policy_calls(self, policy_ids: list, with_disclosure_operations: bool) -> list:
+    fns = self.EoaBond.functions
+    calls = []
+    for policy_id in policy_ids:
+        calls += [
+            fns.policies(policy_id),
+            fns.getAllowedCategories(policy_id),
+            fns.getAllowedAddresses(policy_id),
+            fns.getAllowedColumns(policy_id),
+        ]
+        if with_disclosure_operations:
+            calls.append(fns.getIdentityDisclosureOperations(policy_id))
+    return calls
+
+
+def _policy_rows(policy_ids: list, results: list, with_disclosure_operations: bool) -> list:
+    step = 5 if with_disclosure_operations else 4
+    policies = []
+    for i, policy_id in enumerate(policy_ids):
+        row = results[i * step : (i + 1) * step]
+        policy_data = row[0]
+        policy = {
+            "policy_id": policy_id,
+            "allowed_categories": row[1],
+            "allowed_addresses": row[2],
+            "allowed_columns": row[3],
+            "exp_date": policy_data[0],
+            "price": policy_data[1],
+            "owner": policy_data[2],
+            "deactivated": policy_data[3],
+        }
+        if with_disclosure_operations:
+            policy["identity_disclosure_operations"] = row[4]
+        policies.append(policy)
+    return policies
+
+
+def _bucket_calls(self, bucket_ids: list) -> list:
+    fns = self.EoaBond.functions
+    calls = []
+    for bucket_id in bucket_ids:
+        calls += [fns.buckets(bucket_id), fns.getPolicyIds(bucket_id)]
+    return calls
+
+
+def _bucket_rows(bucket_ids: list, results: list) -> list:
+    buckets = []
+    for i, bucket_id in enumerate(bucket_ids):
+        bucket_data, policy_ids = results[2 * i], results[2 * i + 1]
+        buckets.append(
+            {
+                "bucket_id": bucket_id,
+                "policy_ids": policy_ids,
+                "data_format": bucket_data[0],
+                "node_address": bucket_data[1],
+                "owner": bucket_data[2],
+                "deactivated": bucket_data[3],
+            }
+        )
+    return buckets
+
+
+def get_bucket_policy_ids(self, bucket_ids: list, return_exceptions: bool = False) -> list:
+    """Fetches the policy id list of every bucket in one batched round-trip"""
+
+    def fetch(keys):
+        return batch_call(
+            getattr(self, "web3", None),
+            [self.EoaBond.functions.getPolicyIds(k[1]) for k in keys],
+            return_exceptions=return_exceptions,
+        )
+
+    return _cached(self, [("bucket_policy_ids", b) for b in bucket_ids], fetch)
+
+
+def read_policies(self, policy_ids: list, with_disclosure_operations: bool = False) -> list:
+    """Fetches several policies in one batched round-trip"""
+
+    def fetch(keys):
+        ids = [k[1] for k in keys]
+        results = batch_call(
+            getattr(self, "web3", None),
+            _policy_calls(self, ids, with_disclosure_operations),
+        )
+        return _policy_rows(ids, results, with_disclosure_operations)
+
+    keys = [("policy", p, with_disclosure_operations) for p in policy_ids]
+    return _cached(self, keys, fetch)
+
+
+def read_buckets(self, bucket_ids: list) -> list:
+    """Fetches several buckets in one batched round-trip"""
+
+    def fetch(keys):
+        ids = [k[1] for k in keys]
+        results = batch_call(getattr(self, "web3", None), _bucket_calls(self, ids))
+        return _bucket_rows(ids, results)
+
+    return _cached(self, [("bucket", b) for b in bucket_ids], fetch)
+
+
+async def async_get_bucket_policy_ids(
+    self, bucket_ids: list, return_exceptions: bool = False
+) -> list:
+    """get_bucket_policy_ids counterpart for AsyncWeb3 clients"""
+    unique_ids = list(dict.fromkeys(bucket_ids))
+    results = await async_batch_call(
+        self.web3,
+        [self.EoaBond.functions.getPolicyIds(b) for b in unique_ids],
+        return_exceptions=return_exceptions,
+    )
+    by_bucket = dict(zip(unique_ids, results))
+    return [by_bucket[b] for b in bucket_ids]
+
+
+async def async_read_policies(
+    self, policy_ids: list, with_disclosure_operations: bool = False
+) -> list:
+    """read_policies counterpart for AsyncWeb3 clients"""
+    results = await async_batch_call(
+        self.web3, _policy_calls(self, policy_ids, with_disclosure_operations)
+    )
+    return _policy_rows(policy_ids, results, with_disclosure_operations)
+
+
+async def async_read_buckets(self, bucket_ids: list) -> list:
+    """read_buckets counterpart for AsyncWeb3 clients"""
+    results = await async_batch_call(self.web3, _bucket_calls(self, bucket_ids))
+    return _bucket_rows(bucket_ids, results)
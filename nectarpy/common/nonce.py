@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+NONCE_ERROR_MARKERS = (
+    "nonce too low",
+    "nonce too high",
+    "invalid nonce",
+    "replacement transaction underpriced",
+)
+# The node already has this exact transaction; its nonce is taken by it.
+ALREADY_SENT_MARKERS = ("already known", "known transaction", "already imported")
+
+
+def is_nonce_error(exc: Exception) -> bool:
+    """Whether a send failure means the local nonce is out of step with the node"""
+    message = str(exc).lower()
+    return any(marker in message for marker in NONCE_ERROR_MARKERS)
+
+
+def is_already_sent(exc: Exception) -> bool:
+    """Whether a send failure means the node already has the transaction"""
+    message = str(exc).lower()
+    return any(marker in message for marker in ALREADY_SENT_MARKERS)
+
+
+class _NonceLedger:
+    """
+    Local nonce bookkeeping shared by NonceManager and AsyncNonceManager.
+
+    Allocated nonces stay outstanding until they are confirmed (broadcast) or
+    released (never sent). A released nonce is handed out again, so a failed
+    send does not leave a gap that stalls the transactions after it.
+    """
+
+    def __init__(self, web3, address: str):
+        self.web3 = web3
+        self.address = address
+        self._next = None
+        self._outstanding = set()
+        self._gaps = set()
+
+    def _take(self, count: int) -> int:
+        if count == 1 and self._gaps:
+            nonce = min(self._gaps)
+            self._gaps.discard(nonce)
+        else:
+            nonce = self._next
+            self._next += count
+        self._outstanding.update(range(nonce, nonce + count))
+        return nonce
+
+    def _confirm(self, nonce: int):
+        self._outstanding.discard(nonce)
+
+    def _release(self, nonce: int):
+        self._outstanding.discard(nonce)
+        if self._next is None or nonce >= self._next:
+            return
+        self._gaps.add(nonce)
+        while self._next - 1 in self._gaps:
+            self._next -= 1
+            self._gaps.discard(self._next)
+
+    def _merge_pending(self, pending: int):
+        # Other nonces are still in flight, so never move the counter back.
+        self._next = pending if self._next is None else max(self._next, pending)
+        self._gaps = {nonce for nonce in self._gaps if nonce >= pending}
+
+
+class NonceManager(_NonceLedger):
+    """Hands out consecutive nonces from memory after a single pending-count sync"""
+
+    def __init__(self, web3, address: str):
+        super().__init__(web3, address)
+        self._lock = threading.Lock()
+
+    def allocate(self, count: int = 1) -> int:
+        """Reserves count consecutive nonces and returns the first one"""
+        with self._lock:
+            if self._next is None:
+                self._next = self.web3.eth.get_transaction_count(
+                    self.address, "pending"
+                )
+            return self._take(count)
+
+    def confirm(self, nonce: int):
+        """Marks an allocated nonce as broadcast"""
+        with self._lock:
+            self._confirm(nonce)
+
+    def release(self, nonce: int):
+        """Returns an allocated nonce that was never broadcast"""
+        with self._lock:
+            self._release(nonce)
+
+    def resync(self):
+        """
+        Re-reads the pending count from the node. While other nonces are
+        outstanding the counter only moves forward, so they are not reused.
+        """
+        with self._lock:
+            if not self._outstanding:
+                self._next = None
+                self._gaps.clear()
+                return
+            self._merge_pending(
+                self.web3.eth.get_transaction_count(self.address, "pending")
+            )
+
+
+class AsyncNonceManager(_NonceLedger):
+    """NonceManager counterpart for AsyncWeb3 clients"""
+
+    def __init__(self, web3, address: str):
+        super().__init__(web3, address)
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, count: int = 1) -> int:
+        """Reserves count consecutive nonces and returns the first one"""
+        async with self._lock:
+            if self._next is None:
+                self._next = await self.web3.eth.get_transaction_count(
+                    self.address, "pending"
+                )
+            return self._take(count)
+
+    def confirm(self, nonce: int):
+        """Marks an allocated nonce as broadcast"""
+        self._confirm(nonce)
+
+    def release(self, nonce: int):
+        """Returns an allocated nonce that was never broadcast"""
+        self._release(nonce)
+
+    async def resync(self):
+        """NonceManager.resync counterpart"""
+        async with self._lock:
+            if not self._outstanding:
+                self._next = None
+                self._gaps.clear()
+                return
+            self._merge_pending(
+                await self.web3.eth.get_transaction_count(self.address, "pending")
+            )
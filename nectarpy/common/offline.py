@@ -0,0 +1,237 @@
+import os
+import json
+import tempfile
+from pathlib import Path
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+from nectarpy.common.batch import _batch_size, _post, _supports_batch
+from nectarpy.common.fees import chain_id_from_config
+from nectarpy.common.nonce import is_already_sent
+from nectarpy.common.transactions import (
+    ADD_BUCKET_BASE_GAS,
+    ADD_BUCKET_GAS_PER_POLICY,
+    _resync_nonce,
+    sign_transaction,
+    wait_for_receipts,
+)
+
+# Gas limits for calls signed without a node to estimate them, as
+# (base, per list element) over the call's list arguments.
+OFFLINE_GAS_LIMITS = {
+    "approve": (100_000, 0),
+    "deactivate_policy": (100_000, 0),
+    "add_policy": (300_000, 50_000),
+    "add_bucket": (ADD_BUCKET_BASE_GAS, ADD_BUCKET_GAS_PER_POLICY),
+}
+
+
+def offline_gas_limit(action: str, contract_fn, gas_limits: dict = None) -> int:
+    """Upper bound on the gas of a call that cannot be estimated"""
+    limits = {**OFFLINE_GAS_LIMITS, **(gas_limits or {})}
+    if action not in limits:
+        raise ValueError(f"No offline gas limit for {action}; pass it in gas_limits")
+    limit = limits[action]
+    if isinstance(limit, int):
+        return limit
+    base, per_item = limit
+    items = sum(len(a) for a in contract_fn.args if isinstance(a, (list, tuple)))
+    return base + per_item * items
+
+
+class SignedBatch:
+    """
+    Transactions built and signed without contacting a node.
+
+    Nonces count up from the given one and every transaction carries the
+    given fee fields, e.g. from FeeOracle.fees() read beforehand. save()
+    writes them as JSON lines that replay_transactions() broadcasts later.
+    """
+
+    def __init__(self, client, nonce: int, fees: dict, gas_limits: dict = None):
+        if not fees:
+            raise ValueError("fees are required to sign offline, e.g. FeeOracle(web3).fees()")
+        self.client = client
+        self.next_nonce = nonce
+        self.fees = dict(fees)
+        self.gas_limits = gas_limits
+        self.chain_id = chain_id_from_config(client.blockchain_config)
+        self.transactions = []
+
+    def sign(self, contract_fn, action: str, tx_params: dict = None) -> str:
+        """Signs a contract call at the next nonce and returns its hash"""
+        params = {**self.fees, **(tx_params or {})}
+        if self.chain_id is not None:
+            params.setdefault("chainId", self.chain_id)
+        if "gas" not in params:
+            params["gas"] = offline_gas_limit(action, contract_fn, self.gas_limits)
+        signed = sign_transaction(self.client, contract_fn, self.next_nonce, params)
+        entry = {
+            "nonce": self.next_nonce,
+            "action": action,
+            "hash": Web3.to_hex(signed.hash),
+            "raw": Web3.to_hex(signed.rawTransaction),
+        }
+        self.transactions.append(entry)
+        self.next_nonce += 1
+        return entry["hash"]
+
+    def _sign_all(self, calls: list) -> list:
+        return [self.sign(fn, action, tx_params) for fn, tx_params, action in calls]
+
+    def save(self, path) -> Path:
+        """Writes the signed transactions to path, one JSON object per line"""
+        path = Path(path)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "w") as file:
+                for entry in self.transactions:
+                    file.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return path
+
+
+class OwnerBatch(SignedBatch):
+    """SignedBatch with the Data Owner write methods of Nectar"""
+
+    def add_policies(self, policies: list) -> list:
+        """Signs addPolicy calls and returns the new policy ids"""
+        policy_ids, calls = self.client._policy_batch(policies)
+        self._sign_all(calls)
+        return policy_ids
+
+    def add_buckets(self, buckets: list) -> list:
+        """Signs addBucket calls and returns the new bucket ids"""
+        bucket_ids, calls = self.client._bucket_batch(buckets)
+        self._sign_all(calls)
+        return bucket_ids
+
+    def provision(self, spec: dict) -> dict:
+        """Signs everything in a Nectar.provision spec and returns the new ids"""
+        created, calls = self.client._provision_calls(spec)
+        self._sign_all(calls)
+        return created
+
+    def deactivate_policy(self, policy_id: int) -> str:
+        """Signs a deactivatePolicy call"""
+        return self.sign(
+            self.client.EoaBond.functions.deactivatePolicy(policy_id), "deactivate_policy"
+        )
+
+
+class AnalystBatch(SignedBatch):
+    """SignedBatch with the Data Analyst write methods of NectarClient"""
+
+    def approve(self, amount: int) -> str:
+        """Signs a USDC approve of amount for the QueryManager"""
+        return self.sign(
+            self.client.USDC.functions.approve(self.client.qm_contract_addr, amount),
+            "approve",
+        )
+
+    def pay_queries(self, queries: list, prices: list, user_index: int) -> list:
+        """
+        Seals and signs payQuery calls for byoc_query argument dicts at the
+        given prices, numbering them from user_index. Returns the user index
+        of each query, for get_result once the batch is replayed.
+        """
+        if len(prices) != len(queries):
+            raise ValueError("prices must have one entry per query")
+        specs = [self.client._query_spec(query) for query in queries]
+        indexes = []
+        for offset, (spec, price) in enumerate(zip(specs, prices)):
+            contract_fn, tx_params = self.client._pay_query_call(
+                spec, price, user_index + offset, offline=True
+            )
+            self.sign(contract_fn, "pay_query", tx_params)
+            indexes.append(user_index + offset)
+        return indexes
+
+
+def load_transactions(path) -> list:
+    """Reads a file written by SignedBatch.save, in nonce order"""
+    with open(path) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    return sorted(entries, key=lambda entry: entry["nonce"])
+
+
+def _broadcast_batch(web3, entries: list) -> list:
+    payload = [
+        {
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "eth_sendRawTransaction",
+            "params": [entry["raw"]],
+        }
+        for i, entry in enumerate(entries)
+    ]
+    raw = _post(web3, json.dumps(payload).encode("utf-8"), "eth_sendRawTransaction")
+    responses = json.loads(raw)
+    if not isinstance(responses, list):
+        raise ValueError(f"RPC endpoint rejected batch request: {responses}")
+    by_id = {r.get("id"): r for r in responses}
+    missing = {"error": "no response in batch"}
+    return [by_id.get(i, missing).get("error") for i in range(len(entries))]
+
+
+def _broadcast_single(web3, entries: list) -> list:
+    errors = []
+    for entry in entries:
+        try:
+            web3.eth.send_raw_transaction(entry["raw"])
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+def _mined(web3, entry: dict, error) -> bool:
+    """Whether a transaction rejected for its nonce was mined by an earlier replay"""
+    if "nonce too low" not in str(error).lower():
+        return False
+    try:
+        web3.eth.get_transaction_receipt(entry["hash"])
+    except TransactionNotFound:
+        return False
+    except Exception as e:
+        print(f"cannot check receipt of {entry['hash']}:", e)
+        return False
+    return True
+
+
+def replay_transactions(self, path, wait: bool = True) -> list:
+    """
+    Broadcasts a file of signed transactions in nonce order, as JSON-RPC
+    batches where the provider allows. Entries the node already has, or that
+    are already mined, count as sent, so a file can be replayed again.
+    Returns the receipts, or the hashes when wait is False.
+    """
+    entries = load_transactions(path)
+    errors = []
+    size = _batch_size()
+    for start in range(0, len(entries), size):
+        chunk = entries[start : start + size]
+        if _supports_batch(self.web3):
+            errors += _broadcast_batch(self.web3, chunk)
+        else:
+            errors += _broadcast_single(self.web3, chunk)
+    # The local nonce counter does not know about replayed transactions.
+    _resync_nonce(self)
+
+    failed = [
+        f"{entry['action']} nonce {entry['nonce']}: {error}"
+        for entry, error in zip(entries, errors)
+        if error is not None
+        and not is_already_sent(error)
+        and not _mined(self.web3, entry, error)
+    ]
+    if failed:
+        raise RuntimeError("Some transactions were not accepted: " + "; ".join(failed))
+    if not wait:
+        return [entry["hash"] for entry in entries]
+    return wait_for_receipts(
+        self, [(HexBytes(entry["hash"]), entry["action"]) for entry in entries]
+    )
@@ -0,0 +1,172 @@
+import time
+import secrets
+from datetime import datetime, timedelta
+from web3 import Web3
+from nectarpy.common.queries import VALID_DISCLOSURE_OPERATIONS
+
+
+def contract_supports_function(
+    self, function_name: str, arg_count: int = None
+) -> bool:
+    """Check function support by ABI when available; default to True for unknown ABI."""
+    contract = getattr(self, "EoaBond", None)
+    abi = getattr(contract, "abi", None)
+    if not isinstance(abi, list):
+        return True
+    for item in abi:
+        if item.get("type") != "function":
+            continue
+        if item.get("name") != function_name:
+            continue
+        if arg_count is None or len(item.get("inputs", [])) == arg_count:
+            return True
+    return False
+
+
+def validate_disclosure_operations(operations: list):
+    for op in operations:
+        if op not in VALID_DISCLOSURE_OPERATIONS:
+            raise ValueError(
+                f"Invalid operation: {op}. "
+                f"Must be one of {VALID_DISCLOSURE_OPERATIONS}"
+            )
+
+
+def prepare_disclosure_operations(self, policy_id: int, operations: list):
+    """Validates operations and returns the setIdentityDisclosureOperations call"""
+    if not contract_supports_function(
+        self, "setIdentityDisclosureOperations", arg_count=2
+    ):
+        raise RuntimeError(
+            "Connected EoaBond ABI does not support setIdentityDisclosureOperations."
+        )
+    validate_disclosure_operations(operations)
+    return self.EoaBond.functions.setIdentityDisclosureOperations(
+        policy_id, operations
+    )
+
+
+def prepare_policy(
+    self,
+    allowed_categories: list,
+    allowed_addresses: list,
+    allowed_columns: list,
+    valid_days: int,
+    usd_price: float,
+    identity_disclosure_operations: list = None,
+) -> tuple:
+    """Validates policy settings, returning (policy_id, addPolicy call, needs setter)"""
+    if len(allowed_addresses) == 0:
+        raise RuntimeError("allowed_addresses check failed.")
+
+    if len(allowed_columns) == 0:
+        raise RuntimeError("allowed_columns check failed.")
+
+    if len(allowed_categories) == 0:
+        raise RuntimeError("allowed_categories check failed.")
+
+    if valid_days <= 0:
+        raise RuntimeError("valid_days must be greater than 0.")
+
+    if usd_price <= 0:
+        raise ValueError("usd_price must be greater than 0.")
+
+    if not isinstance(usd_price, (int, float)):
+        raise TypeError("usd_price is invalid.")
+
+    if identity_disclosure_operations is None:
+        identity_disclosure_operations = []
+
+    validate_disclosure_operations(identity_disclosure_operations)
+
+    price = Web3.to_wei(usd_price, "mwei")
+    policy_id = secrets.randbits(256)
+    edo = datetime.now() + timedelta(days=valid_days)
+    exp_date = int(time.mktime(edo.timetuple()))
+
+    for i in range(len(allowed_addresses)):
+        checksum_address = Web3.to_checksum_address(allowed_addresses[i])
+        allowed_addresses[i] = checksum_address
+
+    supports_add_policy_with_disclosure = contract_supports_function(
+        self, "addPolicy", arg_count=7
+    )
+    supports_set_disclosure = contract_supports_function(
+        self, "setIdentityDisclosureOperations", arg_count=2
+    )
+
+    if (
+        identity_disclosure_operations
+        and not supports_add_policy_with_disclosure
+        and not supports_set_disclosure
+    ):
+        raise RuntimeError(
+            "Connected EoaBond ABI does not support identity disclosure "
+            "operations. Update contract/ABI before using this feature."
+        )
+
+    if supports_add_policy_with_disclosure:
+        add_policy_fn = self.EoaBond.functions.addPolicy(
+            policy_id,
+            allowed_categories,
+            allowed_addresses,
+            allowed_columns,
+            exp_date,
+            price,
+            identity_disclosure_operations,
+        )
+    else:
+        add_policy_fn = self.EoaBond.functions.addPolicy(
+            policy_id,
+            allowed_categories,
+            allowed_addresses,
+            allowed_columns,
+            exp_date,
+            price,
+        )
+    set_disclosure_after = bool(
+        identity_disclosure_operations
+        and not supports_add_policy_with_disclosure
+        and supports_set_disclosure
+    )
+    return policy_id, add_policy_fn, set_disclosure_after
+
+
+def prepare_bucket(
+    self,
+    policy_ids: list,
+    use_allowlists: list,
+    data_format: str,
+    node_address: str,
+) -> tuple:
+    """Validates bucket settings, returning (bucket_id, addBucket call)"""
+    if not isinstance(policy_ids, list) or len(policy_ids) == 0:
+        raise ValueError("policy_ids must be a non-empty list")
+
+    if not isinstance(use_allowlists, list):
+        raise TypeError("use_allowlists must be a list of booleans")
+    for flag in use_allowlists:
+        if not isinstance(flag, bool):
+            raise TypeError(f"Invalid use_allowlists element: {flag}, must be bool")
+
+    if not isinstance(data_format, str) or not data_format.strip():
+        raise ValueError("data_format must be a non-empty string")
+
+    allowed_formats = ["std1"]
+    if data_format not in allowed_formats:
+        raise ValueError(
+            f"Invalid data_format: {data_format}, must be one of {allowed_formats}"
+        )
+
+    if not isinstance(node_address, str) or not node_address.strip():
+        raise ValueError("node_address must be a non-empty string")
+
+    if len(use_allowlists) != len(policy_ids):
+        raise ValueError(
+            f"use_allowlists length ({len(use_allowlists)}) must equal policy_ids length ({len(policy_ids)})"
+        )
+
+    bucket_id = secrets.randbits(256)
+    return bucket_id, self.EoaBond.functions.addBucket(
+        bucket_id, policy_ids, use_allowlists, data_format, node_address
+    )
@@ -0,0 +1,156 @@
+import json
+import dill
+from nectarpy.common import encryption
+from nectarpy.common.blob_store import offload_payload, resolve_payload
+from nectarpy.common.serialization import dumps_function
+
+VALID_DISCLOSURE_OPERATIONS = ["count", "sum", "mean", "min", "max"]
+
+
+def validate_byoc_query(
+    pre_compute_func,
+    main_func,
+    is_separate_data: bool,
+    bucket_ids: list,
+    policy_indexes: list,
+    categorize_by_do: bool,
+    aggregate_type: str,
+):
+    """Checks byoc_query arguments before anything is priced or sent"""
+    if pre_compute_func is not None and not callable(pre_compute_func):
+        raise TypeError("pre_compute_func must be a callable function or None")
+
+    if main_func is not None and not callable(main_func):
+        raise TypeError("main_func must be a callable function or None")
+
+    if not isinstance(is_separate_data, bool):
+        raise TypeError("is_separate_data must be a boolean")
+
+    if len(bucket_ids) != len(policy_indexes):
+        raise ValueError("Length of bucket_ids and policy_indexes must match")
+
+    # Validate bucket_ids
+    if not isinstance(bucket_ids, list) or len(bucket_ids) == 0:
+        raise ValueError("bucket_ids must be a non-empty list")
+
+    if not isinstance(policy_indexes, list) or len(policy_indexes) == 0:
+        raise ValueError("policy_indexes must be a non-empty list")
+    if len(bucket_ids) == 1:
+        # Single worker
+        if main_func is None or not callable(main_func):
+            raise ValueError("Single worker requires a valid main_func")
+    else:
+        if pre_compute_func is None or not callable(pre_compute_func):
+            raise ValueError("Multiple workers require a valid pre_compute_func")
+        if main_func is None or not callable(main_func):
+            raise ValueError("Multiple workers require a valid main_func")
+    if categorize_by_do and not aggregate_type:
+        raise ValueError(
+            "categorize_by_do requires aggregate_type "
+            "(e.g., 'count', 'sum', 'mean', 'min', 'max')"
+        )
+    if categorize_by_do and aggregate_type not in VALID_DISCLOSURE_OPERATIONS:
+        raise ValueError(
+            f"Invalid aggregate_type for categorize_by_do: {aggregate_type}. "
+            f"Must be one of {VALID_DISCLOSURE_OPERATIONS}"
+        )
+
+
+def build_query_str(
+    pre_compute_func, main_func, is_separate_data: bool, categorize_by_do: bool
+) -> dict:
+    """Serializes the query functions into the payload sealed by encrypt_query"""
+    return {
+        "pre_compute_func": (
+            dumps_function(pre_compute_func) if pre_compute_func else None
+        ),
+        "main_func": dumps_function(main_func) if main_func else None,
+        "is_separate_data": is_separate_data,
+        "categorizeByDO": categorize_by_do,
+    }
+
+
+def encrypt_query(
+    self,
+    query_str,
+    policy_indexes: list,
+    categorize_by_do: bool = False,
+    aggregate_type: str = None,
+) -> str:
+    """Seals a query for the star node, offloading it to the blob store if set"""
+    print("encrypting query under star node key...")
+    ppcCmd = encryption.hybrid_encrypt(self, query_str, policy_indexes)
+    # Expose categorization metadata to backend-api (outside encrypted payload)
+    if categorize_by_do or aggregate_type:
+        ppc_data = json.loads(ppcCmd)
+        if categorize_by_do:
+            ppc_data["categorizeByDO"] = True
+        if aggregate_type:
+            ppc_data["aggregate"] = {"type": aggregate_type}
+        ppcCmd = json.dumps(ppc_data)
+    store = getattr(self, "blob_store", None)
+    if store is not None:
+        ppcCmd = offload_payload(store, ppcCmd, self.offload_min_bytes)
+    return ppcCmd
+
+
+def decode_decrypted_result(decrypted):
+    """
+    Normalize decrypted query payload into a Python object.
+    Supports:
+    - JSON bytes/strings (categorized responses)
+    - dill-serialized bytes (legacy payloads)
+    - passthrough for already-decoded objects
+    """
+    if isinstance(decrypted, (bytes, bytearray, memoryview)):
+        raw = decrypted
+        try:
+            text = str(raw, "utf-8")
+            try:
+                return json.loads(text)
+            except Exception:
+                return text
+        except Exception:
+            try:
+                return dill.loads(raw)
+            except Exception:
+                return bytes(raw)
+
+    if isinstance(decrypted, str):
+        try:
+            return json.loads(decrypted)
+        except Exception:
+            return decrypted
+
+    return decrypted
+
+
+def open_result(self, raw):
+    """Decrypts and decodes a raw result posted on-chain"""
+    result = raw
+    if isinstance(raw, (bytes, bytearray)):
+        result = raw.decode("utf-8", errors="ignore")
+
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except Exception:
+            # Some backend paths write plain text errors (not JSON encoded).
+            pass
+
+    if isinstance(result, dict) and "payloadRef" in result:
+        result = resolve_payload(
+            getattr(self, "blob_store", None), result["payloadRef"]
+        )
+
+    if isinstance(result, str) and result.startswith("Something went wrong"):
+        raise RuntimeError(f"Query failed: {result}")
+    else:
+        existing_result = encryption.open_result(
+            self, result, decode_decrypted_result
+        )
+        print("result:")
+        print("-" * 50)
+        print(existing_result)
+        print("-" * 50)
+    return existing_result
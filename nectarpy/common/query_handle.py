@@ -0,0 +1,75 @@
+from web3.exceptions import TransactionNotFound
+from nectarpy.common.result_waiter import (
+    _raw_result,
+    _read_query,
+    wait_for_raw_result,
+)
+
+_PENDING = object()
+
+
+class QueryHandle:
+    """
+    Reference to a submitted query whose result can be collected later.
+
+    Only the user index is needed to rebuild a handle, so another process
+    holding a client for the same account can resume with
+    QueryHandle(client, user_index).
+    """
+
+    def __init__(self, client, user_index: int, tx_hash=None):
+        self.client = client
+        self.user_index = user_index
+        self.tx_hash = tx_hash
+        self._confirmed = tx_hash is None
+        self._result = _PENDING
+
+    def __repr__(self) -> str:
+        state = "done" if self._result is not _PENDING else "pending"
+        return f"QueryHandle(user_index={self.user_index}, {state})"
+
+    def _mined(self) -> bool:
+        if self._confirmed:
+            return True
+        try:
+            receipt = self.client.web3.eth.get_transaction_receipt(self.tx_hash)
+        except TransactionNotFound:
+            return False
+        if receipt.status != 1:
+            raise RuntimeError(
+                f"pay_query transaction reverted: {self.tx_hash.hex()}"
+            )
+        self._confirmed = True
+        return True
+
+    def poll(self):
+        """Returns the decoded result if it has been posted, otherwise None"""
+        if self._result is _PENDING:
+            if not self._mined():
+                return None
+            raw = _raw_result(
+                _read_query(self.client, self.user_index), self.user_index
+            )
+            if raw is None:
+                return None
+            self._result = self.client._open_result(raw)
+        return self._result
+
+    def done(self) -> bool:
+        """Whether the result has been posted, without blocking"""
+        self.poll()
+        return self._result is not _PENDING
+
+    def result(self, timeout: float = None):
+        """Blocks until the result is posted and returns it decoded"""
+        if self._result is _PENDING:
+            if not self._confirmed:
+                receipt = self.client._wait_for_receipt(self.tx_hash, "pay_query")
+                if receipt.status != 1:
+                    raise RuntimeError(
+                        f"pay_query transaction reverted: {self.tx_hash.hex()}"
+                    )
+                self._confirmed = True
+            raw = wait_for_raw_result(self.client, self.user_index, timeout=timeout)
+            self._result = self.client._open_result(raw)
+        return self._result
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import threading
+from web3 import Web3
+from web3._utils.method_formatters import receipt_formatter
+from web3.datastructures import AttributeDict
+from web3.exceptions import TimeExhausted, TransactionNotFound
+from nectarpy.common.batch import _batch_size, _post, _supports_batch
+
+# Shortest gap between receipt polls, and the block time assumed until measured.
+# Polls for a late block start at MIN_POLL and double up to the block time.
+MIN_POLL = 0.5
+DEFAULT_BLOCK_TIME = 6.0
+BLOCK_TIME_SAMPLE = 20
+
+
+def receipt_settings() -> tuple:
+    """Returns (timeout, poll); poll is None unless NECTAR_TX_RECEIPT_POLL is set"""
+    timeout = float(os.getenv("NECTAR_TX_RECEIPT_TIMEOUT", "180"))
+    poll = os.getenv("NECTAR_TX_RECEIPT_POLL")
+    return timeout, None if poll is None else float(poll)
+
+
+def _hex(tx_hash) -> str:
+    return tx_hash if isinstance(tx_hash, str) else Web3.to_hex(tx_hash)
+
+
+class HeadWatcher:
+    """
+    Wakes a callback on every newHeads notification from a WebSocket endpoint.
+    Needs the websockets package (nectarpy[ws]); without it, receipts are polled.
+    """
+
+    def __init__(self, url: str, on_head):
+        self.url = url
+        self.on_head = on_head
+        try:
+            from websockets.sync.client import connect
+        except ImportError as e:
+            print(
+                f"cannot follow newHeads from {url}, polling for receipts instead:"
+                f" {e}. Install it with: pip install nectarpy[ws]"
+            )
+            self.alive = False
+            return
+        self.alive = True
+        self._thread = threading.Thread(target=self._run, args=(connect,), daemon=True)
+        self._thread.start()
+
+    def _run(self, connect):
+        try:
+            with connect(self.url) as ws:
+                ws.send(
+                    json.dumps(
+                        {
+                            "jsonrpc": "2.0",
+                            "id": 1,
+                            "method": "eth_subscribe",
+                            "params": ["newHeads"],
+                        }
+                    )
+                )
+                reply = json.loads(ws.recv())
+                if "error" in reply:
+                    raise RuntimeError(reply["error"])
+                for message in ws:
+                    if json.loads(message).get("method") == "eth_subscription":
+                        self.on_head()
+        except Exception as e:
+            print("newHeads subscription ended, polling for receipts:", e)
+        finally:
+            self.alive = False
+            self.on_head()
+
+
+class ReceiptTracker:
+    """
+    Waits for transaction receipts on behalf of any number of threads.
+
+    Whichever waiter is due polls for every pending hash at once, in one
+    JSON-RPC batch that also reads the block number. Polls are spaced by the
+    chain's block time, measured from when new blocks are first seen, or
+    triggered by newHeads when a WebSocket endpoint is given.
+    """
+
+    def __init__(self, web3, ws_url: str = None, poll: float = None):
+        self.web3 = web3
+        self.poll = poll
+        self.block_time = None
+        self._receipts = {}
+        self._waiters = {}
+        self._cond = threading.Condition()
+        self._polling = False
+        self._next_poll = 0.0
+        self._latest_block = None
+        self._block_seen = None
+        self._late_polls = 0
+        self._heads = None
+        if ws_url:
+            self._heads = HeadWatcher(ws_url, self._on_head)
+
+    def _on_head(self):
+        with self._cond:
+            self._next_poll = 0.0
+            self._cond.notify_all()
+
+    def _estimate_block_time(self) -> float:
+        try:
+            latest = self.web3.eth.get_block("latest")
+            earlier = self.web3.eth.get_block(max(latest["number"] - BLOCK_TIME_SAMPLE, 0))
+            blocks = latest["number"] - earlier["number"]
+            if blocks > 0:
+                return max((latest["timestamp"] - earlier["timestamp"]) / blocks, MIN_POLL)
+        except Exception as e:
+            print("cannot measure block time, assuming default:", e)
+        return DEFAULT_BLOCK_TIME
+
+    def _delay(self) -> float:
+        if self.poll is not None:
+            return self.poll
+        if self._heads is not None and self._heads.alive:
+            # newHeads wakes waiters; timed polls are only a safety net.
+            return self.block_time
+        if self._block_seen is not None:
+            due = self._block_seen + self.block_time - time.monotonic()
+            if due > MIN_POLL:
+                return due
+        # The next block is due (or its timing is unknown yet), but keeps not
+        # showing up; back off rather than poll the node every MIN_POLL.
+        cap = self.block_time or DEFAULT_BLOCK_TIME
+        delay = min(MIN_POLL * 2**self._late_polls, cap)
+        self._late_polls += 1
+        return delay
+
+    def _fetch_batch(self, hashes: list) -> tuple:
+        calls = [("eth_blockNumber", [])] + [
+            ("eth_getTransactionReceipt", [h]) for h in hashes
+        ]
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        raw = _post(
+            self.web3, json.dumps(payload).encode("utf-8"), "eth_getTransactionReceipt"
+        )
+        responses = json.loads(raw)
+        if not isinstance(responses, list):
+            raise ValueError(f"RPC endpoint rejected batch request: {responses}")
+        by_id = {r.get("id"): r for r in responses}
+        block = int(by_id[0]["result"], 16)
+        receipts = []
+        for i in range(1, len(calls)):
+            result = by_id.get(i, {}).get("result")
+            receipts.append(
+                None if result is None else AttributeDict.recursive(receipt_formatter(result))
+            )
+        return block, receipts
+
+    def _fetch_single(self, hashes: list) -> tuple:
+        block = self.web3.eth.block_number
+        receipts = []
+        for h in hashes:
+            try:
+                receipts.append(self.web3.eth.get_transaction_receipt(h))
+            except TransactionNotFound:
+                receipts.append(None)
+        return block, receipts
+
+    def _fetch(self, hashes: list) -> tuple:
+        if _supports_batch(self.web3):
+            try:
+                block, receipts = None, []
+                size = _batch_size() - 1
+                for start in range(0, len(hashes), size):
+                    block, chunk = self._fetch_batch(hashes[start : start + size])
+                    receipts += chunk
+                return block, receipts
+            except Exception as e:
+                print("batch receipt poll failed, polling one by one:", e)
+        return self._fetch_single(hashes)
+
+    def _poll_once(self):
+        if self.block_time is None:
+            self.block_time = self._estimate_block_time()
+        with self._cond:
+            hashes = [h for h in self._waiters if h not in self._receipts]
+        if not hashes:
+            return
+        block, receipts = self._fetch(hashes)
+        with self._cond:
+            if self._latest_block is not None and block > self._latest_block:
+                self._block_seen = time.monotonic()
+                self._late_polls = 0
+            self._latest_block = block
+            for h, receipt in zip(hashes, receipts):
+                if receipt is not None:
+                    self._receipts[h] = receipt
+
+    def wait_many(self, tx_hashes: list, timeout: float = None) -> list:
+        """Blocks until every hash has a receipt, raising TimeExhausted after timeout"""
+        keys = [_hex(h) for h in tx_hashes]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            for key in keys:
+                self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            while True:
+                with self._cond:
+                    if all(key in self._receipts for key in keys):
+                        return [self._receipts[key] for key in keys]
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        missing = [k for k in keys if k not in self._receipts]
+                        raise TimeExhausted(f"no receipt for {missing} within {timeout}s")
+                    if self._polling or now < self._next_poll:
+                        wait = max(self._next_poll - now, 0.05)
+                        if deadline is not None:
+                            wait = min(wait, deadline - now)
+                        self._cond.wait(wait)
+                        continue
+                    self._polling = True
+                try:
+                    self._poll_once()
+                except Exception as e:
+                    print("receipt poll failed, retrying:", e)
+                finally:
+                    with self._cond:
+                        self._polling = False
+                        self._next_poll = time.monotonic() + self._delay()
+                        self._cond.notify_all()
+        finally:
+            with self._cond:
+                for key in keys:
+                    self._waiters[key] -= 1
+                    if self._waiters[key] == 0:
+                        del self._waiters[key]
+                        self._receipts.pop(key, None)
+
+    def wait(self, tx_hash, timeout: float = None):
+        """Blocks until tx_hash has a receipt, raising TimeExhausted after timeout"""
+        return self.wait_many([tx_hash], timeout)[0]
+
+
+def _tracker(self):
+    tracker = getattr(self, "receipt_tracker", None)
+    if tracker is None and (_supports_batch(self.web3) or _ws_url(self)):
+        with self.__dict__.setdefault("_receipt_tracker_lock", threading.Lock()):
+            tracker = getattr(self, "receipt_tracker", None)
+            if tracker is None:
+                tracker = ReceiptTracker(
+                    self.web3, ws_url=_ws_url(self), poll=receipt_settings()[1]
+                )
+                self.receipt_tracker = tracker
+    return tracker
+
+
+def _ws_url(self):
+    config = getattr(self, "blockchain_config", None) or {}
+    return os.getenv("NECTAR_WS_URL") or config.get("ws")
+
+
+def wait_for_mined(self, pending: list) -> list:
+    """
+    Waits for the receipts of several (tx_hash, action) pairs together,
+    raising TimeoutError if any is not mined in time
+    """
+    timeout, poll = receipt_settings()
+    tracker = _tracker(self)
+    try:
+        if tracker is not None:
+            return tracker.wait_many([tx_hash for tx_hash, _ in pending], timeout)
+        return [
+            self.web3.eth.wait_for_transaction_receipt(
+                tx_hash, timeout=timeout, poll_latency=MIN_POLL if poll is None else poll
+            )
+            for tx_hash, _ in pending
+        ]
+    except TimeExhausted as exc:
+        actions = ", ".join(
+            f"{action} transaction {_hex(tx_hash)}" for tx_hash, action in pending
+        )
+        raise TimeoutError(f"{actions} not mined within {timeout:g}s") from exc
@@ -0,0 +1,260 @@
+import copy
+import json
+import time
+import hashlib
+import marshal
+import os
+import tempfile
+import threading
+from pathlib import Path
+from nectarpy.common.cache import TTLCache
+from nectarpy.common.events import EventWatcher, decode_log
+from nectarpy.common.serialization import dumps_function
+
+INVALIDATING_EVENTS = ["PolicyDeactivated", "BucketDeactivated"]
+MAX_RETRY_DELAY = 300
+
+
+def query_fingerprint(self, spec: dict) -> str:
+    """Hashes everything that determines a byoc_query result for this account"""
+    digest = hashlib.sha256()
+    for func in (spec["pre_compute_func"], spec["main_func"]):
+        digest.update(hashlib.sha256(dumps_function(func) or b"").digest())
+        # Importable functions pickle by reference, so their code goes in too.
+        code = getattr(func, "__code__", None)
+        digest.update(hashlib.sha256(marshal.dumps(code) if code else b"").digest())
+    params = {
+        "account": self.account["address"],
+        "queryManager": self.qm_contract_addr,
+        "is_separate_data": spec["is_separate_data"],
+        "bucket_ids": spec["bucket_ids"],
+        "policy_indexes": spec["policy_indexes"],
+        "categorize_by_do": spec["categorize_by_do"],
+        "aggregate_type": spec["aggregate_type"],
+    }
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Keeps decoded query results in memory and, optionally, on disk.
+
+    Disk entries hold the raw result as posted on-chain, still encrypted, in
+    owner-only JSON files; open_result decodes them when they are first
+    used. Entries expire after ttl seconds and are dropped once a policy or
+    bucket they used is deactivated. Entries written by an earlier process
+    are checked against the deactivation logs since they were written before
+    first use.
+    """
+
+    def __init__(
+        self,
+        web3,
+        eoa_bond,
+        directory=None,
+        ttl: float = 3600,
+        maxsize: int = 256,
+        event_poll: float = 6,
+        open_result=None,
+    ):
+        self.web3 = web3
+        self.eoa_bond = eoa_bond
+        self.ttl = ttl
+        self.event_poll = event_poll
+        self.open_result = open_result
+        self.entries = TTLCache(maxsize=maxsize)
+        self.directory = None
+        if directory is not None:
+            self.directory = Path(directory)
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._revoked_policies = set()
+        self._revoked_buckets = set()
+        self._lock = threading.Lock()
+        self._last_poll = time.monotonic()
+        self._watcher = None
+        self._start_block = None
+        # Hits are served only while every deactivation up to the watcher's
+        # position has been applied.
+        self._current = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._install()
+
+    def _install(self):
+        try:
+            self._watcher = EventWatcher(self.web3, self.eoa_bond, INVALIDATING_EVENTS)
+        except Exception as e:
+            self._failed("result cache events unavailable, retrying:", e)
+            return
+        self._start_block = self._watcher.next_block
+        self._current = True
+        self._failures = 0
+
+    def _failed(self, message: str, e: Exception):
+        # Back off from event_poll up to MAX_RETRY_DELAY between attempts.
+        print(message, e)
+        self._current = False
+        delay = min(max(self.event_poll, 1) * 2**self._failures, MAX_RETRY_DELAY)
+        self._failures += 1
+        self._retry_at = time.monotonic() + delay
+
+    def _revoke(self, events: list):
+        for event in events:
+            args = event["args"]
+            if "policyId" in args:
+                self._revoked_policies.add(args["policyId"])
+            if "bucketId" in args:
+                self._revoked_buckets.add(args["bucketId"])
+
+    def sync(self):
+        """Applies deactivation events seen since the last sync"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._retry_at:
+                return
+            if self._watcher is None:
+                self._install()
+                return
+            if self._current and now - self._last_poll < self.event_poll:
+                return
+            self._last_poll = now
+            try:
+                # A failed poll leaves the watcher where it was, so the retry
+                # picks up every event since the last successful one.
+                self._revoke(self._watcher.poll())
+            except Exception as e:
+                self._failed("result cache event polling failed, retrying:", e)
+            else:
+                self._current = True
+                self._failures = 0
+
+    def _path(self, fingerprint: str) -> Path:
+        return self.directory / f"{fingerprint}.json"
+
+    def _write(self, fingerprint: str, entry: dict):
+        if entry.get("raw") is None:
+            return
+        stored = {key: value for key, value in entry.items() if key != "value"}
+        # mkstemp creates the file readable by its owner only.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(stored, file)
+            os.replace(tmp_path, self._path(fingerprint))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def _load(self, fingerprint: str):
+        if self.directory is None or self.open_result is None:
+            return None
+        try:
+            entry = json.loads(self._path(fingerprint).read_text(encoding="utf-8"))
+            entry["value"] = self.open_result(entry["raw"])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print("discarding unreadable result cache entry:", e)
+            self._delete(fingerprint)
+            return None
+        written_at = entry["block"]
+        if not self._verify(entry):
+            self._delete(fingerprint)
+            return None
+        if entry["block"] != written_at:
+            self._write(fingerprint, entry)
+        return entry
+
+    def _verify(self, entry: dict) -> bool:
+        """Checks an entry written before the watcher started for deactivations it has not seen"""
+        if self._start_block is None or entry["block"] is None:
+            return False
+        if entry["block"] >= self._start_block:
+            return True
+        topics = self._watcher.topics
+        try:
+            logs = self.web3.eth.get_logs(
+                {
+                    "address": self.eoa_bond.address,
+                    "topics": [list(topics)],
+                    "fromBlock": entry["block"],
+                    "toBlock": self._start_block,
+                }
+            )
+        except Exception as e:
+            print("cannot check cached result for deactivations:", e)
+            return False
+        events = [decode_log(self.eoa_bond, topics, log) for log in logs]
+        self._revoke([e for e in events if e is not None])
+        entry["block"] = self._start_block
+        return not self._stale(entry)
+
+    def _stale(self, entry: dict) -> bool:
+        return (
+            time.time() >= entry["expires"]
+            or not self._revoked_policies.isdisjoint(entry["policy_ids"])
+            or not self._revoked_buckets.isdisjoint(entry["bucket_ids"])
+        )
+
+    def _delete(self, fingerprint: str):
+        self.entries.pop(fingerprint)
+        if self.directory is not None:
+            try:
+                self._path(fingerprint).unlink()
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, fingerprint: str) -> tuple:
+        """Returns (True, result) on a fresh hit, else (False, None)"""
+        self.sync()
+        with self._lock:
+            if not self._current:
+                # Deactivations may have been missed; keep the entries for
+                # when the events catch up.
+                return False, None
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                entry = self._load(fingerprint)
+                if entry is None:
+                    return False, None
+                self.entries.set(fingerprint, entry)
+            elif not self._verify(entry):
+                self._delete(fingerprint)
+                return False, None
+            if self._stale(entry):
+                self._delete(fingerprint)
+                return False, None
+            return True, copy.deepcopy(entry["value"])
+
+    def store(
+        self, fingerprint: str, value, policy_ids: list, bucket_ids: list, raw=None
+    ):
+        """
+        Caches a result along with the policies and buckets it was computed
+        from. Only entries given the raw on-chain result are written to disk.
+        """
+        try:
+            block = self.web3.eth.block_number
+        except Exception as e:
+            print("cannot read the block for a cached result:", e)
+            block = None
+        entry = {
+            "value": copy.deepcopy(value),
+            "raw": raw,
+            "expires": time.time() + self.ttl,
+            "block": block,
+            "policy_ids": list(policy_ids),
+            "bucket_ids": list(bucket_ids),
+        }
+        with self._lock:
+            self.entries.set(fingerprint, entry)
+            if self.directory is not None:
+                self._write(fingerprint, entry)
+
+    def clear(self):
+        """Drops every cached result, on disk as well"""
+        self.entries.clear()
+        if self.directory is not None:
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
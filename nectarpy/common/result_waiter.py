@@ -0,0 +1,253 @@
+import os
+import time
+import asyncio
+import threading
+from nectarpy.common.events import AsyncEventWatcher, EventWatcher
+from nectarpy.common.receipts import DEFAULT_BLOCK_TIME
+
+RESULT_EVENTS = ["SuccessfulQuery", "RefundQuery"]
+
+# QueryManager.QueryStatus is Pending, Successful, Refunded.
+QUERY_REFUNDED = 2
+
+
+def _read_query(self, user_index):
+    return self.QueryManager.functions.getQueryByUserIndex(
+        self.account["address"], user_index
+    ).call()
+
+
+def _refunded(query, user_index) -> RuntimeError:
+    # The star node posts its error text as the result of a refunded query.
+    error = query[2]
+    if isinstance(error, (bytes, bytearray)):
+        error = error.decode("utf-8", errors="ignore")
+    if error:
+        return RuntimeError(f"Query {user_index} was refunded: {error}")
+    return RuntimeError(f"Query {user_index} was refunded")
+
+
+def _raw_result(query, user_index):
+    """Returns the posted result of a query tuple, or None while it is pending"""
+    if query[3] == QUERY_REFUNDED:
+        raise _refunded(query, user_index)
+    return query[2] or None
+
+
+class ResultFeed:
+    """
+    One QueryManager result watcher shared by every wait of a client.
+
+    The watcher is installed when the first wait starts and removed when the
+    last one ends. A wait polls it only if no other wait has since the wait
+    last looked, and the events naming this account are kept for every wait
+    to look up.
+    """
+
+    def __init__(self, web3, contract, account: str):
+        self.web3 = web3
+        self.contract = contract
+        self.account = account.lower()
+        self.watcher = None
+        self._waits = 0
+        self._events = {}
+        self._polls = 0
+        self._lock = threading.Lock()
+
+    def _record(self, events: list):
+        for event in events:
+            if event["args"]["user"].lower() == self.account:
+                index = event["args"]["queryIndex"]
+                self._events.setdefault(index, []).append(event["event"])
+
+    def _watcher_failed(self, e: Exception):
+        print("result event polling failed, falling back to polling:", e)
+        self.watcher = None
+
+    def _left(self):
+        self._waits -= 1
+        if self._waits == 0:
+            self._events.clear()
+            watcher, self.watcher = self.watcher, None
+            return watcher
+        return None
+
+    def _joined(self):
+        return None if self.watcher is None else self._polls
+
+    def join(self):
+        """Starts a wait, returning the poll count, or None if results can only be polled for"""
+        with self._lock:
+            self._waits += 1
+            if self.watcher is None:
+                try:
+                    self.watcher = EventWatcher(self.web3, self.contract, RESULT_EVENTS)
+                except Exception as e:
+                    print("result events unavailable, falling back to polling:", e)
+            return self._joined()
+
+    def leave(self):
+        with self._lock:
+            watcher = self._left()
+        if watcher is not None:
+            watcher.uninstall()
+
+    def events(self, query_index, seen: int) -> tuple:
+        """
+        Returns (events for query_index, poll count), polling the watcher
+        unless another wait has since the poll count seen. The events are
+        None once the watcher is gone.
+        """
+        with self._lock:
+            if self.watcher is None:
+                return None, seen
+            if self._polls == seen:
+                self._polls += 1
+                try:
+                    self._record(self.watcher.poll())
+                except Exception as e:
+                    self._watcher_failed(e)
+                    return None, seen
+            return list(self._events.get(query_index, [])), self._polls
+
+
+class AsyncResultFeed(ResultFeed):
+    """ResultFeed counterpart for AsyncWeb3 clients, polling with eth_getLogs"""
+
+    def __init__(self, web3, contract, account: str):
+        super().__init__(web3, contract, account)
+        self._lock = asyncio.Lock()
+
+    async def join(self):
+        async with self._lock:
+            self._waits += 1
+            if self.watcher is None:
+                watcher = AsyncEventWatcher(self.web3, self.contract, RESULT_EVENTS)
+                try:
+                    await watcher.poll()
+                except Exception as e:
+                    print("result events unavailable, falling back to polling:", e)
+                else:
+                    self.watcher = watcher
+            return self._joined()
+
+    async def leave(self):
+        async with self._lock:
+            self._left()
+
+    async def events(self, query_index, seen: int) -> tuple:
+        async with self._lock:
+            if self.watcher is None:
+                return None, seen
+            if self._polls == seen:
+                self._polls += 1
+                try:
+                    self._record(await self.watcher.poll())
+                except Exception as e:
+                    self._watcher_failed(e)
+                    return None, seen
+            return list(self._events.get(query_index, [])), self._polls
+
+
+def _result_feed(self, cls=ResultFeed) -> ResultFeed:
+    feed = self.__dict__.get("result_feed")
+    if feed is None:
+        feed = self.__dict__.setdefault(
+            "result_feed", cls(self.web3, self.QueryManager, self.account["address"])
+        )
+    return feed
+
+
+def _poll_settings(self) -> tuple:
+    # Results only change once per block, so polls follow the block time.
+    block_poll = os.getenv("NECTAR_RESULT_POLL")
+    if block_poll is None:
+        tracker = getattr(self, "receipt_tracker", None)
+        block_poll = getattr(tracker, "block_time", None) or DEFAULT_BLOCK_TIME
+    return (
+        float(block_poll),
+        float(os.getenv("NECTAR_RESULT_MAX_POLL", "15")),
+        float(os.getenv("NECTAR_RESULT_RECHECK", "60")),
+    )
+
+
+def wait_for_raw_result(self, user_index, timeout: float = None):
+    """Blocks until a result is posted for user_index and returns it undecoded"""
+    block_poll, max_poll, recheck = _poll_settings(self)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    # Join the watcher before the first read so nothing posted in between is missed.
+    feed = _result_feed(self)
+    polls = feed.join()
+    try:
+        query = _read_query(self, user_index)
+        last_read = time.monotonic()
+        query_index = query[0]
+        interval = block_poll
+        while _raw_result(query, user_index) is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"no result for query {user_index} within {timeout}s"
+                )
+            if polls is None:
+                time.sleep(interval)
+                interval = min(interval * 1.5, max_poll)
+                query = _read_query(self, user_index)
+                continue
+
+            time.sleep(block_poll)
+            matched, polls = feed.events(query_index, polls)
+            if matched is None:
+                polls = None
+                continue
+            if matched or time.monotonic() - last_read >= recheck:
+                query = _read_query(self, user_index)
+                last_read = time.monotonic()
+                if query[2] == "" and "RefundQuery" in matched:
+                    raise _refunded(query, user_index)
+        return query[2]
+    finally:
+        feed.leave()
+
+
+async def async_wait_for_raw_result(self, user_index, timeout: float = None):
+    """wait_for_raw_result counterpart for AsyncWeb3 clients"""
+    block_poll, max_poll, recheck = _poll_settings(self)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    async def read():
+        return await self.QueryManager.functions.getQueryByUserIndex(
+            self.account["address"], user_index
+        ).call()
+
+    feed = _result_feed(self, AsyncResultFeed)
+    polls = await feed.join()
+    try:
+        query = await read()
+        last_read = time.monotonic()
+        query_index = query[0]
+        interval = block_poll
+        while _raw_result(query, user_index) is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"no result for query {user_index} within {timeout}s"
+                )
+            if polls is None:
+                await asyncio.sleep(interval)
+                interval = min(interval * 1.5, max_poll)
+                query = await read()
+                continue
+
+            await asyncio.sleep(block_poll)
+            matched, polls = await feed.events(query_index, polls)
+            if matched is None:
+                polls = None
+                continue
+            if matched or time.monotonic() - last_read >= recheck:
+                query = await read()
+                last_read = time.monotonic()
+                if query[2] == "" and "RefundQuery" in matched:
+                    raise _refunded(query, user_index)
+        return query[2]
+    finally:
+        await feed.leave()
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import threading
+import weakref
+from functools import partial
+from nectarpy.common.events import AsyncEventWatcher, EventWatcher
+
+ROLE_EVENTS = ["RoleGranted", "RoleRevoked", "StatusReset"]
+
+
+class RoleCache:
+    """
+    Remembers an account's role until it expires or a UserRole event names the account.
+
+    Events arrive through a RoleFeed, so reading the role never waits on the
+    watcher. A change made before the watcher is installed is picked up when
+    the ttl runs out.
+    """
+
+    def __init__(self, address: str, ttl: float = None):
+        self.address = address
+        if ttl is None:
+            ttl = float(os.getenv("NECTAR_ROLE_TTL", "300"))
+        self.ttl = ttl
+        self.role = None
+        self.generation = 0
+        self._expires = 0.0
+
+    def valid(self) -> bool:
+        return self.role is not None and time.monotonic() < self._expires
+
+    def store(self, role: str, generation: int):
+        """Caches role unless an event invalidated it while it was being read"""
+        if generation == self.generation:
+            self.role = role
+            self._expires = time.monotonic() + self.ttl
+
+    def invalidate(self):
+        self.generation += 1
+        self.role = None
+
+
+class RoleFeed:
+    """
+    Follows UserRole events for every RoleCache on one connection.
+
+    A single watcher is polled for all the caches added, and each event only
+    invalidates the caches of the account it names. Caches are held weakly,
+    and polling stops once none are left. If the events cannot be followed,
+    the caches fall back on their ttl.
+    """
+
+    def __init__(self, event_poll: float = 6):
+        self.event_poll = event_poll
+        self.events_enabled = True
+        self.watcher = None
+        self._caches = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def apply(self, events: list):
+        accounts = set()
+        for event in events:
+            args = event["args"]
+            accounts.add(args.get("account", args.get("user")))
+        if accounts:
+            for cache in list(self._caches):
+                if cache.address in accounts:
+                    cache.invalidate()
+
+    def events_failed(self, e: Exception):
+        print("role events unavailable, relying on ttl:", e)
+        with self._lock:
+            self.watcher = None
+            self.events_enabled = False
+            self._poller = None
+            caches = list(self._caches)
+        for cache in caches:
+            cache.invalidate()
+
+    def _done(self) -> bool:
+        """Stops the poller once every cache is gone"""
+        with self._lock:
+            if len(self._caches) == 0:
+                self._poller = None
+                self.watcher = None
+                return True
+            return False
+
+    def add(self, cache: RoleCache, install):
+        """
+        Adds cache and, on first use, starts polling the watcher built by
+        install on a daemon thread.
+        """
+        with self._lock:
+            self._caches.add(cache)
+            if self.events_enabled and self._poller is None:
+                self._poller = threading.Thread(
+                    target=_follow_events, args=(self, install), daemon=True
+                )
+                self._poller.start()
+
+    def async_add(self, cache: RoleCache, install):
+        """add counterpart that polls from a task on the running event loop"""
+        with self._lock:
+            self._caches.add(cache)
+            if self.events_enabled and self._poller is None:
+                self._poller = asyncio.get_running_loop().create_task(
+                    _async_follow_events(self, install)
+                )
+
+
+def _follow_events(feed, install):
+    try:
+        watcher = feed.watcher = install()
+    except Exception as e:
+        feed.events_failed(e)
+        return
+    while feed.watcher is watcher:
+        time.sleep(feed.event_poll)
+        if feed._done():
+            watcher.uninstall()
+            return
+        try:
+            feed.apply(watcher.poll())
+        except Exception as e:
+            feed.events_failed(e)
+
+
+async def _async_follow_events(feed, install):
+    try:
+        watcher = feed.watcher = install()
+        await watcher.poll()
+    except Exception as e:
+        feed.events_failed(e)
+        return
+    while feed.watcher is watcher:
+        await asyncio.sleep(feed.event_poll)
+        if feed._done():
+            return
+        try:
+            feed.apply(await watcher.poll())
+        except Exception as e:
+            feed.events_failed(e)
+
+
+def _role_cache(self) -> RoleCache:
+    cache = self.__dict__.get("role_cache")
+    if cache is None:
+        cache = self.role_cache = RoleCache(self.account["address"])
+    return cache
+
+
+def _role_feed(self) -> RoleFeed:
+    # Clients of a NectarSession are handed the session's feed.
+    feed = self.__dict__.get("role_feed")
+    if feed is None:
+        feed = self.role_feed = RoleFeed()
+    return feed
+
+
+def read_user_role(self, refresh: bool = False) -> str:
+    """Returns the account role, re-reading UserRole only when the cached one is stale"""
+    cache = _role_cache(self)
+    _role_feed(self).add(
+        cache, partial(EventWatcher, self.web3, self.UserRole, ROLE_EVENTS)
+    )
+    role = cache.role if cache.valid() else None
+    if refresh or role is None:
+        generation = cache.generation
+        role = self.UserRole.functions.getUserRole(self.account["address"]).call()
+        cache.store(role, generation)
+        print(f"Current user role: {role}")
+    return role
+
+
+async def async_read_user_role(self, refresh: bool = False) -> str:
+    """read_user_role counterpart for AsyncWeb3 clients"""
+    cache = _role_cache(self)
+    _role_feed(self).async_add(
+        cache, partial(AsyncEventWatcher, self.web3, self.UserRole, ROLE_EVENTS)
+    )
+    role = cache.role if cache.valid() else None
+    if refresh or role is None:
+        generation = cache.generation
+        role = await self.UserRole.functions.getUserRole(
+            self.account["address"]
+        ).call()
+        cache.store(role, generation)
+        print(f"Current user role: {role}")
+    return role
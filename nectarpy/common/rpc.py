@@ -0,0 +1,359 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import aiohttp
+import requests
+from urllib3.exceptions import NewConnectionError
+from web3.providers.async_rpc import AsyncHTTPProvider
+from web3.providers.rpc import HTTPProvider
+from web3._utils.request import async_make_post_request, make_post_request
+
+# Node-side state (filters, subscriptions) lives on one endpoint, so these
+# always go to the first configured URL.
+STATEFUL_METHODS = {
+    "eth_newFilter",
+    "eth_newBlockFilter",
+    "eth_newPendingTransactionFilter",
+    "eth_getFilterChanges",
+    "eth_getFilterLogs",
+    "eth_uninstallFilter",
+}
+# Writes are never sent twice at once, and only fail over when the request
+# certainly did not reach the node.
+WRITE_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction"}
+
+LATENCY_WEIGHT = 0.3
+HEDGE_MIN = 0.25
+COOLDOWN_MAX = 30.0
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="nectar-rpc")
+
+
+def endpoint_urls(blockchain: dict) -> list:
+    """Returns the RPC URLs of a blockchain.json network entry, NECTAR_RPC_URLS first"""
+    override = os.getenv("NECTAR_RPC_URLS")
+    if override:
+        return [url.strip() for url in override.split(",") if url.strip()]
+    urls = blockchain.get("urls") or blockchain["url"]
+    return [urls] if isinstance(urls, str) else list(urls)
+
+
+def _uses_mempool(method: str, params) -> bool:
+    # A pending nonce read must see the transactions just sent, so writes and
+    # these reads go to the same node.
+    if method in WRITE_METHODS:
+        return True
+    return method == "eth_getTransactionCount" and bool(params) and params[-1] == "pending"
+
+
+def _status(error: Exception):
+    """HTTP status of a requests or aiohttp error response, else None"""
+    if isinstance(error, requests.HTTPError):
+        return getattr(error.response, "status_code", None)
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+    return None
+
+
+def _retriable(error: Exception) -> bool:
+    status = _status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            aiohttp.ClientConnectionError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+def _unsent(error: Exception) -> bool:
+    if _status(error) is not None:
+        return _status(error) == 429
+    if isinstance(error, (requests.ConnectTimeout, aiohttp.ClientConnectorError)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_ambiguous(error: Exception) -> bool:
+    """
+    Whether a failed request may still have been processed by the node, e.g.
+    a read timeout or a 5xx after the body was sent
+    """
+    return _retriable(error) and not _unsent(error)
+
+
+class Endpoint:
+    """Latency and error history of one RPC URL"""
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def succeeded(self, latency: float):
+        self.requests += 1
+        self.consecutive_errors = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+    def failed(self):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_errors += 1
+        cooldown = min(COOLDOWN_MAX, 2 ** (self.consecutive_errors - 1))
+        self.down_until = time.monotonic() + cooldown
+
+
+class _EndpointPool:
+    """Endpoint ranking and bookkeeping shared by the failover providers"""
+
+    def _init_pool(self, endpoint_uris: list, max_retries: int = None):
+        if not endpoint_uris:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = [Endpoint(uri) for uri in endpoint_uris]
+        if max_retries is None:
+            max_retries = int(os.getenv("NECTAR_RPC_RETRIES", "3"))
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+
+    def _ordered(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy(now)]
+            down = [e for e in self.endpoints if not e.healthy(now)]
+            return healthy + sorted(down, key=lambda e: e.down_until)
+
+    def _ranked(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy(now)]
+            if not healthy:
+                return sorted(self.endpoints, key=lambda e: e.down_until)
+            # Unmeasured endpoints rank first so each gets sampled.
+            return sorted(healthy, key=lambda e: e.latency or 0.0)
+
+    def _succeeded(self, endpoint: Endpoint, start: float):
+        with self._lock:
+            endpoint.succeeded(time.monotonic() - start)
+
+    def _failed(self, endpoint: Endpoint, error: Exception):
+        if _retriable(error):
+            with self._lock:
+                endpoint.failed()
+
+    def stats(self) -> list:
+        """Returns the latency and error counts of every endpoint"""
+        with self._lock:
+            return [
+                {
+                    "uri": e.uri,
+                    "latency": e.latency,
+                    "requests": e.requests,
+                    "errors": e.errors,
+                    "healthy": e.healthy(time.monotonic()),
+                }
+                for e in self.endpoints
+            ]
+
+
+class FailoverHTTPProvider(_EndpointPool, HTTPProvider):
+    """
+    HTTPProvider spread over several RPC URLs.
+
+    Reads go to the healthy endpoint with the lowest average latency and are
+    re-sent to the next one when the answer is slow (hedged). 429, 5xx and
+    connection errors put an endpoint on cooldown and move on to the next,
+    with jittered exponential backoff once every endpoint has failed.
+    Transactions and pending nonce reads go to the first healthy endpoint in
+    configured order, so the nonces read match the transactions sent.
+    """
+
+    def __init__(
+        self,
+        endpoint_uris: list,
+        request_kwargs: dict = None,
+        hedge_after: float = None,
+        max_retries: int = None,
+    ):
+        self._init_pool(endpoint_uris, max_retries)
+        super().__init__(endpoint_uris[0], request_kwargs)
+        if hedge_after is None and os.getenv("NECTAR_RPC_HEDGE"):
+            hedge_after = float(os.getenv("NECTAR_RPC_HEDGE"))
+        self.hedge_after = hedge_after
+        self._local = threading.local()
+
+    def _hedge_delay(self, endpoint: Endpoint) -> float:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if endpoint.latency is None:
+            return HEDGE_MIN * 4
+        return max(HEDGE_MIN, 2 * endpoint.latency)
+
+    def _attempt(self, endpoint: Endpoint, data: bytes) -> bytes:
+        start = time.monotonic()
+        try:
+            raw = make_post_request(endpoint.uri, data, **self.get_request_kwargs())
+        except Exception as e:
+            self._failed(endpoint, e)
+            raise
+        self._succeeded(endpoint, start)
+        return raw
+
+    def _race(self, endpoints: list, data: bytes, write: bool) -> bytes:
+        """Tries endpoints in order, starting the next early when hedging a slow read"""
+        queue = list(endpoints)
+        pending = {}
+        error = None
+
+        def launch():
+            endpoint = queue.pop(0)
+            pending[_executor.submit(self._attempt, endpoint, data)] = endpoint
+
+        launch()
+        while pending:
+            timeout = None
+            if not write and queue:
+                timeout = min(self._hedge_delay(e) for e in pending.values())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for future in done:
+                del pending[future]
+                try:
+                    return future.result()
+                except Exception as e:
+                    if not _retriable(e) or (write and is_ambiguous(e)):
+                        raise
+                    error = e
+            if not pending and queue:
+                launch()
+        raise error
+
+    @contextmanager
+    def pinned(self):
+        """Sends every read made by this thread inside the block to one endpoint"""
+        if getattr(self._local, "pin", None) is not None:
+            yield
+            return
+        self._local.pin = self._ranked()[0]
+        try:
+            yield
+        finally:
+            self._local.pin = None
+
+    def post(self, data: bytes, method: str = None, params=None) -> bytes:
+        """POSTs an encoded JSON-RPC request or batch, routed by method"""
+        if method in STATEFUL_METHODS:
+            return self._attempt(self.endpoints[0], data)
+        write = method in WRITE_METHODS
+        mempool = _uses_mempool(method, params)
+        pin = getattr(self._local, "pin", None)
+        if pin is not None and not mempool:
+            return self._attempt(pin, data)
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Writes go to the first healthy endpoint in configured order,
+                # reads to the fastest.
+                endpoints = self._ordered() if mempool else self._ranked()
+                return self._race(endpoints, data, write)
+            except Exception as e:
+                if attempt == self.max_retries or not _retriable(e):
+                    raise
+                if write and is_ambiguous(e):
+                    raise
+                time.sleep(_backoff(attempt))
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        return self.decode_rpc_response(self.post(request_data, method, params))
+
+
+class AsyncFailoverHTTPProvider(_EndpointPool, AsyncHTTPProvider):
+    """
+    FailoverHTTPProvider counterpart for AsyncWeb3.
+
+    Endpoints are ranked, put on cooldown and retried with backoff the same
+    way, and writes only fail over when the request certainly did not reach
+    the node. A slow read is not hedged.
+    """
+
+    def __init__(
+        self, endpoint_uris: list, request_kwargs: dict = None, max_retries: int = None
+    ):
+        self._init_pool(endpoint_uris, max_retries)
+        super().__init__(endpoint_uris[0], request_kwargs)
+
+    async def _attempt(self, endpoint: Endpoint, data: bytes) -> bytes:
+        start = time.monotonic()
+        try:
+            raw = await async_make_post_request(
+                endpoint.uri, data, **self.get_request_kwargs()
+            )
+        except Exception as e:
+            self._failed(endpoint, e)
+            raise
+        self._succeeded(endpoint, start)
+        return raw
+
+    async def post(self, data: bytes, method: str = None, params=None) -> bytes:
+        """POSTs an encoded JSON-RPC request, routed by method"""
+        if method in STATEFUL_METHODS:
+            return await self._attempt(self.endpoints[0], data)
+        write = method in WRITE_METHODS
+        mempool = _uses_mempool(method, params)
+        for attempt in range(self.max_retries + 1):
+            error = None
+            for endpoint in self._ordered() if mempool else self._ranked():
+                try:
+                    return await self._attempt(endpoint, data)
+                except Exception as e:
+                    if not _retriable(e) or (write and is_ambiguous(e)):
+                        raise
+                    error = e
+            if attempt == self.max_retries:
+                raise error
+            await asyncio.sleep(_backoff(attempt))
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        return self.decode_rpc_response(await self.post(request_data, method, params))
+
+
+@contextmanager
+def pinned(web3):
+    """
+    Keeps reads that must agree with each other, such as a block number and
+    the logs up to it, on one endpoint
+    """
+    provider = web3.provider
+    if isinstance(provider, FailoverHTTPProvider):
+        with provider.pinned():
+            yield
+    else:
+        yield
@@ -0,0 +1,94 @@
+import os
+import types
+import dill
+from nectarpy.common.cache import TTLCache
+
+_SCALARS = (type(None), bool, int, float, complex, str, bytes)
+
+_function_cache = TTLCache(
+    maxsize=int(os.getenv("NECTAR_FUNCTION_CACHE_SIZE", "256"))
+)
+
+
+class _Uncacheable(Exception):
+    """Raised when a function refers to state that could change between calls"""
+
+
+def _referenced_names(code) -> set:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+def _fingerprint_value(value, seen: set):
+    if isinstance(value, _SCALARS):
+        return (type(value).__name__, value)
+    if isinstance(value, (tuple, frozenset)):
+        items = tuple(_fingerprint_value(v, seen) for v in value)
+        return (type(value).__name__, items if isinstance(value, tuple) else frozenset(items))
+    if isinstance(value, types.ModuleType):
+        return ("module", value.__name__)
+    if isinstance(value, types.FunctionType):
+        return ("function", _fingerprint_function(value, seen))
+    module = getattr(value, "__module__", None)
+    if (
+        isinstance(value, (type, types.BuiltinFunctionType))
+        and module not in (None, "__main__")
+    ):
+        # Importable classes and builtins are pickled by reference.
+        return ("ref", module, value.__qualname__)
+    # Mutable objects would have to be pickled just to compare them.
+    raise _Uncacheable(type(value).__name__)
+
+
+def _fingerprint_function(func, seen: set):
+    if id(func) in seen:
+        return ("recursive", func.__qualname__)
+    seen = seen | {id(func)}
+    closure = tuple(
+        _fingerprint_value(cell.cell_contents, seen) for cell in func.__closure__ or ()
+    )
+    func_globals = tuple(
+        (name, _fingerprint_value(func.__globals__[name], seen))
+        for name in sorted(_referenced_names(func.__code__))
+        if name in func.__globals__
+    )
+    return (
+        func.__module__,
+        func.__qualname__,
+        func.__code__,
+        _fingerprint_value(func.__defaults__, seen),
+        _fingerprint_value(
+            tuple(sorted((func.__kwdefaults__ or {}).items())), seen
+        ),
+        closure,
+        func_globals,
+    )
+
+
+def dumps_function(func) -> bytes:
+    """
+    dill.dumps(func, recurse=True), memoized on the function's code, closure
+    and referenced globals. Functions that refer to mutable objects are
+    pickled every time, since a change to those objects would not show in the key.
+    """
+    if func is None:
+        return None
+    if not isinstance(func, types.FunctionType):
+        return dill.dumps(func, recurse=True)
+    try:
+        key = _fingerprint_function(func, set())
+    except (_Uncacheable, ValueError):  # ValueError: empty closure cell
+        return dill.dumps(func, recurse=True)
+    payload = _function_cache.get(key)
+    if payload is None:
+        payload = dill.dumps(func, recurse=True)
+        _function_cache.set(key, payload)
+    return payload
+
+
+def clear_function_cache():
+    """Drops every memoized function pickle"""
+    _function_cache.clear()
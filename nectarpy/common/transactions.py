@@ -0,0 +1,275 @@
+import asyncio
+from nectarpy.common.nonce import is_already_sent, is_nonce_error
+from nectarpy.common.receipts import wait_for_mined
+from nectarpy.common.rpc import is_ambiguous
+
+# payQuery stores the encrypted command on-chain, so its cost grows with the
+# payload. Used when the call cannot be estimated ahead of a pending approve.
+PAY_QUERY_BASE_GAS = 400_000
+PAY_QUERY_GAS_PER_BUCKET = 100_000
+PAY_QUERY_GAS_PER_BYTE = 1_000
+# Storing the command costs at least a 20k gas SSTORE per 32-byte word.
+PAY_QUERY_MIN_GAS_PER_BYTE = 625
+
+
+# Bulk provisioning sends calls that depend on policies added earlier in the
+# same batch, which the node cannot estimate until those are mined.
+ADD_BUCKET_BASE_GAS = 400_000
+ADD_BUCKET_GAS_PER_POLICY = 100_000
+SET_DISCLOSURE_BASE_GAS = 100_000
+SET_DISCLOSURE_GAS_PER_OPERATION = 50_000
+
+
+def estimate_pay_query_gas(ppc_cmd: str, bucket_count: int) -> int:
+    """Upper bound on payQuery gas for a command of this size"""
+    return (
+        PAY_QUERY_BASE_GAS
+        + PAY_QUERY_GAS_PER_BUCKET * bucket_count
+        + PAY_QUERY_GAS_PER_BYTE * len(ppc_cmd.encode("utf-8"))
+    )
+
+
+def pay_query_gas(self, ppc_cmd: str, bucket_count: int, offline: bool = False) -> int:
+    """
+    estimate_pay_query_gas capped at the block gas limit. Raises ValueError
+    when even the cheapest payQuery for the command could not fit in a block.
+    Offline, the block gas limit is not read and the estimate is not capped.
+    """
+    limit = estimate_pay_query_gas(ppc_cmd, bucket_count)
+    oracle = getattr(self, "fee_oracle", None)
+    if oracle is None or offline:
+        return limit
+    try:
+        cap = oracle.block_gas_limit()
+    except Exception as e:
+        print("cannot read block gas limit, using uncapped payQuery gas:", e)
+        return limit
+    size = len(ppc_cmd.encode("utf-8"))
+    floor = PAY_QUERY_BASE_GAS + PAY_QUERY_MIN_GAS_PER_BYTE * size
+    if floor > cap:
+        raise ValueError(
+            f"payQuery command of {size} bytes needs more than {floor} gas, over the"
+            f" block gas limit of {cap}; send it through use_blob_store instead"
+        )
+    return min(limit, cap)
+
+
+async def async_pay_query_gas(
+    self, ppc_cmd: str, bucket_count: int, offline: bool = False
+) -> int:
+    """pay_query_gas counterpart for AsyncWeb3 clients"""
+    limit = estimate_pay_query_gas(ppc_cmd, bucket_count)
+    oracle = getattr(self, "fee_oracle", None)
+    if oracle is None or offline:
+        return limit
+    try:
+        cap = await oracle.block_gas_limit()
+    except Exception as e:
+        print("cannot read block gas limit, using uncapped payQuery gas:", e)
+        return limit
+    size = len(ppc_cmd.encode("utf-8"))
+    floor = PAY_QUERY_BASE_GAS + PAY_QUERY_MIN_GAS_PER_BYTE * size
+    if floor > cap:
+        raise ValueError(
+            f"payQuery command of {size} bytes needs more than {floor} gas, over the"
+            f" block gas limit of {cap}; send it through use_blob_store instead"
+        )
+    return min(limit, cap)
+
+
+
+
+def estimate_add_bucket_gas(policy_count: int) -> int:
+    """Upper bound on addBucket gas for a bucket with this many policies"""
+    return ADD_BUCKET_BASE_GAS + ADD_BUCKET_GAS_PER_POLICY * policy_count
+
+
+def estimate_disclosure_gas(operation_count: int) -> int:
+    """Upper bound on setIdentityDisclosureOperations gas"""
+    return SET_DISCLOSURE_BASE_GAS + SET_DISCLOSURE_GAS_PER_OPERATION * operation_count
+
+
+def _resync_nonce(self):
+    manager = getattr(self, "nonce_manager", None)
+    if manager is not None:
+        manager.resync()
+
+
+def _confirm_nonce(self, nonce: int):
+    manager = getattr(self, "nonce_manager", None)
+    if manager is not None:
+        manager.confirm(nonce)
+
+
+def _release_nonce(self, nonce: int, error: Exception):
+    # A nonce error means the node disagrees with the local counter; anything
+    # else (a revert in gas estimation, a fee error) left the nonce unused.
+    manager = getattr(self, "nonce_manager", None)
+    if manager is None:
+        return
+    manager.release(nonce)
+    if is_nonce_error(error):
+        manager.resync()
+
+
+async def _async_release_nonce(self, nonce: int, error: Exception):
+    manager = getattr(self, "nonce_manager", None)
+    if manager is None:
+        return
+    manager.release(nonce)
+    if is_nonce_error(error):
+        await manager.resync()
+
+
+def _invalidate_fees(self):
+    oracle = getattr(self, "fee_oracle", None)
+    if oracle is not None:
+        oracle.invalidate()
+
+
+def sign_transaction(self, contract_fn, nonce: int, tx_params: dict = None):
+    """Builds and signs a contract call from the API account at the given nonce"""
+    oracle = getattr(self, "fee_oracle", None)
+    if oracle is not None:
+        tx_params = oracle.tx_params(contract_fn, self.account["address"], tx_params)
+    tx_built = contract_fn.build_transaction(
+        {
+            "from": self.account["address"],
+            "nonce": nonce,
+            **(tx_params or {}),
+        }
+    )
+    return self.web3.eth.account.sign_transaction(
+        tx_built, self.account["private_key"]
+    )
+
+
+def _rebroadcast(self, tx_signed, error: Exception):
+    """
+    Re-sends the same signed bytes after a send whose outcome is unknown.
+    Re-signing at another nonce could get the call mined twice.
+    """
+    if not is_already_sent(error):
+        try:
+            self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        except Exception as e:
+            if not (is_already_sent(e) or is_ambiguous(e)):
+                try:
+                    self.web3.eth.get_transaction(tx_signed.hash)
+                except Exception:
+                    raise e from None
+    return tx_signed.hash
+
+
+def send_transaction(self, contract_fn, tx_params: dict = None):
+    """Builds, signs and broadcasts a contract call without waiting for its receipt"""
+    retried = False
+    while True:
+        nonce = self._next_nonce()
+        tx_signed = None
+        try:
+            tx_signed = sign_transaction(self, contract_fn, nonce, tx_params)
+            tx_hash = self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        except Exception as e:
+            if tx_signed is not None and (is_already_sent(e) or is_ambiguous(e)):
+                # The node may hold the transaction, so its nonce counts as used.
+                _confirm_nonce(self, nonce)
+                return _rebroadcast(self, tx_signed, e)
+            # The nonce was not consumed, so hand it back. The cached fees may
+            # be why it was rejected, so re-read them too.
+            _release_nonce(self, nonce, e)
+            _invalidate_fees(self)
+            if retried or not is_nonce_error(e):
+                raise
+            retried = True
+            continue
+        _confirm_nonce(self, nonce)
+        return tx_hash
+
+
+class BatchError(RuntimeError):
+    """
+    Raised when part of a batch of transactions was not sent or reverted.
+    outcomes holds one dict per call, in order, with its action, the id it
+    writes, its tx_hash (None if not sent), receipt status and error.
+    """
+
+    def __init__(self, message: str, outcomes: list):
+        super().__init__(message)
+        self.outcomes = outcomes
+
+
+def wait_for_receipts(self, pending: list) -> list:
+    """Waits on several in-flight (tx_hash, action) pairs, raising if any reverted"""
+    receipts = wait_for_mined(self, pending)
+    for (tx_hash, action), receipt in zip(pending, receipts):
+        if receipt.status != 1:
+            raise RuntimeError(f"{action} transaction reverted: {tx_hash.hex()}")
+    return receipts
+
+
+async def async_sign_transaction(self, contract_fn, nonce: int, tx_params: dict = None):
+    """sign_transaction counterpart for AsyncWeb3 clients"""
+    oracle = getattr(self, "fee_oracle", None)
+    if oracle is not None:
+        tx_params = await oracle.tx_params(
+            contract_fn, self.account["address"], tx_params
+        )
+    tx_built = await contract_fn.build_transaction(
+        {
+            "from": self.account["address"],
+            "nonce": nonce,
+            **(tx_params or {}),
+        }
+    )
+    return self.web3.eth.account.sign_transaction(
+        tx_built, self.account["private_key"]
+    )
+
+
+async def _async_rebroadcast(self, tx_signed, error: Exception):
+    """_rebroadcast counterpart for AsyncWeb3 clients"""
+    if not is_already_sent(error):
+        try:
+            await self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        except Exception as e:
+            if not (is_already_sent(e) or is_ambiguous(e)):
+                try:
+                    await self.web3.eth.get_transaction(tx_signed.hash)
+                except Exception:
+                    raise e from None
+    return tx_signed.hash
+
+
+async def async_send_transaction(self, contract_fn, tx_params: dict = None):
+    """send_transaction counterpart for AsyncWeb3 clients"""
+    retried = False
+    while True:
+        nonce = await self._next_nonce()
+        tx_signed = None
+        try:
+            tx_signed = await async_sign_transaction(self, contract_fn, nonce, tx_params)
+            tx_hash = await self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        except Exception as e:
+            if tx_signed is not None and (is_already_sent(e) or is_ambiguous(e)):
+                _confirm_nonce(self, nonce)
+                return await _async_rebroadcast(self, tx_signed, e)
+            await _async_release_nonce(self, nonce, e)
+            _invalidate_fees(self)
+            if retried or not is_nonce_error(e):
+                raise
+            retried = True
+            continue
+        _confirm_nonce(self, nonce)
+        return tx_hash
+
+
+async def async_wait_for_receipts(self, pending: list) -> list:
+    """wait_for_receipts counterpart for AsyncWeb3 clients"""
+    receipts = await asyncio.gather(
+        *[self._wait_for_receipt(tx_hash, action) for tx_hash, action in pending]
+    )
+    for (tx_hash, action), receipt in zip(pending, receipts):
+        if receipt.status != 1:
+            raise RuntimeError(f"{action} transaction reverted: {tx_hash.hex()}")
+    return list(receipts)
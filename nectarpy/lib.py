@@ -1,18 +1,40 @@
 import os
-import time
-import secrets
-from datetime import datetime, timedelta
+import json
+import dill
 from web3 import Web3
-from web3.exceptions import TimeExhausted
 from web3.types import TxReceipt
 from nectarpy.common import encryption
-from nectarpy.common.blockchain_init import blockchain_init
+from nectarpy.common.blockchain_init import ContractsMixin, blockchain_init
+from nectarpy.common.inventory import Inventory
+from nectarpy.common.metadata import (
+    MetadataCache,
+    get_bucket_policy_ids,
+    read_buckets,
+    read_policies,
+)
+from nectarpy.common.offline import OwnerBatch, replay_transactions
+from nectarpy.common.policies import (
+    contract_supports_function,
+    prepare_bucket,
+    prepare_disclosure_operations,
+    prepare_policy,
+    validate_disclosure_operations,
+)
+from nectarpy.common.queries import VALID_DISCLOSURE_OPERATIONS
+from nectarpy.common.receipts import wait_for_mined
+from nectarpy.common.result_waiter import wait_for_raw_result
+from nectarpy.common.roles import read_user_role
+from nectarpy.common.transactions import (
+    BatchError,
+    estimate_add_bucket_gas,
+    estimate_disclosure_gas,
+    send_transaction,
+)
 
 current_dir = os.path.dirname(__file__)
-VALID_DISCLOSURE_OPERATIONS = ["count", "sum", "mean", "min", "max"]
 
 
-class Nectar:
+class Nectar(ContractsMixin):
     """Client for sending queries to Nectar"""
 
     def __init__(self, api_secret: str, mode: str = "moonbeam"):
@@ -22,34 +44,23 @@ class Nectar:
     def _contract_supports_function(
         self, function_name: str, arg_count: int = None
     ) -> bool:
-        """Check function support by ABI when available; default to True for unknown ABI."""
-        contract = getattr(self, "EoaBond", None)
-        abi = getattr(contract, "abi", None)
-        if not isinstance(abi, list):
-            return True
-        for item in abi:
-            if item.get("type") != "function":
-                continue
-            if item.get("name") != function_name:
-                continue
-            if arg_count is None or len(item.get("inputs", [])) == arg_count:
-                return True
-        return False
+        return contract_supports_function(self, function_name, arg_count)
 
     def _next_nonce(self) -> int:
-        return self.web3.eth.get_transaction_count(self.account["address"], "pending")
+        manager = getattr(self, "nonce_manager", None)
+        if manager is None:
+            return self.web3.eth.get_transaction_count(
+                self.account["address"], "pending"
+            )
+        return manager.allocate()
 
     def _wait_for_receipt(self, tx_hash, action: str) -> TxReceipt:
-        timeout = int(os.getenv("NECTAR_TX_RECEIPT_TIMEOUT", "180"))
-        poll_latency = int(os.getenv("NECTAR_TX_RECEIPT_POLL", "5"))
-        try:
-            return self.web3.eth.wait_for_transaction_receipt(
-                tx_hash, timeout=timeout, poll_latency=poll_latency
-            )
-        except TimeExhausted as exc:
-            raise TimeoutError(
-                f"{action} transaction not mined within {timeout}s: {tx_hash.hex()}"
-            ) from exc
+        return wait_for_mined(self, [(tx_hash, action)])[0]
+
+    def _invalidate_policy(self, policy_id: int):
+        cache = getattr(self, "metadata_cache", None)
+        if cache is not None:
+            cache.invalidate_policy(policy_id)
 
     def sans_hex_prefix(self, hexval: str) -> str:
         """Returns a hex string without the 0x prefix"""
@@ -60,18 +71,9 @@ class Nectar:
     def approve_payment(self, amount: int) -> TxReceipt:
         """Approves an EC20 query payment"""
         print("approving query payment...")
-        approve_tx = self.USDC.functions.approve(
-            self.qm_contract_addr, amount
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
-        )
-        approve_signed = self.web3.eth.account.sign_transaction(
-            approve_tx, self.account["private_key"]
+        approve_hash = send_transaction(
+            self, self.USDC.functions.approve(self.qm_contract_addr, amount)
         )
-        approve_hash = self.web3.eth.send_raw_transaction(approve_signed.rawTransaction)
         receipt = self._wait_for_receipt(approve_hash, "approve")
         if receipt.status != 1:
             raise RuntimeError(f"approve transaction reverted: {approve_hash.hex()}")
@@ -88,69 +90,57 @@ class Nectar:
     ) -> tuple:
         """Sends a query along with a payment"""
         print("encrypting query under star node key...")
-        encrypted_query = encryption.hybrid_encrypt_v1(self, query_str=query)
+        encrypted_query = encryption.hybrid_encrypt(self, query_str=query)
         print("sending query with payment...")
         user_index = self.QueryManager.functions.getUserIndex(
             self.account["address"]
         ).call()
-        query_tx = self.QueryManager.functions.payQuery(
-            user_index,
-            encrypted_query,
-            use_allowlists,
-            access_indexes,
-            price,
-            bucket_ids,
-            policy_indexes,
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
-        )
-        query_signed = self.web3.eth.account.sign_transaction(
-            query_tx, self.account["private_key"]
+        query_hash = send_transaction(
+            self,
+            self.QueryManager.functions.payQuery(
+                user_index,
+                encrypted_query,
+                use_allowlists,
+                access_indexes,
+                price,
+                bucket_ids,
+                policy_indexes,
+            ),
         )
-        query_hash = self.web3.eth.send_raw_transaction(query_signed.rawTransaction)
         query_receipt = self._wait_for_receipt(query_hash, "pay_query")
         if query_receipt.status != 1:
             raise RuntimeError(f"pay_query transaction reverted: {query_hash.hex()}")
         return user_index, query_receipt
 
-    def wait_for_query_result(self, user_index: str) -> str:
+    def wait_for_query_result(self, user_index: str, timeout: float = None) -> str:
         """Waits for the query result to be available"""
         print("waiting for mpc result...")
-        result = ""
-        while not result:
-            query = self.QueryManager.functions.getQueryByUserIndex(
-                self.account["address"], user_index
-            ).call()
-            time.sleep(5)
-            if query[2] != "":
-                result = query[2]
+        result = wait_for_raw_result(self, user_index, timeout=timeout)
         print("decrypting result...")
-        decrypted = encryption.hybrid_decrypt_v1(self, result)
-        return self._decode_decrypted_result(decrypted)
+        return encryption.open_result(self, result, self._decode_decrypted_result)
 
     def get_pay_amount(self, bucket_ids: list, policy_indexes: list) -> int:
-        policy_ids = []
-        for i in range(len(bucket_ids)):
-            p = self.EoaBond.functions.getPolicyIds(bucket_ids[i]).call()[
-                policy_indexes[i]
-            ]
-            policy_ids.append(p)
-        prices = [self.read_policy(p)["price"] for p in policy_ids]
-        return sum(prices)
+        bucket_policy_ids = get_bucket_policy_ids(self, bucket_ids)
+        policy_ids = [
+            bucket_policy_ids[i][policy_indexes[i]] for i in range(len(bucket_ids))
+        ]
+        unique_ids = list(dict.fromkeys(policy_ids))
+        policies = dict(zip(unique_ids, self.read_policies(unique_ids)))
+        return sum(policies[p]["price"] for p in policy_ids)
 
     def check_if_is_valid_user_role(self) -> str:
         """Getting current role"""
-        roleName = self.UserRole.functions.getUserRole(self.account["address"]).call()
+        roleName = read_user_role(self)
         if roleName not in ["DO"]:
             raise RuntimeError(
                 "Unauthorized action: Your role does not have permission to perform this operation"
             )
-        print(f"Current user role: {roleName}")
         return roleName
 
+    def refresh_role(self) -> str:
+        """Re-reads the account role from UserRole, bypassing the role cache"""
+        return read_user_role(self, refresh=True)
+
     def add_policy(
         self,
         allowed_categories: list,
@@ -165,106 +155,27 @@ class Nectar:
         print(f'web 3 account {self.account["address"]}')
         self.check_if_is_valid_user_role()
 
-        if len(allowed_addresses) == 0:
-            raise RuntimeError("allowed_addresses check failed.")
-
-        if len(allowed_columns) == 0:
-            raise RuntimeError("allowed_columns check failed.")
-
-        if len(allowed_categories) == 0:
-            raise RuntimeError("allowed_categories check failed.")
-
-        if valid_days <= 0:
-            raise RuntimeError("valid_days must be greater than 0.")
-
-        if usd_price <= 0:
-            raise ValueError("usd_price must be greater than 0.")
-
-        if not isinstance(usd_price, (int, float)):
-            raise TypeError("usd_price is invalid.")
-
-        if identity_disclosure_operations is None:
-            identity_disclosure_operations = []
-
-        for op in identity_disclosure_operations:
-            if op not in VALID_DISCLOSURE_OPERATIONS:
-                raise ValueError(
-                    f"Invalid operation: {op}. "
-                    f"Must be one of {VALID_DISCLOSURE_OPERATIONS}"
-                )
-
-        price = Web3.to_wei(usd_price, "mwei")
-        policy_id = secrets.randbits(256)
-        edo = datetime.now() + timedelta(days=valid_days)
-        exp_date = int(time.mktime(edo.timetuple()))
-
-        for i in range(len(allowed_addresses)):
-            checksum_address = Web3.to_checksum_address(allowed_addresses[i])
-            allowed_addresses[i] = checksum_address
-
-        supports_add_policy_with_disclosure = self._contract_supports_function(
-            "addPolicy", arg_count=7
-        )
-        supports_set_disclosure = self._contract_supports_function(
-            "setIdentityDisclosureOperations", arg_count=2
-        )
-
-        if (
-            identity_disclosure_operations
-            and not supports_add_policy_with_disclosure
-            and not supports_set_disclosure
-        ):
-            raise RuntimeError(
-                "Connected EoaBond ABI does not support identity disclosure "
-                "operations. Update contract/ABI before using this feature."
-            )
-
-        if supports_add_policy_with_disclosure:
-            tx_built = self.EoaBond.functions.addPolicy(
-                policy_id,
-                allowed_categories,
-                allowed_addresses,
-                allowed_columns,
-                exp_date,
-                price,
-                identity_disclosure_operations,
-            ).build_transaction(
-                {
-                    "from": self.account["address"],
-                    "nonce": self._next_nonce(),
-                }
-            )
-        else:
-            tx_built = self.EoaBond.functions.addPolicy(
-                policy_id,
-                allowed_categories,
-                allowed_addresses,
-                allowed_columns,
-                exp_date,
-                price,
-            ).build_transaction(
-                {
-                    "from": self.account["address"],
-                    "nonce": self._next_nonce(),
-                }
-            )
-        tx_signed = self.web3.eth.account.sign_transaction(
-            tx_built, self.account["private_key"]
+        policy_id, add_policy_fn, set_disclosure_after = self._prepare_policy(
+            allowed_categories,
+            allowed_addresses,
+            allowed_columns,
+            valid_days,
+            usd_price,
+            identity_disclosure_operations,
         )
-        tx_hash = self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        tx_hash = send_transaction(self, add_policy_fn)
         receipt = self._wait_for_receipt(tx_hash, "add_policy")
         if receipt.status != 1:
             raise RuntimeError(f"add_policy transaction reverted: {tx_hash.hex()}")
-        if (
-            identity_disclosure_operations
-            and not supports_add_policy_with_disclosure
-            and supports_set_disclosure
-        ):
+        if set_disclosure_after:
             self.set_identity_disclosure_operations(
                 policy_id, identity_disclosure_operations
             )
         return policy_id
 
+    def _prepare_policy(self, *args, **kwargs) -> tuple:
+        return prepare_policy(self, *args, **kwargs)
+
     def get_bucket_ids(self, address: str = None) -> list:
         print("DO get get_bucket_ids...")
         try:
@@ -289,62 +200,65 @@ class Nectar:
 
     def read_policy(self, policy_id: int) -> dict:
         """Fetches a policy on the blockchain"""
-        policy_data = self.EoaBond.functions.policies(policy_id).call()
-        identity_disclosure_operations = []
-        if self._contract_supports_function(
-            "getIdentityDisclosureOperations", arg_count=1
-        ):
-            identity_disclosure_operations = (
-                self.EoaBond.functions.getIdentityDisclosureOperations(policy_id).call()
-            )
-        return {
-            "policy_id": policy_id,
-            "allowed_categories": self.EoaBond.functions.getAllowedCategories(
-                policy_id
-            ).call(),
-            "allowed_addresses": self.EoaBond.functions.getAllowedAddresses(
-                policy_id
-            ).call(),
-            "allowed_columns": self.EoaBond.functions.getAllowedColumns(
-                policy_id
-            ).call(),
-            "exp_date": policy_data[0],
-            "price": policy_data[1],
-            "owner": policy_data[2],
-            "deactivated": policy_data[3],
-            "identity_disclosure_operations": identity_disclosure_operations,
-        }
+        return self.read_policies([policy_id])[0]
+
+    def read_policies(self, policy_ids: list) -> list:
+        """Fetches several policies on the blockchain in one batched request"""
+        policies = read_policies(
+            self,
+            policy_ids,
+            with_disclosure_operations=self._contract_supports_function(
+                "getIdentityDisclosureOperations", arg_count=1
+            ),
+        )
+        for policy in policies:
+            policy.setdefault("identity_disclosure_operations", [])
+        return policies
+
+    def enable_metadata_cache(
+        self, ttl: float = 300, maxsize: int = 1024
+    ) -> MetadataCache:
+        """Caches policy and bucket reads until they expire or change on-chain"""
+        self.metadata_cache = MetadataCache(
+            self.web3, self.EoaBond, ttl=ttl, maxsize=maxsize
+        )
+        return self.metadata_cache
+
+    def sync_inventory(self, event_poll: float = 6) -> Inventory:
+        """Loads all of this owner's buckets and policies and keeps them current from events"""
+        self.inventory = Inventory(self, event_poll=event_poll)
+        self.inventory.sync()
+        return self.inventory
+
+    def _inventory(self) -> Inventory:
+        if getattr(self, "inventory", None) is None:
+            return self.sync_inventory()
+        return self.inventory
+
+    def list_buckets(self, include_deactivated: bool = False, policy_id: int = None) -> list:
+        """Lists this owner's buckets from the local inventory"""
+        return self._inventory().list_buckets(include_deactivated, policy_id)
+
+    def list_policies(self, include_deactivated: bool = False, bucket_id: int = None) -> list:
+        """Lists this owner's policies from the local inventory"""
+        return self._inventory().list_policies(include_deactivated, bucket_id)
 
     def set_identity_disclosure_operations(
         self, policy_id: int, operations: list
     ) -> dict:
         """Update which operations allow categorized results for a policy."""
-        if not self._contract_supports_function(
-            "setIdentityDisclosureOperations", arg_count=2
-        ):
-            raise RuntimeError(
-                "Connected EoaBond ABI does not support setIdentityDisclosureOperations."
-            )
-        for op in operations:
-            if op not in VALID_DISCLOSURE_OPERATIONS:
-                raise ValueError(
-                    f"Invalid operation: {op}. "
-                    f"Must be one of {VALID_DISCLOSURE_OPERATIONS}"
-                )
-
-        tx_built = self.EoaBond.functions.setIdentityDisclosureOperations(
-            policy_id, operations
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
-        )
-        tx_signed = self.web3.eth.account.sign_transaction(
-            tx_built, self.account["private_key"]
+        tx_hash = send_transaction(
+            self, self._prepare_disclosure_operations(policy_id, operations)
         )
-        tx_hash = self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
-        return self._wait_for_receipt(tx_hash, "set_identity_disclosure_operations")
+        receipt = self._wait_for_receipt(tx_hash, "set_identity_disclosure_operations")
+        self._invalidate_policy(policy_id)
+        return receipt
+
+    def _validate_disclosure_operations(self, operations: list):
+        validate_disclosure_operations(operations)
+
+    def _prepare_disclosure_operations(self, policy_id: int, operations: list):
+        return prepare_disclosure_operations(self, policy_id, operations)
 
     def add_bucket(
         self,
@@ -355,64 +269,183 @@ class Nectar:
     ) -> int:
         """Set a new on-chain bucket"""
         print("adding new bucket...")
-        if not isinstance(policy_ids, list) or len(policy_ids) == 0:
-            raise ValueError("policy_ids must be a non-empty list")
-
-        if not isinstance(use_allowlists, list):
-            raise TypeError("use_allowlists must be a list of booleans")
-        for flag in use_allowlists:
-            if not isinstance(flag, bool):
-                raise TypeError(f"Invalid use_allowlists element: {flag}, must be bool")
-
-        if not isinstance(data_format, str) or not data_format.strip():
-            raise ValueError("data_format must be a non-empty string")
-
-        allowed_formats = ["std1"]
-        if data_format not in allowed_formats:
-            raise ValueError(
-                f"Invalid data_format: {data_format}, must be one of {allowed_formats}"
-            )
-
-        if not isinstance(node_address, str) or not node_address.strip():
-            raise ValueError("node_address must be a non-empty string")
-
-        if len(use_allowlists) != len(policy_ids):
-            raise ValueError(
-                f"use_allowlists length ({len(use_allowlists)}) must equal policy_ids length ({len(policy_ids)})"
-            )
-
-        bucket_id = secrets.randbits(256)
-        print(f"use_allowlists =====>{use_allowlists}")
-        tx_built = self.EoaBond.functions.addBucket(
-            bucket_id, policy_ids, use_allowlists, data_format, node_address
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
-        )
-
-        tx_signed = self.web3.eth.account.sign_transaction(
-            tx_built, self.account["private_key"]
+        bucket_id, add_bucket_fn = self._prepare_bucket(
+            policy_ids, use_allowlists, data_format, node_address
         )
-        tx_hash = self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
+        print(f"use_allowlists =====>{use_allowlists}")
+        tx_hash = send_transaction(self, add_bucket_fn)
         receipt = self._wait_for_receipt(tx_hash, "add_bucket")
         if receipt.status != 1:
             raise RuntimeError(f"add_bucket transaction reverted: {tx_hash.hex()}")
         print("adding new bucket - done")
         return bucket_id
 
+    def _prepare_bucket(self, *args, **kwargs) -> tuple:
+        return prepare_bucket(self, *args, **kwargs)
+
+    def _send_all(self, calls: list) -> list:
+        """
+        Broadcasts (contract_fn, tx_params, action) calls back to back on
+        consecutive nonces, then waits for all of them together. Returns the
+        outcome of each call, or raises BatchError carrying them if any call
+        was not sent or reverted.
+        """
+        outcomes = []
+        error = None
+        for contract_fn, tx_params, action in calls:
+            # Every batched call takes the policy or bucket id it writes first.
+            outcome = {
+                "action": action,
+                "id": contract_fn.args[0],
+                "tx_hash": None,
+                "status": None,
+                "error": None,
+            }
+            outcomes.append(outcome)
+            if error is not None:
+                outcome["error"] = "not sent"
+                continue
+            try:
+                outcome["tx_hash"] = send_transaction(self, contract_fn, tx_params)
+            except Exception as e:
+                error = e
+                outcome["error"] = str(e)
+
+        sent = [o for o in outcomes if o["tx_hash"] is not None]
+        try:
+            receipts = wait_for_mined(self, [(o["tx_hash"], o["action"]) for o in sent])
+        except TimeoutError as e:
+            raise BatchError(str(e), outcomes) from e
+        for outcome, receipt in zip(sent, receipts):
+            outcome["status"] = receipt.status
+            if receipt.status != 1:
+                outcome["error"] = "reverted"
+
+        failed = [o for o in outcomes if o["error"] is not None]
+        if failed:
+            first = failed[0]
+            raise BatchError(
+                f"{len(failed)} of {len(calls)} transactions failed, first"
+                f" {first['action']} for {first['id']}: {first['error']}",
+                outcomes,
+            ) from error
+        return outcomes
+
+    def _policy_batch(self, policies: list) -> tuple:
+        """Validates policy settings, returning (policy_ids, calls) for _send_all"""
+        policy_ids, calls = [], []
+        for policy in policies:
+            policy_id, add_policy_fn, set_disclosure_after = self._prepare_policy(**policy)
+            policy_ids.append(policy_id)
+            calls.append((add_policy_fn, None, "add_policy"))
+            if set_disclosure_after:
+                operations = policy["identity_disclosure_operations"]
+                calls.append(
+                    (
+                        self.EoaBond.functions.setIdentityDisclosureOperations(
+                            policy_id, operations
+                        ),
+                        {"gas": estimate_disclosure_gas(len(operations))},
+                        "set_identity_disclosure_operations",
+                    )
+                )
+        return policy_ids, calls
+
+    def _bucket_batch(self, buckets: list, new_policy_ids: set = frozenset()) -> tuple:
+        """Validates bucket settings, returning (bucket_ids, calls) for _send_all"""
+        bucket_ids, calls = [], []
+        for bucket in buckets:
+            bucket_id, add_bucket_fn = self._prepare_bucket(**bucket)
+            bucket_ids.append(bucket_id)
+            tx_params = None
+            if new_policy_ids.intersection(bucket["policy_ids"]):
+                tx_params = {"gas": estimate_add_bucket_gas(len(bucket["policy_ids"]))}
+            calls.append((add_bucket_fn, tx_params, "add_bucket"))
+        return bucket_ids, calls
+
+    def add_policies(self, policies: list) -> list:
+        """
+        Sets several on-chain policies at once and returns their ids.
+        Each policy is a dict of add_policy arguments; all of them are
+        validated before anything is sent.
+        """
+        print(f"adding {len(policies)} policies...")
+        self.check_if_is_valid_user_role()
+        policy_ids, calls = self._policy_batch(policies)
+        self._send_all(calls)
+        return policy_ids
+
+    def add_buckets(self, buckets: list) -> list:
+        """
+        Sets several on-chain buckets at once and returns their ids.
+        Each bucket is a dict of add_bucket arguments; all of them are
+        validated before anything is sent.
+        """
+        print(f"adding {len(buckets)} buckets...")
+        self.check_if_is_valid_user_role()
+        bucket_ids, calls = self._bucket_batch(buckets)
+        self._send_all(calls)
+        return bucket_ids
+
+    def provision(self, spec: dict) -> dict:
+        """
+        Creates named policies and buckets in one batch of transactions.
+
+        spec maps "policies" to {name: add_policy arguments} and "buckets" to
+        {name: add_bucket arguments}, where a bucket's policy_ids may name
+        policies from the same spec. Returns the same structure with the
+        new on-chain ids in place of the arguments.
+        """
+        print(
+            f"provisioning {len(spec.get('policies', {}))} policies"
+            f" and {len(spec.get('buckets', {}))} buckets..."
+        )
+        self.check_if_is_valid_user_role()
+        created, calls = self._provision_calls(spec)
+        self._send_all(calls)
+        return created
+
+    def _provision_calls(self, spec: dict) -> tuple:
+        """Validates a provision spec, returning (created ids, calls) for _send_all"""
+        policies = spec.get("policies", {})
+        buckets = spec.get("buckets", {})
+        policy_ids, policy_calls = self._policy_batch(list(policies.values()))
+        named = dict(zip(policies, policy_ids))
+
+        resolved = []
+        for name, bucket in buckets.items():
+            bucket = dict(bucket)
+            ids = []
+            for policy in bucket.get("policy_ids", []):
+                if isinstance(policy, str):
+                    if policy not in named:
+                        raise ValueError(f"Bucket {name} uses unknown policy {policy}")
+                    policy = named[policy]
+                ids.append(policy)
+            bucket["policy_ids"] = ids
+            resolved.append(bucket)
+        bucket_ids, bucket_calls = self._bucket_batch(resolved, set(policy_ids))
+
+        # Nonce order puts every policy on-chain before the buckets using it.
+        created = {"policies": named, "buckets": dict(zip(buckets, bucket_ids))}
+        return created, policy_calls + bucket_calls
+
+    def offline_batch(
+        self, nonce: int, fees: dict, gas_limits: dict = None
+    ) -> OwnerBatch:
+        """
+        Starts a batch of policy and bucket writes that are signed locally,
+        from nonce on and with fees as given, without contacting a node
+        """
+        return OwnerBatch(self, nonce, fees, gas_limits)
+
+    def replay(self, path, wait: bool = True) -> list:
+        """Broadcasts a file saved from offline_batch and waits for its receipts"""
+        return replay_transactions(self, path, wait)
+
     def read_bucket(self, bucket_id: int) -> dict:
         """Fetches a bucket from the blockchain"""
-        bucket_data = self.EoaBond.functions.buckets(bucket_id).call()
-        return {
-            "bucket_id": bucket_id,
-            "policy_ids": self.EoaBond.functions.getPolicyIds(bucket_id).call(),
-            "data_format": bucket_data[0],
-            "node_address": bucket_data[1],
-            "owner": bucket_data[2],
-            "deactivated": bucket_data[3],
-        }
+        return read_buckets(self, [bucket_id])[0]
 
     def deactivate_policy(
         self,
@@ -420,23 +453,18 @@ class Nectar:
     ) -> TxReceipt:
         """Deactivates a policy"""
         print("deactivating policy...")
-        tx_built = self.EoaBond.functions.deactivatePolicy(policy_id).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
+        tx_hash = send_transaction(
+            self, self.EoaBond.functions.deactivatePolicy(policy_id)
         )
-        tx_signed = self.web3.eth.account.sign_transaction(
-            tx_built, self.account["private_key"]
-        )
-        tx_hash = self.web3.eth.send_raw_transaction(tx_signed.rawTransaction)
-        return self._wait_for_receipt(tx_hash, "deactivate_policy")
+        receipt = self._wait_for_receipt(tx_hash, "deactivate_policy")
+        self._invalidate_policy(policy_id)
+        return receipt
 
     def _decode_decrypted_result(self, decrypted):
-        if isinstance(decrypted, (bytes, bytearray)):
-            raw = bytes(decrypted)
+        if isinstance(decrypted, (bytes, bytearray, memoryview)):
+            raw = decrypted
             try:
-                text = raw.decode("utf-8")
+                text = str(raw, "utf-8")
                 try:
                     return json.loads(text)
                 except Exception:
@@ -445,7 +473,7 @@ class Nectar:
                 try:
                     return dill.loads(raw)
                 except Exception:
-                    return raw
+                    return bytes(raw)
 
         if isinstance(decrypted, str):
             try:
@@ -0,0 +1,462 @@
+import asyncio
+from web3 import Web3
+from web3.exceptions import ContractLogicError, TimeExhausted, TransactionNotFound
+from web3.types import TxReceipt
+from nectarpy.common.allowance import (
+    AllowanceLedger,
+    allowance_ledger,
+    payment_failed,
+    payment_sent,
+)
+from nectarpy.common.blockchain_init import ContractsMixin, async_blockchain_init
+from nectarpy.common.metadata import (
+    async_get_bucket_policy_ids,
+    async_read_buckets,
+    async_read_policies,
+)
+from nectarpy.common.policies import (
+    contract_supports_function,
+    prepare_bucket,
+    prepare_disclosure_operations,
+    prepare_policy,
+)
+from nectarpy.common.queries import (
+    build_query_str,
+    encrypt_query,
+    open_result,
+    validate_byoc_query,
+)
+from nectarpy.common.receipts import MIN_POLL, receipt_settings
+from nectarpy.common.result_waiter import async_wait_for_raw_result
+from nectarpy.common.roles import async_read_user_role
+from nectarpy.common.transactions import (
+    async_pay_query_gas,
+    async_send_transaction,
+    async_wait_for_receipts,
+)
+from nectarpy.lib_v1 import _report_bucket_error
+
+
+class _AsyncBase(ContractsMixin):
+    """Transaction plumbing shared by the asyncio clients"""
+
+    ROLE = None
+
+    @classmethod
+    async def create(cls, api_secret: str, mode: str = "moonbeam"):
+        """Builds the client and checks the account role, like the sync constructor"""
+        client = cls(api_secret, mode)
+        await client.check_if_is_valid_user_role()
+        return client
+
+    def __init__(self, api_secret: str, mode: str = "moonbeam"):
+        async_blockchain_init(self, api_secret, mode)
+
+    def sans_hex_prefix(self, hexval: str) -> str:
+        """Returns a hex string without the 0x prefix"""
+        if hexval.startswith("0x"):
+            return hexval[2:]
+        return hexval
+
+    async def check_if_is_valid_user_role(self) -> str:
+        """Getting current role"""
+        roleName = await async_read_user_role(self)
+        if roleName not in [self.ROLE]:
+            raise RuntimeError(
+                "Unauthorized action: Your role does not have permission to perform this operation"
+            )
+        return roleName
+
+    async def refresh_role(self) -> str:
+        """Re-reads the account role from UserRole, bypassing the role cache"""
+        return await async_read_user_role(self, refresh=True)
+
+    async def _next_nonce(self) -> int:
+        return await self.nonce_manager.allocate()
+
+    async def _wait_for_receipt(self, tx_hash, action: str) -> TxReceipt:
+        timeout, poll = receipt_settings()
+        try:
+            return await self.web3.eth.wait_for_transaction_receipt(
+                tx_hash, timeout=timeout, poll_latency=MIN_POLL if poll is None else poll
+            )
+        except TimeExhausted as exc:
+            raise TimeoutError(
+                f"{action} transaction {tx_hash.hex()} not mined within {timeout:g}s"
+            ) from exc
+
+    async def _transact(self, contract_fn, action: str) -> TxReceipt:
+        tx_hash = await async_send_transaction(self, contract_fn)
+        receipt = await self._wait_for_receipt(tx_hash, action)
+        if receipt.status != 1:
+            raise RuntimeError(f"{action} transaction reverted: {tx_hash.hex()}")
+        return receipt
+
+    async def approve_payment(self, amount: int) -> TxReceipt:
+        """Approves an EC20 query payment"""
+        print("approving query payment...")
+        return await self._transact(
+            self.USDC.functions.approve(self.qm_contract_addr, amount), "approve"
+        )
+
+    async def get_allowance(self) -> int:
+        """Returns the USDC amount the QueryManager may still spend for this account"""
+        return await self.USDC.functions.allowance(
+            self.account["address"], self.qm_contract_addr
+        ).call()
+
+    async def _user_index(self) -> int:
+        # Concurrent queries must not all read the same on-chain index, so it is
+        # handed out locally like nonces.
+        if not hasattr(self, "_user_index_lock"):
+            self._user_index_lock = asyncio.Lock()
+            self._next_user_index = None
+        async with self._user_index_lock:
+            if self._next_user_index is None:
+                self._next_user_index = (
+                    await self.QueryManager.functions.getUserIndex(
+                        self.account["address"]
+                    ).call()
+                )
+            user_index = self._next_user_index
+            self._next_user_index += 1
+            return user_index
+
+    async def _resync_user_index(self, user_index: int):
+        """NectarClient._resync_user_index counterpart"""
+        async with self._user_index_lock:
+            next_index = self._next_user_index
+            if next_index is None:
+                return
+            if next_index == user_index + 1:
+                next_index = user_index
+            try:
+                on_chain = await self.QueryManager.functions.getUserIndex(
+                    self.account["address"]
+                ).call()
+            except Exception as e:
+                print("cannot re-read user index, keeping local counter:", e)
+                on_chain = next_index
+            self._next_user_index = max(next_index, on_chain)
+
+
+class AsyncNectarClient(_AsyncBase):
+    """Asyncio client for sending queries to Nectar"""
+
+    ROLE = "DA"
+
+    async def read_policy(self, policy_id: int) -> dict:
+        """Fetches a policy on the blockchain"""
+        return (await self.read_policies([policy_id]))[0]
+
+    async def read_policies(self, policy_ids: list) -> list:
+        """Fetches several policies on the blockchain in one batched request"""
+        return await async_read_policies(self, policy_ids)
+
+    async def get_pay_amount(self, bucket_ids: list, policy_indexes: list) -> int:
+        bucket_policy_ids = await async_get_bucket_policy_ids(
+            self, bucket_ids, return_exceptions=True
+        )
+        policy_ids = []
+        for i in range(len(bucket_ids)):
+            result = bucket_policy_ids[i]
+            if isinstance(result, ContractLogicError):
+                _report_bucket_error(bucket_ids[i], result)
+                return 0
+            if isinstance(result, Exception):
+                raise result
+            policy_ids.append(result[policy_indexes[i]])
+
+        unique_ids = list(dict.fromkeys(policy_ids))
+        policies = dict(zip(unique_ids, await self.read_policies(unique_ids)))
+        return sum(policies[p]["price"] for p in policy_ids)
+
+    async def _settle_payments(self, ledger: AllowanceLedger):
+        for tx_hash in ledger.pending_hashes():
+            try:
+                await self.web3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+            except Exception as e:
+                print("cannot check payQuery receipt, counting it as pending:", e)
+                continue
+            ledger.settle(tx_hash)
+
+    async def ensure_allowance(
+        self, amount: int, budget: int = None, reuse: bool = True, wait: bool = True
+    ):
+        """NectarClient.ensure_allowance counterpart"""
+        ledger = allowance_ledger(self)
+        lock = self.__dict__.setdefault("_allowance_lock", asyncio.Lock())
+        async with lock:
+            await self._settle_payments(ledger)
+            in_flight = ledger.total()
+            result = None
+            if reuse and await self.get_allowance() >= in_flight + amount:
+                print("existing allowance covers payment, skipping approve")
+            elif wait:
+                result = await self.approve_payment(
+                    in_flight + max(amount, budget or 0)
+                )
+            else:
+                result = await async_send_transaction(
+                    self,
+                    self.USDC.functions.approve(
+                        self.qm_contract_addr, in_flight + max(amount, budget or 0)
+                    ),
+                )
+            ledger.reserve(amount)
+            return result
+
+    async def pay_query(
+        self,
+        query_str,
+        price: int,
+        bucket_ids: list,
+        policy_indexes: list,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+        approve_hash=None,
+    ) -> tuple:
+        """
+        Sends a query along with a payment. With the hash of an approve that
+        is not mined yet, waits for both transactions.
+        """
+        try:
+            ppcCmd = encrypt_query(
+                self, query_str, policy_indexes, categorize_by_do, aggregate_type
+            )
+        except Exception:
+            payment_failed(self, price)
+            raise
+        try:
+            gas = await async_pay_query_gas(self, ppcCmd, len(bucket_ids))
+        except Exception:
+            payment_failed(self, price)
+            raise
+        print("sending query with payment...")
+        user_index = await self._user_index()
+        query_hash = None
+        try:
+            tx_params = None
+            if approve_hash is not None:
+                # payQuery cannot be gas-estimated until the approve is mined.
+                tx_params = {"gas": gas}
+            query_hash = await async_send_transaction(
+                self,
+                self.QueryManager.functions.payQuery(
+                    user_index, ppcCmd, price, bucket_ids, policy_indexes
+                ),
+                tx_params,
+            )
+            payment_sent(self, price, query_hash)
+            if approve_hash is None:
+                query_receipt = await self._wait_for_receipt(query_hash, "pay_query")
+                if query_receipt.status != 1:
+                    raise RuntimeError(
+                        f"pay_query transaction reverted: {query_hash.hex()}"
+                    )
+            else:
+                _, query_receipt = await async_wait_for_receipts(
+                    self, [(approve_hash, "approve"), (query_hash, "pay_query")]
+                )
+        except Exception:
+            if query_hash is None:
+                payment_failed(self, price)
+            await self._resync_user_index(user_index)
+            raise
+        allowance_ledger(self).settle(query_hash)
+        return user_index, query_receipt
+
+    async def approve_and_pay_query(
+        self,
+        query_str,
+        price: int,
+        bucket_ids: list,
+        policy_indexes: list,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+        approve_amount: int = None,
+    ) -> tuple:
+        """Sends the approve and the paid query back to back, then waits on both"""
+        print("sending payment approval and query...")
+        approve_hash = await self.ensure_allowance(
+            price, approve_amount, reuse=False, wait=False
+        )
+        return await self.pay_query(
+            query_str,
+            price,
+            bucket_ids,
+            policy_indexes,
+            categorize_by_do,
+            aggregate_type,
+            approve_hash=approve_hash,
+        )
+
+    async def get_result(self, query_index, timeout: float = None):
+        raw = await async_wait_for_raw_result(self, query_index, timeout=timeout)
+        # Opening can fetch a blob and decrypt it, so keep it off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(
+            None, open_result, self, raw
+        )
+
+    async def wait_for_query_result(self, user_index, timeout: float = None):
+        """Waits for the query result to be available"""
+        print("waiting for result...")
+        return await self.get_result(user_index, timeout=timeout)
+
+    async def byoc_query(
+        self,
+        pre_compute_func=None,
+        main_func=None,
+        is_separate_data: bool = False,
+        bucket_ids: list = None,
+        policy_indexes: list = None,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+        pipelined: bool = False,
+        reuse_allowance: bool = False,
+        approve_budget: int = None,
+    ):
+        """Sends a query along with a payment"""
+        await self.check_if_is_valid_user_role()
+        validate_byoc_query(
+            pre_compute_func,
+            main_func,
+            is_separate_data,
+            bucket_ids,
+            policy_indexes,
+            categorize_by_do,
+            aggregate_type,
+        )
+
+        print("Sending query to blockchain...")
+        price = await self.get_pay_amount(bucket_ids, policy_indexes)
+        approved = await self.ensure_allowance(
+            price, approve_budget, reuse=reuse_allowance, wait=not pipelined
+        )
+        query_str = build_query_str(
+            pre_compute_func, main_func, is_separate_data, categorize_by_do
+        )
+        query_kwargs = {
+            "bucket_ids": bucket_ids,
+            "policy_indexes": policy_indexes,
+            "categorize_by_do": categorize_by_do,
+            "aggregate_type": aggregate_type,
+        }
+        # When pipelined, payQuery goes out before the approve is mined.
+        user_index, _ = await self.pay_query(
+            query_str,
+            price,
+            approve_hash=approved if pipelined else None,
+            **query_kwargs,
+        )
+        return await self.wait_for_query_result(user_index)
+
+
+class AsyncNectar(_AsyncBase):
+    """Asyncio client for Data Owner policy and bucket management"""
+
+    ROLE = "DO"
+
+    async def read_policy(self, policy_id: int) -> dict:
+        """Fetches a policy on the blockchain"""
+        return (await self.read_policies([policy_id]))[0]
+
+    async def read_policies(self, policy_ids: list) -> list:
+        """Fetches several policies on the blockchain in one batched request"""
+        policies = await async_read_policies(
+            self,
+            policy_ids,
+            with_disclosure_operations=contract_supports_function(
+                self, "getIdentityDisclosureOperations", arg_count=1
+            ),
+        )
+        for policy in policies:
+            policy.setdefault("identity_disclosure_operations", [])
+        return policies
+
+    async def read_bucket(self, bucket_id: int) -> dict:
+        """Fetches a bucket from the blockchain"""
+        return (await async_read_buckets(self, [bucket_id]))[0]
+
+    async def get_bucket_ids(self, address: str = None) -> list:
+        try:
+            if address is None:
+                return await self.EoaBond.functions.getAllBucketIdsByOwner().call(
+                    {"from": self.account["address"]}
+                )
+            return await self.EoaBond.functions.getOwnerBucketIdsByAddress(
+                Web3.to_checksum_address(address)
+            ).call()
+        except Exception as e:
+            print("get_bucket_ids call failed:", e)
+            return []
+
+    async def get_pay_amount(self, bucket_ids: list, policy_indexes: list) -> int:
+        bucket_policy_ids = await async_get_bucket_policy_ids(self, bucket_ids)
+        policy_ids = [
+            bucket_policy_ids[i][policy_indexes[i]] for i in range(len(bucket_ids))
+        ]
+        unique_ids = list(dict.fromkeys(policy_ids))
+        policies = dict(zip(unique_ids, await self.read_policies(unique_ids)))
+        return sum(policies[p]["price"] for p in policy_ids)
+
+    async def add_policy(
+        self,
+        allowed_categories: list,
+        allowed_addresses: list,
+        allowed_columns: list,
+        valid_days: int,
+        usd_price: float,
+        identity_disclosure_operations: list = None,
+    ) -> int:
+        """Set a new on-chain policy"""
+        print("adding new policy...")
+        await self.check_if_is_valid_user_role()
+        policy_id, add_policy_fn, set_disclosure_after = prepare_policy(
+            self,
+            allowed_categories,
+            allowed_addresses,
+            allowed_columns,
+            valid_days,
+            usd_price,
+            identity_disclosure_operations,
+        )
+        await self._transact(add_policy_fn, "add_policy")
+        if set_disclosure_after:
+            await self.set_identity_disclosure_operations(
+                policy_id, identity_disclosure_operations
+            )
+        return policy_id
+
+    async def set_identity_disclosure_operations(
+        self, policy_id: int, operations: list
+    ) -> TxReceipt:
+        """Update which operations allow categorized results for a policy."""
+        return await self._transact(
+            prepare_disclosure_operations(self, policy_id, operations),
+            "set_identity_disclosure_operations",
+        )
+
+    async def add_bucket(
+        self,
+        policy_ids: list,
+        use_allowlists: list,
+        data_format: str,
+        node_address: str,
+    ) -> int:
+        """Set a new on-chain bucket"""
+        print("adding new bucket...")
+        bucket_id, add_bucket_fn = prepare_bucket(
+            self, policy_ids, use_allowlists, data_format, node_address
+        )
+        await self._transact(add_bucket_fn, "add_bucket")
+        return bucket_id
+
+    async def deactivate_policy(self, policy_id: int) -> TxReceipt:
+        """Deactivates a policy"""
+        print("deactivating policy...")
+        return await self._transact(
+            self.EoaBond.functions.deactivatePolicy(policy_id), "deactivate_policy"
+        )
@@ -1,17 +1,61 @@
-import json
 import os
-import time
-import dill
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from web3.types import TxReceipt
-from web3.exceptions import ContractLogicError, TimeExhausted
-from nectarpy.common import encryption
-from nectarpy.common.blockchain_init import blockchain_init
+from web3.exceptions import ContractLogicError, TransactionNotFound
+from nectarpy.common.allowance import (
+    AllowanceLedger,
+    allowance_ledger,
+    payment_failed,
+    payment_sent,
+)
+from nectarpy.common.blob_store import OFFLOAD_MIN_BYTES, BlobStore
+from nectarpy.common.blockchain_init import ContractsMixin, blockchain_init
+from nectarpy.common.history import QueryHistory
+from nectarpy.common.metadata import MetadataCache, get_bucket_policy_ids, read_policies
+from nectarpy.common.offline import AnalystBatch, replay_transactions
+from nectarpy.common.query_handle import QueryHandle
+from nectarpy.common.queries import (
+    VALID_DISCLOSURE_OPERATIONS,
+    build_query_str,
+    decode_decrypted_result,
+    encrypt_query,
+    open_result,
+    validate_byoc_query,
+)
+from nectarpy.common.result_cache import ResultCache, query_fingerprint
+from nectarpy.common.receipts import wait_for_mined
+from nectarpy.common.result_waiter import wait_for_raw_result
+from nectarpy.common.roles import read_user_role
+from nectarpy.common.transactions import (
+    pay_query_gas,
+    send_transaction,
+    wait_for_receipts,
+)
 
 current_dir = os.path.dirname(__file__)
-VALID_DISCLOSURE_OPERATIONS = ["count", "sum", "mean", "min", "max"]
-
-
-class NectarClient:
+QUERY_SPEC_DEFAULTS = {
+    "pre_compute_func": None,
+    "main_func": None,
+    "is_separate_data": False,
+    "bucket_ids": None,
+    "policy_indexes": None,
+    "categorize_by_do": False,
+    "aggregate_type": None,
+}
+
+
+def _report_bucket_error(bucket_id, error: ContractLogicError):
+    error_message = str(error)
+    if "BucketNotFound" in error_message:
+        print(f"Error: Bucket ID {bucket_id} does not exist.")
+    elif "NoPolicyIdsInBucket" in error_message:
+        print(f"Error: Bucket ID {bucket_id} has no policy IDs.")
+    else:
+        print(f"Smart contract error: {error}")
+
+
+class NectarClient(ContractsMixin):
     """Client for sending queries to Nectar"""
 
     def __init__(self, api_secret: str, mode: str = "moonbeam"):
@@ -26,91 +70,248 @@ class NectarClient:
 
     def read_policy(self, policy_id: int) -> dict:
         """Fetches a policy on the blockchain"""
+        return self.read_policies([policy_id])[0]
+
+    def read_policies(self, policy_ids: list) -> list:
+        """Fetches several policies on the blockchain in one batched request"""
+        return read_policies(self, policy_ids)
+
+    def enable_metadata_cache(
+        self, ttl: float = 300, maxsize: int = 1024
+    ) -> MetadataCache:
+        """Caches policy and bucket reads until they expire or change on-chain"""
+        self.metadata_cache = MetadataCache(
+            self.web3, self.EoaBond, ttl=ttl, maxsize=maxsize
+        )
+        return self.metadata_cache
+
+    def enable_result_cache(
+        self, directory=None, ttl: float = 3600, maxsize: int = 256
+    ) -> ResultCache:
+        """Returns repeat byoc_query results locally, optionally persisted under directory"""
+        self.result_cache = ResultCache(
+            self.web3,
+            self.EoaBond,
+            directory=directory,
+            ttl=ttl,
+            maxsize=maxsize,
+            open_result=self._open_result,
+        )
+        return self.result_cache
 
-        policy_data = self.EoaBond.functions.policies(policy_id).call()
-        return {
-            "policy_id": policy_id,
-            "allowed_categories": self.EoaBond.functions.getAllowedCategories(
-                policy_id
-            ).call(),
-            "allowed_addresses": self.EoaBond.functions.getAllowedAddresses(
-                policy_id
-            ).call(),
-            "allowed_columns": self.EoaBond.functions.getAllowedColumns(
-                policy_id
-            ).call(),
-            "exp_date": policy_data[0],
-            "price": policy_data[1],
-            "owner": policy_data[2],
-            "deactivated": policy_data[3],
-        }
+    def query_history(self, path, start_block: int = None) -> QueryHistory:
+        """
+        Opens a local index of this account's queries at path and brings it up
+        to date. A new index starts at start_block, by default the
+        queryManagerBlock of the network in blockchain.json, or the block the
+        QueryManager was deployed in when that is not configured.
+        """
+        if start_block is None:
+            config = getattr(self, "blockchain_config", None) or {}
+            start_block = config.get("queryManagerBlock")
+        history = QueryHistory(
+            self.web3, self.QueryManager, path, user=self.account["address"],
+            start_block=start_block,
+        )
+        history.sync()
+        return history
+
+    def use_blob_store(
+        self, store: BlobStore, min_bytes: int = OFFLOAD_MIN_BYTES
+    ) -> BlobStore:
+        """Stores query payloads of at least min_bytes in store, putting only a hash on-chain"""
+        self.blob_store = store
+        self.offload_min_bytes = min_bytes
+        return store
 
     def check_if_is_valid_user_role(self) -> str:
         """Getting current role"""
-        roleName = self.UserRole.functions.getUserRole(self.account["address"]).call()
+        roleName = read_user_role(self)
         if roleName not in ["DA"]:
             raise RuntimeError(
                 "Unauthorized action: Your role does not have permission to perform this operation"
             )
-        print(f"Current user role: {roleName}")
         return roleName
 
+    def refresh_role(self) -> str:
+        """Re-reads the account role from UserRole, bypassing the role cache"""
+        return read_user_role(self, refresh=True)
+
     def _next_nonce(self) -> int:
-        return self.web3.eth.get_transaction_count(self.account["address"], "pending")
+        manager = getattr(self, "nonce_manager", None)
+        if manager is None:
+            return self.web3.eth.get_transaction_count(
+                self.account["address"], "pending"
+            )
+        return manager.allocate()
 
     def _wait_for_receipt(self, tx_hash, action: str) -> TxReceipt:
-        timeout = int(os.getenv("NECTAR_TX_RECEIPT_TIMEOUT", "180"))
-        poll_latency = int(os.getenv("NECTAR_TX_RECEIPT_POLL", "5"))
-        try:
-            return self.web3.eth.wait_for_transaction_receipt(
-                tx_hash, timeout=timeout, poll_latency=poll_latency
-            )
-        except TimeExhausted as exc:
-            raise TimeoutError(
-                f"{action} transaction not mined within {timeout}s: {tx_hash.hex()}"
-            ) from exc
+        return wait_for_mined(self, [(tx_hash, action)])[0]
+
+    def _user_index(self) -> int:
+        # Handed out locally like nonces, so a query sent before the previous
+        # one is mined does not reuse its index.
+        lock = self.__dict__.setdefault("_user_index_lock", threading.Lock())
+        with lock:
+            if getattr(self, "_next_user_index", None) is None:
+                self._next_user_index = self.QueryManager.functions.getUserIndex(
+                    self.account["address"]
+                ).call()
+            user_index = self._next_user_index
+            self._next_user_index += 1
+            return user_index
+
+    def _resync_user_index(self, user_index: int):
+        """
+        Takes back the index of a query that failed. Other queries may hold
+        later indexes, so the counter only moves back when this was the last
+        one handed out, and never below the on-chain index.
+        """
+        lock = self.__dict__.setdefault("_user_index_lock", threading.Lock())
+        with lock:
+            next_index = getattr(self, "_next_user_index", None)
+            if next_index is None:
+                return
+            if next_index == user_index + 1:
+                next_index = user_index
+            try:
+                on_chain = self.QueryManager.functions.getUserIndex(
+                    self.account["address"]
+                ).call()
+            except Exception as e:
+                print("cannot re-read user index, keeping local counter:", e)
+                on_chain = next_index
+            self._next_user_index = max(next_index, on_chain)
 
     def get_pay_amount(self, bucket_ids: list, policy_indexes: list) -> int:
+        bucket_policy_ids = get_bucket_policy_ids(
+            self, bucket_ids, return_exceptions=True
+        )
         policy_ids = []
         for i in range(len(bucket_ids)):
-            try:
-                p = self.EoaBond.functions.getPolicyIds(bucket_ids[i]).call()[
-                    policy_indexes[i]
-                ]
-                policy_ids.append(p)
-            except ContractLogicError as e:
-                error_message = str(e)
-                if "BucketNotFound" in error_message:
-                    print(f"Error: Bucket ID {bucket_ids[i]} does not exist.")
-                elif "NoPolicyIdsInBucket" in error_message:
-                    print(f"Error: Bucket ID {bucket_ids[i]} has no policy IDs.")
-                else:
-                    print(f"Smart contract error: {e}")
+            result = bucket_policy_ids[i]
+            if isinstance(result, ContractLogicError):
+                _report_bucket_error(bucket_ids[i], result)
                 return 0
+            if isinstance(result, Exception):
+                raise result
+            policy_ids.append(result[policy_indexes[i]])
 
-        prices = [self.read_policy(p)["price"] for p in policy_ids]
-        return sum(prices)
+        unique_ids = list(dict.fromkeys(policy_ids))
+        policies = dict(zip(unique_ids, self.read_policies(unique_ids)))
+        return sum(policies[p]["price"] for p in policy_ids)
+
+    def get_pay_amounts(self, queries: list) -> list:
+        """
+        Prices several (bucket_ids, policy_indexes) pairs with one read per
+        bucket and policy. Like get_pay_amount, a query on a bucket the
+        contract rejects is reported and priced 0.
+        """
+        unique_buckets = list(
+            dict.fromkeys(b for bucket_ids, _ in queries for b in bucket_ids)
+        )
+        bucket_policy_ids = dict(
+            zip(
+                unique_buckets,
+                get_bucket_policy_ids(self, unique_buckets, return_exceptions=True),
+            )
+        )
+        for bucket_id, result in bucket_policy_ids.items():
+            if isinstance(result, ContractLogicError):
+                _report_bucket_error(bucket_id, result)
+            elif isinstance(result, Exception):
+                raise result
+        policy_ids = [
+            None
+            if any(isinstance(bucket_policy_ids[b], Exception) for b in bucket_ids)
+            else [bucket_policy_ids[b][i] for b, i in zip(bucket_ids, policy_indexes)]
+            for bucket_ids, policy_indexes in queries
+        ]
+        unique_ids = list(dict.fromkeys(p for ids in policy_ids for p in ids or ()))
+        policies = dict(zip(unique_ids, self.read_policies(unique_ids)))
+        return [
+            0 if ids is None else sum(policies[p]["price"] for p in ids)
+            for ids in policy_ids
+        ]
 
     def approve_payment(self, amount: int) -> TxReceipt:
         """Approves an EC20 query payment"""
 
-        approve_tx = self.USDC.functions.approve(
-            self.qm_contract_addr, amount
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
+        approve_hash = send_transaction(
+            self, self.USDC.functions.approve(self.qm_contract_addr, amount)
         )
-        approve_signed = self.web3.eth.account.sign_transaction(
-            approve_tx, self.account["private_key"]
-        )
-        approve_hash = self.web3.eth.send_raw_transaction(approve_signed.rawTransaction)
         receipt = self._wait_for_receipt(approve_hash, "approve")
         if receipt.status != 1:
             raise RuntimeError(f"approve transaction reverted: {approve_hash.hex()}")
         return receipt
 
+    def get_allowance(self) -> int:
+        """Returns the USDC amount the QueryManager may still spend for this account"""
+        return self.USDC.functions.allowance(
+            self.account["address"], self.qm_contract_addr
+        ).call()
+
+    def _allowance_ledger(self) -> AllowanceLedger:
+        return allowance_ledger(self)
+
+    def _settle_payments(self, ledger: AllowanceLedger):
+        for tx_hash in ledger.pending_hashes():
+            try:
+                self.web3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+            except Exception as e:
+                print("cannot check payQuery receipt, counting it as pending:", e)
+                continue
+            ledger.settle(tx_hash)
+
+    def ensure_allowance(
+        self, amount: int, budget: int = None, reuse: bool = True, wait: bool = True
+    ):
+        """
+        Approves max(amount, budget) on top of what payments in flight still
+        need, unless reuse is set and the allowance already covers both.
+        amount then counts as in flight until its payQuery is sent and mined.
+        Returns the approve receipt, its hash when wait is False, or None when
+        no approve was needed.
+        """
+        ledger = self._allowance_ledger()
+        lock = self.__dict__.setdefault("_allowance_lock", threading.Lock())
+        with lock:
+            self._settle_payments(ledger)
+            in_flight = ledger.total()
+            result = None
+            if reuse and self.get_allowance() >= in_flight + amount:
+                print("existing allowance covers payment, skipping approve")
+            elif wait:
+                result = self.approve_payment(in_flight + max(amount, budget or 0))
+            else:
+                result = send_transaction(
+                    self,
+                    self.USDC.functions.approve(
+                        self.qm_contract_addr, in_flight + max(amount, budget or 0)
+                    ),
+                )
+            ledger.reserve(amount)
+            return result
+
+    def _payment_sent(self, price: int, tx_hash):
+        payment_sent(self, price, tx_hash)
+
+    def _payment_failed(self, price: int):
+        payment_failed(self, price)
+
+    def _encrypt_query(
+        self,
+        query_str,
+        policy_indexes: list,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+    ) -> str:
+        return encrypt_query(
+            self, query_str, policy_indexes, categorize_by_do, aggregate_type
+        )
+
     def pay_query(
         self,
         query_str,
@@ -119,116 +320,109 @@ class NectarClient:
         policy_indexes: list,
         categorize_by_do: bool = False,
         aggregate_type: str = None,
+        approve_hash=None,
     ) -> tuple:
-        """Sends a query along with a payment"""
-        print("encrypting query under star node key...")
-        ppcCmd = encryption.hybrid_encrypt_v1(self, query_str, policy_indexes)
-        # Expose categorization metadata to backend-api (outside encrypted payload)
-        if categorize_by_do or aggregate_type:
-            ppc_data = json.loads(ppcCmd)
-            if categorize_by_do:
-                ppc_data["categorizeByDO"] = True
-            if aggregate_type:
-                ppc_data["aggregate"] = {"type": aggregate_type}
-            ppcCmd = json.dumps(ppc_data)
+        """
+        Sends a query along with a payment. With the hash of an approve that
+        is not mined yet, waits for both transactions.
+        """
+        try:
+            ppcCmd = self._encrypt_query(
+                query_str, policy_indexes, categorize_by_do, aggregate_type
+            )
+        except Exception:
+            self._payment_failed(price)
+            raise
+        try:
+            gas = pay_query_gas(self, ppcCmd, len(bucket_ids))
+        except Exception:
+            self._payment_failed(price)
+            raise
         print("sending query with payment...")
-        user_index = self.QueryManager.functions.getUserIndex(
-            self.account["address"]
-        ).call()
-        query_tx = self.QueryManager.functions.payQuery(
-            user_index,
-            ppcCmd,
+        user_index = self._user_index()
+        query_hash = None
+        try:
+            tx_params = None
+            if approve_hash is not None:
+                # payQuery cannot be gas-estimated until the approve is mined.
+                tx_params = {"gas": gas}
+            query_hash = send_transaction(
+                self,
+                self.QueryManager.functions.payQuery(
+                    user_index,
+                    ppcCmd,
+                    price,
+                    bucket_ids,
+                    policy_indexes,
+                ),
+                tx_params,
+            )
+            self._payment_sent(price, query_hash)
+            if approve_hash is None:
+                query_receipt = self._wait_for_receipt(query_hash, "pay_query")
+                if query_receipt.status != 1:
+                    raise RuntimeError(
+                        f"pay_query transaction reverted: {query_hash.hex()}"
+                    )
+            else:
+                _, query_receipt = wait_for_receipts(
+                    self, [(approve_hash, "approve"), (query_hash, "pay_query")]
+                )
+        except Exception:
+            if query_hash is None:
+                self._payment_failed(price)
+            self._resync_user_index(user_index)
+            raise
+        self._allowance_ledger().settle(query_hash)
+        return user_index, query_receipt
+
+    def approve_and_pay_query(
+        self,
+        query_str,
+        price: int,
+        bucket_ids: list,
+        policy_indexes: list,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+        approve_amount: int = None,
+    ) -> tuple:
+        """Sends the approve and the paid query back to back, then waits on both"""
+        print("sending payment approval and query...")
+        approve_hash = self.ensure_allowance(
+            price, approve_amount, reuse=False, wait=False
+        )
+        return self.pay_query(
+            query_str,
             price,
             bucket_ids,
             policy_indexes,
-        ).build_transaction(
-            {
-                "from": self.account["address"],
-                "nonce": self._next_nonce(),
-            }
-        )
-        query_signed = self.web3.eth.account.sign_transaction(
-            query_tx, self.account["private_key"]
+            categorize_by_do,
+            aggregate_type,
+            approve_hash=approve_hash,
         )
-        query_hash = self.web3.eth.send_raw_transaction(query_signed.rawTransaction)
-        query_receipt = self._wait_for_receipt(query_hash, "pay_query")
-        if query_receipt.status != 1:
-            raise RuntimeError(f"pay_query transaction reverted: {query_hash.hex()}")
-        return user_index, query_receipt
 
-    def wait_for_query_result(self, user_index) -> str:
+    def wait_for_query_result(self, user_index, timeout: float = None) -> str:
         """Waits for the query result to be available"""
         print(f"waiting for result...")
-        return self.get_result(user_index)
+        return self.get_result(user_index, timeout=timeout)
 
     def _decode_decrypted_result(self, decrypted):
-        """
-        Normalize decrypted query payload into a Python object.
-        Supports:
-        - JSON bytes/strings (categorized responses)
-        - dill-serialized bytes (legacy payloads)
-        - passthrough for already-decoded objects
-        """
-        if isinstance(decrypted, (bytes, bytearray)):
-            raw = bytes(decrypted)
-            try:
-                text = raw.decode("utf-8")
-                try:
-                    return json.loads(text)
-                except Exception:
-                    return text
-            except Exception:
-                try:
-                    return dill.loads(raw)
-                except Exception:
-                    return raw
-
-        if isinstance(decrypted, str):
-            try:
-                return json.loads(decrypted)
-            except Exception:
-                return decrypted
-
-        return decrypted
-
-    def get_result(self, query_index):
-
-        result = ""
-        while not result:
-            query = self.QueryManager.functions.getQueryByUserIndex(
-                self.account["address"], query_index
-            ).call()
-            time.sleep(5)
-            raw = query[2]
-            if raw == "":
-                continue
+        return decode_decrypted_result(decrypted)
+
+    def get_result(self, query_index, timeout: float = None):
+
+        raw = wait_for_raw_result(self, query_index, timeout=timeout)
+        return self._open_result(raw)
+
+    def _open_result(self, raw):
+        """Decrypts and decodes a raw result posted on-chain"""
+        return open_result(self, raw)
+
+    def _validate_byoc_query(self, *args, **kwargs):
+        validate_byoc_query(*args, **kwargs)
 
-            parsed = raw
-            if isinstance(raw, (bytes, bytearray)):
-                parsed = raw.decode("utf-8", errors="ignore")
-
-            if isinstance(parsed, str):
-                try:
-                    parsed = json.loads(parsed)
-                except Exception:
-                    # Some backend paths write plain text errors (not JSON encoded).
-                    parsed = parsed
-
-            if isinstance(parsed, str) and parsed.startswith("Something went wrong"):
-                raise RuntimeError(f"Query failed: {parsed}")
-
-            result = parsed
-
-        if isinstance(result, str) and result.startswith("Something went wrong"):
-            raise RuntimeError(f"Query failed: {result}")
-        else:
-            existing_result = encryption.hybrid_decrypt_v1(self, result)
-            existing_result = self._decode_decrypted_result(existing_result)
-            print("result:")
-            print("-" * 50)
-            print(existing_result)
-            print("-" * 50)
-        return existing_result
+    def _build_query_str(self, *args) -> dict:
+        return build_query_str(*args)
 
     def byoc_query(
         self,
@@ -239,69 +433,270 @@ class NectarClient:
         policy_indexes: list = None,
         categorize_by_do: bool = False,
         aggregate_type: str = None,
+        pipelined: bool = False,
+        reuse_allowance: bool = False,
+        approve_budget: int = None,
+        wait: bool = True,
     ) -> tuple:
         """Sends a query along with a payment"""
+        if not wait:
+            return self.submit_query(
+                pre_compute_func=pre_compute_func,
+                main_func=main_func,
+                is_separate_data=is_separate_data,
+                bucket_ids=bucket_ids,
+                policy_indexes=policy_indexes,
+                categorize_by_do=categorize_by_do,
+                aggregate_type=aggregate_type,
+                pipelined=pipelined,
+                reuse_allowance=reuse_allowance,
+                approve_budget=approve_budget,
+            )
 
         self.check_if_is_valid_user_role()
 
-        if pre_compute_func is not None and not callable(pre_compute_func):
-            raise TypeError("pre_compute_func must be a callable function or None")
-
-        if main_func is not None and not callable(main_func):
-            raise TypeError("main_func must be a callable function or None")
-
-        if not isinstance(is_separate_data, bool):
-            raise TypeError("is_separate_data must be a boolean")
-
-        if len(bucket_ids) != len(policy_indexes):
-            raise ValueError("Length of bucket_ids and policy_indexes must match")
-
-        # Validate bucket_ids
-        if not isinstance(bucket_ids, list) or len(bucket_ids) == 0:
-            raise ValueError("bucket_ids must be a non-empty list")
-
-        if not isinstance(policy_indexes, list) or len(policy_indexes) == 0:
-            raise ValueError("policy_indexes must be a non-empty list")
-        if len(bucket_ids) == 1:
-            # Single worker
-            if main_func is None or not callable(main_func):
-                raise ValueError("Single worker requires a valid main_func")
-        else:
-            if pre_compute_func is None or not callable(pre_compute_func):
-                raise ValueError("Multiple workers require a valid pre_compute_func")
-            if main_func is None or not callable(main_func):
-                raise ValueError("Multiple workers require a valid main_func")
-        if categorize_by_do and not aggregate_type:
-            raise ValueError(
-                "categorize_by_do requires aggregate_type "
-                "(e.g., 'count', 'sum', 'mean', 'min', 'max')"
-            )
-        if categorize_by_do and aggregate_type not in VALID_DISCLOSURE_OPERATIONS:
-            raise ValueError(
-                f"Invalid aggregate_type for categorize_by_do: {aggregate_type}. "
-                f"Must be one of {VALID_DISCLOSURE_OPERATIONS}"
+        self._validate_byoc_query(
+            pre_compute_func,
+            main_func,
+            is_separate_data,
+            bucket_ids,
+            policy_indexes,
+            categorize_by_do,
+            aggregate_type,
+        )
+
+        cache = getattr(self, "result_cache", None)
+        if cache is not None:
+            fingerprint = query_fingerprint(
+                self,
+                {
+                    "pre_compute_func": pre_compute_func,
+                    "main_func": main_func,
+                    "is_separate_data": is_separate_data,
+                    "bucket_ids": bucket_ids,
+                    "policy_indexes": policy_indexes,
+                    "categorize_by_do": categorize_by_do,
+                    "aggregate_type": aggregate_type,
+                },
             )
+            hit, cached_result = cache.lookup(fingerprint)
+            if hit:
+                print("returning cached result")
+                return cached_result
 
         print("Sending query to blockchain...")
         price = self.get_pay_amount(bucket_ids, policy_indexes)
 
         """Approves a payment, sends a query, then fetches the result"""
-        self.approve_payment(price)
-        query_str = {
-            "pre_compute_func": (
-                dill.dumps(pre_compute_func, recurse=True) if pre_compute_func else None
-            ),
-            "main_func": dill.dumps(main_func, recurse=True) if main_func else None,
-            "is_separate_data": is_separate_data,
-            "categorizeByDO": categorize_by_do,
+        approved = self.ensure_allowance(
+            price, approve_budget, reuse=reuse_allowance, wait=not pipelined
+        )
+        query_str = self._build_query_str(
+            pre_compute_func, main_func, is_separate_data, categorize_by_do
+        )
+        query_kwargs = {
+            "bucket_ids": bucket_ids,
+            "policy_indexes": policy_indexes,
+            "categorize_by_do": categorize_by_do,
+            "aggregate_type": aggregate_type,
         }
+        # When pipelined, payQuery goes out before the approve is mined.
         user_index, _ = self.pay_query(
             query_str,
             price,
-            bucket_ids=bucket_ids,
-            policy_indexes=policy_indexes,
-            categorize_by_do=categorize_by_do,
-            aggregate_type=aggregate_type,
+            approve_hash=approved if pipelined else None,
+            **query_kwargs,
         )
-        query_res = self.wait_for_query_result(user_index)
+        if cache is None:
+            return self.wait_for_query_result(user_index)
+        print("waiting for result...")
+        # The cache keeps the result as posted, still encrypted, on disk.
+        raw = wait_for_raw_result(self, user_index)
+        query_res = self._open_result(raw)
+        policy_ids = [
+            ids[i]
+            for ids, i in zip(get_bucket_policy_ids(self, bucket_ids), policy_indexes)
+        ]
+        cache.store(fingerprint, query_res, policy_ids, bucket_ids, raw=raw)
         return query_res
+
+    def submit_query(
+        self,
+        pre_compute_func=None,
+        main_func=None,
+        is_separate_data: bool = False,
+        bucket_ids: list = None,
+        policy_indexes: list = None,
+        categorize_by_do: bool = False,
+        aggregate_type: str = None,
+        pipelined: bool = False,
+        reuse_allowance: bool = False,
+        approve_budget: int = None,
+    ) -> QueryHandle:
+        """Sends a query along with a payment and returns without waiting for it"""
+        self.check_if_is_valid_user_role()
+        spec = self._query_spec(
+            {
+                "pre_compute_func": pre_compute_func,
+                "main_func": main_func,
+                "is_separate_data": is_separate_data,
+                "bucket_ids": bucket_ids,
+                "policy_indexes": policy_indexes,
+                "categorize_by_do": categorize_by_do,
+                "aggregate_type": aggregate_type,
+            }
+        )
+        print("Sending query to blockchain...")
+        price = self.get_pay_amount(bucket_ids, policy_indexes)
+        # When pipelined, a failed approve surfaces as a reverted payQuery on the handle.
+        approved = self.ensure_allowance(
+            price, approve_budget, reuse=reuse_allowance, wait=not pipelined
+        )
+        try:
+            user_index = self._user_index()
+        except Exception:
+            self._payment_failed(price)
+            raise
+        try:
+            query_hash = self._send_spec(
+                spec, price, user_index, fixed_gas=pipelined and approved is not None
+            )
+        except Exception:
+            self._resync_user_index(user_index)
+            raise
+        return QueryHandle(self, user_index, query_hash)
+
+    def query_handle(self, user_index: int) -> QueryHandle:
+        """Returns a handle for a query submitted earlier, e.g. by another process"""
+        return QueryHandle(self, user_index)
+
+    def _query_spec(self, spec: dict) -> dict:
+        unknown = set(spec) - set(QUERY_SPEC_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown query spec keys: {sorted(unknown)}")
+        spec = {**QUERY_SPEC_DEFAULTS, **spec}
+        self._validate_byoc_query(**spec)
+        return spec
+
+    def _send_spec(self, spec: dict, price: int, user_index: int, fixed_gas=True):
+        try:
+            query_hash = send_transaction(
+                self, *self._pay_query_call(spec, price, user_index, fixed_gas)
+            )
+        except Exception:
+            self._payment_failed(price)
+            raise
+        self._payment_sent(price, query_hash)
+        return query_hash
+
+    def _pay_query_call(
+        self,
+        spec: dict,
+        price: int,
+        user_index: int,
+        fixed_gas: bool = True,
+        offline: bool = False,
+    ) -> tuple:
+        """
+        Seals a query spec and returns its (payQuery call, tx_params). Without
+        fixed_gas, tx_params is None and the node estimates the gas.
+        """
+        query_str = self._build_query_str(
+            spec["pre_compute_func"],
+            spec["main_func"],
+            spec["is_separate_data"],
+            spec["categorize_by_do"],
+        )
+        ppcCmd = self._encrypt_query(
+            query_str,
+            spec["policy_indexes"],
+            spec["categorize_by_do"],
+            spec["aggregate_type"],
+        )
+        gas = pay_query_gas(self, ppcCmd, len(spec["bucket_ids"]), offline)
+        # Later queries cannot be gas-estimated before earlier ones are mined.
+        return (
+            self.QueryManager.functions.payQuery(
+                user_index, ppcCmd, price, spec["bucket_ids"], spec["policy_indexes"]
+            ),
+            {"gas": gas} if fixed_gas else None,
+        )
+
+    def _await_query(self, query_hash, user_index):
+        receipt = self._wait_for_receipt(query_hash, "pay_query")
+        if receipt.status != 1:
+            raise RuntimeError(f"pay_query transaction reverted: {query_hash.hex()}")
+        return self.wait_for_query_result(user_index)
+
+    def submit_many(
+        self, queries: list, approve_budget: int = None, max_workers: int = None
+    ) -> list:
+        """
+        Submits several queries at once and returns one Future per query.
+
+        Each query is a dict of byoc_query arguments. All queries are validated
+        and priced before anything is sent, a single approve covers the total,
+        and the payQuery transactions go out back to back on consecutive nonces.
+        Each Future resolves to the decoded result of its query.
+        """
+        self.check_if_is_valid_user_role()
+        specs = [self._query_spec(spec) for spec in queries]
+        if not specs:
+            return []
+        prices = self.get_pay_amounts(
+            [(spec["bucket_ids"], spec["policy_indexes"]) for spec in specs]
+        )
+        self.ensure_allowance(sum(prices), approve_budget)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers or min(32, len(specs)))
+        futures = []
+        for offset, (spec, price) in enumerate(zip(specs, prices)):
+            user_index = None
+            try:
+                user_index = self._user_index()
+                query_hash = self._send_spec(spec, price, user_index)
+            except Exception as e:
+                if user_index is not None:
+                    self._resync_user_index(user_index)
+                    self._payment_failed(sum(prices[offset + 1 :]))
+                else:
+                    self._payment_failed(sum(prices[offset:]))
+                # Queries already sent are paid for, so hand back their
+                # futures and fail the rest instead of raising.
+                for _ in specs[offset:]:
+                    failed = Future()
+                    failed.set_exception(e)
+                    futures.append(failed)
+                break
+            futures.append(executor.submit(self._await_query, query_hash, user_index))
+        executor.shutdown(wait=False)
+        return futures
+
+    def offline_batch(
+        self, nonce: int, fees: dict, gas_limits: dict = None
+    ) -> AnalystBatch:
+        """
+        Starts a batch of approve and payQuery writes that are signed locally,
+        from nonce on and with fees as given, without contacting a node
+        """
+        return AnalystBatch(self, nonce, fees, gas_limits)
+
+    def replay(self, path, wait: bool = True) -> list:
+        """Broadcasts a file saved from offline_batch and waits for its receipts"""
+        return replay_transactions(self, path, wait)
+
+    def map_queries(
+        self, queries: list, approve_budget: int = None, max_workers: int = None
+    ):
+        """
+        Runs submit_many and yields (position, result) pairs as queries
+        complete. A query that failed yields its exception as the result, so
+        one failure does not end the iteration.
+        """
+        futures = self.submit_many(
+            queries, approve_budget=approve_budget, max_workers=max_workers
+        )
+        positions = {future: i for i, future in enumerate(futures)}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield positions[future], future.result() if error is None else error
@@ -0,0 +1,86 @@
+import threading
+from web3 import Web3
+from nectarpy.common.blockchain_init import (
+    ContractsMixin,
+    _init_client,
+    _init_keys,
+    req_json,
+)
+from nectarpy.common.fees import FeeOracle, chain_id_from_config
+from nectarpy.common.metadata import MetadataCache
+from nectarpy.common.roles import RoleFeed
+from nectarpy.common.rpc import FailoverHTTPProvider, endpoint_urls
+from nectarpy.lib import Nectar
+from nectarpy.lib_v1 import NectarClient
+
+
+class NectarSession(ContractsMixin):
+    """
+    One RPC connection and one set of contracts shared by many API keys.
+
+    Clients handed out by data_analyst() and data_owner() reuse the session's
+    Web3 instance, keep-alive HTTP session, contract objects and UserRole
+    event watcher, so each extra key only costs its own key derivation and
+    nonce counter.
+    """
+
+    def __init__(self, mode: str = "moonbeam"):
+        print("network mode:", mode)
+        self.blockchain_config = req_json("config/blockchain.json")[mode]
+        self.web3 = Web3(FailoverHTTPProvider(endpoint_urls(self.blockchain_config)))
+        self.fee_oracle = FeeOracle(
+            self.web3, chain_id_from_config(self.blockchain_config)
+        )
+        self.metadata_cache = None
+        self.role_feed = RoleFeed()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def enable_metadata_cache(
+        self, ttl: float = 300, maxsize: int = 1024
+    ) -> MetadataCache:
+        """Caches policy and bucket reads for every client of this session"""
+        with self._lock:
+            self.metadata_cache = MetadataCache(
+                self.web3, self.EoaBond, ttl=ttl, maxsize=maxsize
+            )
+            for client in self._clients.values():
+                client.metadata_cache = self.metadata_cache
+        return self.metadata_cache
+
+    def _client(self, cls, api_secret: str, check_role: bool):
+        key = (cls, api_secret)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = object.__new__(cls)
+                _init_keys(client, api_secret)
+                _init_client(
+                    client,
+                    api_secret,
+                    self.web3,
+                    self.blockchain_config,
+                    self.fee_oracle,
+                    contract_source=self,
+                )
+                client.role_feed = self.role_feed
+                if self.metadata_cache is not None:
+                    client.metadata_cache = self.metadata_cache
+                self._clients[key] = client
+        if check_role:
+            client.check_if_is_valid_user_role()
+        return client
+
+    def data_analyst(self, api_secret: str, check_role: bool = True) -> NectarClient:
+        """Returns the NectarClient for api_secret, creating it on first use"""
+        return self._client(NectarClient, api_secret, check_role)
+
+    def data_owner(self, api_secret: str, check_role: bool = True) -> Nectar:
+        """Returns the Nectar client for api_secret, creating it on first use"""
+        return self._client(Nectar, api_secret, check_role)
+
+    def release(self, api_secret: str):
+        """Forgets the clients created for api_secret"""
+        with self._lock:
+            for key in [k for k in self._clients if k[1] == api_secret]:
+                del self._clients[key]
@@ -23,4 +23,5 @@ setup(
     ],
     python_requires=">=3.8, <4",
     install_requires=["web3<7.0.0", "python-dotenv", "hpke", "dill"],
+    extras_require={"zstd": ["zstandard"], "ws": ["websockets"]},
 )
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import types
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import requests
+
+from nectarpy.common.fees import AsyncFeeOracle
+from nectarpy.common.nonce import AsyncNonceManager
+from nectarpy.common.transactions import async_send_transaction
+from nectarpy.lib_async import AsyncNectar, AsyncNectarClient
+
+
+def build_async_web3():
+    web3 = MagicMock()
+    web3.eth.get_transaction_count = AsyncMock(return_value=5)
+    web3.eth.send_raw_transaction = AsyncMock(return_value=b"tx_hash")
+    web3.eth.wait_for_transaction_receipt = AsyncMock(
+        return_value=types.SimpleNamespace(status=1)
+    )
+    web3.eth.account.sign_transaction.return_value = types.SimpleNamespace(
+        rawTransaction=b"signed_tx"
+    )
+    return web3
+
+
+def async_fn(return_value=None):
+    """A contract function mock whose build_transaction and call are awaitable"""
+    fn = MagicMock()
+    fn.build_transaction = AsyncMock(side_effect=lambda params: dict(params))
+    fn.call = AsyncMock(return_value=return_value)
+    return fn
+
+
+def build_client(cls=AsyncNectarClient):
+    client = object.__new__(cls)
+    client.account = {"address": "0xabc", "private_key": "0x123"}
+    client.qm_contract_addr = "0xqm"
+    client.web3 = build_async_web3()
+    client.nonce_manager = AsyncNonceManager(client.web3, "0xabc")
+    client.USDC = MagicMock()
+    client.USDC.functions.approve.return_value = async_fn()
+    client.USDC.functions.allowance.return_value = async_fn(0)
+    client.QueryManager = MagicMock()
+    client.QueryManager.functions.getUserIndex.return_value = async_fn(7)
+    client.QueryManager.functions.payQuery.side_effect = lambda *args: async_fn()
+    client.UserRole = MagicMock()
+    client.UserRole.functions.getUserRole.return_value = async_fn(cls.ROLE)
+    return client
+
+
+class AsyncNonceManagerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_allocations_sync_once(self):
+        web3 = build_async_web3()
+        manager = AsyncNonceManager(web3, "0xabc")
+        nonces = await asyncio.gather(*[manager.allocate() for _ in range(4)])
+        self.assertEqual(sorted(nonces), [5, 6, 7, 8])
+        web3.eth.get_transaction_count.assert_awaited_once_with("0xabc", "pending")
+
+
+class AsyncNectarClientTests(unittest.IsolatedAsyncioTestCase):
+    async def test_role_check_rejects_other_roles(self):
+        client = build_client()
+        client.UserRole.functions.getUserRole.return_value = async_fn("DO")
+        with self.assertRaises(RuntimeError):
+            await client.check_if_is_valid_user_role()
+
+    async def test_concurrent_pay_queries_get_distinct_indexes_and_nonces(self):
+        client = build_client()
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
+            encrypt_mock.return_value = json.dumps({"cipher": "abc"})
+            results = await asyncio.gather(
+                *[
+                    client.pay_query({"k": "v"}, 10, bucket_ids=[1], policy_indexes=[0])
+                    for _ in range(3)
+                ]
+            )
+
+        self.assertEqual(sorted(index for index, _ in results), [7, 8, 9])
+        client.QueryManager.functions.getUserIndex.return_value.call.assert_awaited_once()
+        sent = client.web3.eth.account.sign_transaction.call_args_list
+        self.assertEqual(sorted(c.args[0]["nonce"] for c in sent), [5, 6, 7])
+
+    async def test_failed_pay_query_rereads_user_index(self):
+        client = build_client()
+        client.web3.eth.wait_for_transaction_receipt.return_value = (
+            types.SimpleNamespace(status=0)
+        )
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
+            encrypt_mock.return_value = json.dumps({"cipher": "abc"})
+            with self.assertRaisesRegex(RuntimeError, "pay_query"):
+                await client.pay_query({"k": "v"}, 10, bucket_ids=[1], policy_indexes=[0])
+            client.web3.eth.wait_for_transaction_receipt.return_value = (
+                types.SimpleNamespace(status=1)
+            )
+            user_index, _ = await client.pay_query(
+                {"k": "v"}, 10, bucket_ids=[1], policy_indexes=[0]
+            )
+
+        self.assertEqual(user_index, 7)
+
+    async def test_byoc_query_reuses_allowance(self):
+        client = build_client()
+        client.USDC.functions.allowance.return_value = async_fn(50)
+        client.get_pay_amount = AsyncMock(return_value=10)
+        client.pay_query = AsyncMock(return_value=(11, {"status": 1}))
+        client.approve_payment = AsyncMock()
+        client.wait_for_query_result = AsyncMock(return_value={"ok": True})
+
+        result = await client.byoc_query(
+            main_func=lambda: 1,
+            bucket_ids=[1],
+            policy_indexes=[0],
+            reuse_allowance=True,
+        )
+
+        self.assertEqual(result, {"ok": True})
+        client.approve_payment.assert_not_awaited()
+        client.wait_for_query_result.assert_awaited_once_with(11)
+
+    async def test_concurrent_approves_cover_each_other(self):
+        client = build_client()
+        client.approve_payment = AsyncMock()
+        # Neither approve is mined before the other query looks at the allowance.
+        await asyncio.gather(client.ensure_allowance(10), client.ensure_allowance(20))
+
+        approved = sorted(c.args[0] for c in client.approve_payment.await_args_list)
+        # approve overwrites the allowance, so the second one must include the first.
+        self.assertIn(approved, ([10, 30], [20, 30]))
+
+
+    async def test_timed_out_send_is_rebroadcast_not_signed_again(self):
+        client = build_client()
+        client.web3.eth.account.sign_transaction.return_value = types.SimpleNamespace(
+            rawTransaction=b"signed_tx", hash=b"signed_hash"
+        )
+        client.web3.eth.send_raw_transaction.side_effect = [
+            requests.ReadTimeout("read timed out"),
+            b"signed_hash",
+        ]
+
+        tx_hash = await async_send_transaction(
+            client, client.USDC.functions.approve("0xqm", 10)
+        )
+
+        self.assertEqual(tx_hash, b"signed_hash")
+        client.web3.eth.account.sign_transaction.assert_called_once()
+        self.assertEqual(client.web3.eth.send_raw_transaction.await_count, 2)
+        self.assertEqual(await client.nonce_manager.allocate(), 6)
+
+    async def test_fees_come_from_the_oracle(self):
+        client = build_client()
+        client.web3.eth.get_block = AsyncMock(
+            return_value={"baseFeePerGas": 100, "gasLimit": 15_000_000}
+        )
+        # max_priority_fee is an awaitable property on AsyncWeb3.
+        client.web3.eth.max_priority_fee = AsyncMock(return_value=7)()
+        client.fee_oracle = AsyncFeeOracle(client.web3, 1284)
+
+        await async_send_transaction(
+            client, client.USDC.functions.approve("0xqm", 10)
+        )
+
+        sent = client.web3.eth.account.sign_transaction.call_args.args[0]
+        self.assertEqual(sent["maxFeePerGas"], 207)
+        self.assertEqual(sent["maxPriorityFeePerGas"], 7)
+        self.assertEqual(sent["chainId"], 1284)
+
+class AsyncNectarTests(unittest.IsolatedAsyncioTestCase):
+    async def test_add_bucket_sends_and_returns_bucket_id(self):
+        nectar = build_client(AsyncNectar)
+        nectar.EoaBond = MagicMock()
+        nectar.EoaBond.functions.addBucket.return_value = async_fn()
+
+        bucket_id = await nectar.add_bucket(
+            [1], [False], "std1", "0x0000000000000000000000000000000000000001"
+        )
+
+        self.assertEqual(nectar.EoaBond.functions.addBucket.call_args.args[0], bucket_id)
+        nectar.web3.eth.send_raw_transaction.assert_awaited_once_with(b"signed_tx")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from eth_abi import encode
+from web3 import Web3
+
+from nectarpy.common.batch import batch_call, block_timestamps
+from nectarpy.common.blockchain_init import req_json
+from nectarpy.common.cache import TTLCache
+from nectarpy.common.metadata import MetadataCache
+from nectarpy.lib_v1 import NectarClient
+
+EOA_BOND = "0xDE93f136a600e29Bb6dFf776cbD73830D098B4bC"
+OWNER = "0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"
+
+
+def build_client():
+    client = object.__new__(NectarClient)
+    client.web3 = Web3(Web3.HTTPProvider("http://rpc.invalid"))
+    client.EoaBond = client.web3.eth.contract(
+        address=EOA_BOND, abi=req_json("config/EoaBond.json")["abi"]
+    )
+    return client
+
+
+def rpc_result(types, values):
+    return "0x" + encode(types, values).hex()
+
+
+def policy_results(price):
+    return [
+        rpc_result(
+            ["uint256", "uint256", "address", "bool"], [123, price, OWNER, False]
+        ),
+        rpc_result(["string[]"], [["*"]]),
+        rpc_result(["address[]"], [[OWNER]]),
+        rpc_result(["string[]"], [["age"]]),
+    ]
+
+
+def batch_response(payloads):
+    """Builds a fake post handler answering each batch with the next result list"""
+    batches = iter(payloads)
+
+    def post(endpoint, data, **kwargs):
+        requests = json.loads(data)
+        results = next(batches)
+        assert len(requests) == len(results)
+        return json.dumps(
+            [
+                {"jsonrpc": "2.0", "id": r["id"], "result": res}
+                for r, res in reversed(list(zip(requests, results)))
+            ]
+        ).encode()
+
+    return post
+
+
+class BatchReadTests(unittest.TestCase):
+    def test_read_policy_uses_single_batch(self):
+        client = build_client()
+        post = MagicMock(side_effect=batch_response([policy_results(10)]))
+        with patch("nectarpy.common.batch.make_post_request", post):
+            policy = client.read_policy(42)
+
+        post.assert_called_once()
+        self.assertEqual(policy["price"], 10)
+        self.assertEqual(policy["owner"], OWNER)
+        self.assertEqual(policy["allowed_addresses"], [OWNER])
+        self.assertEqual(policy["allowed_columns"], ["age"])
+
+    def test_get_pay_amount_takes_two_round_trips(self):
+        client = build_client()
+        bucket_ids = list(range(1, 21))
+        post = MagicMock(
+            side_effect=batch_response(
+                [
+                    [rpc_result(["uint256[]"], [[100 + b, 200 + b]]) for b in bucket_ids],
+                    sum((policy_results(b) for b in bucket_ids), []),
+                ]
+            )
+        )
+        with patch("nectarpy.common.batch.make_post_request", post):
+            price = client.get_pay_amount(bucket_ids, [1] * len(bucket_ids))
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(price, sum(bucket_ids))
+
+    def test_failed_entries_are_retried_individually(self):
+        client = build_client()
+        fn = client.EoaBond.functions.getPolicyIds(1)
+
+        def post(endpoint, data, **kwargs):
+            return json.dumps(
+                [{"jsonrpc": "2.0", "id": 0, "error": {"message": "reverted"}}]
+            ).encode()
+
+        with patch("nectarpy.common.batch.make_post_request", post), patch.object(
+            type(fn), "call", side_effect=ValueError("BucketNotFound")
+        ):
+            results = batch_call(client.web3, [fn], return_exceptions=True)
+        self.assertIsInstance(results[0], ValueError)
+
+    def test_block_timestamps_use_one_batch(self):
+        client = build_client()
+        post = MagicMock(
+            side_effect=batch_response([[{"timestamp": hex(1000 * n)} for n in (3, 5, 9)]])
+        )
+        with patch("nectarpy.common.batch.make_post_request", post):
+            times = block_timestamps(client.web3, {9, 3, 5, 3})
+
+        post.assert_called_once()
+        self.assertEqual(times, {3: 3000, 5: 5000, 9: 9000})
+
+    def test_non_http_provider_falls_back_to_plain_calls(self):
+        fn = MagicMock()
+        fn.call.return_value = [1, 2]
+        self.assertEqual(batch_call(None, [fn]), [[1, 2]])
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+    def test_expires_entries(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        with patch("nectarpy.common.cache.time.monotonic", return_value=100):
+            cache.set("a", 1)
+        with patch("nectarpy.common.cache.time.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"))
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def build_cached_client(self, events):
+        client = build_client()
+        with patch("nectarpy.common.metadata.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.side_effect = events
+            client.metadata_cache = MetadataCache(
+                client.web3, client.EoaBond, event_poll=0
+            )
+        return client
+
+    def test_repeat_reads_skip_rpc(self):
+        client = self.build_cached_client([[], []])
+        post = MagicMock(side_effect=batch_response([policy_results(10)]))
+        with patch("nectarpy.common.batch.make_post_request", post):
+            first = client.read_policy(42)
+            first["allowed_columns"].append("mutated")
+            second = client.read_policy(42)
+
+        post.assert_called_once()
+        self.assertEqual(second["allowed_columns"], ["age"])
+
+    def test_deactivation_event_invalidates_policy(self):
+        client = self.build_cached_client(
+            [[], [{"event": "PolicyDeactivated", "args": {"policyId": 42}}]]
+        )
+        post = MagicMock(
+            side_effect=batch_response([policy_results(10), policy_results(20)])
+        )
+        with patch("nectarpy.common.batch.make_post_request", post):
+            client.read_policy(42)
+            policy = client.read_policy(42)
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(policy["price"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from nectarpy.common.blob_store import (
+    FileBlobStore,
+    HttpBlobStore,
+    offload_payload,
+    resolve_payload,
+)
+from nectarpy.lib_v1 import NectarClient
+
+
+def sealed_payload(size):
+    return json.dumps(
+        {"cipher": "ab" * size, "encapsulatedKey": "cd", "categorizeByDO": True}
+    )
+
+
+class BlobStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = FileBlobStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_large_payload_is_replaced_by_a_reference(self):
+        payload = sealed_payload(10_000)
+        reference = json.loads(offload_payload(self.store, payload))
+
+        self.assertNotIn("cipher", reference)
+        self.assertTrue(reference["categorizeByDO"])
+        ref = reference["payloadRef"]
+        self.assertEqual(ref["sha256"], hashlib.sha256(payload.encode()).hexdigest())
+        self.assertEqual(resolve_payload(self.store, ref), payload)
+
+    def test_root_with_spaces_and_non_ascii(self):
+        store = FileBlobStore(Path(self.tmp.name) / "blob dir é")
+        data = b"sealed"
+        digest = hashlib.sha256(data).hexdigest()
+        locator = store.put(digest, data)
+        self.assertIn("%20", locator)
+        self.assertEqual(store.get(locator), data)
+
+    def test_failed_write_leaves_no_temp_file(self):
+        with patch("nectarpy.common.blob_store.os.replace", side_effect=OSError("disk")):
+            with self.assertRaises(OSError):
+                self.store.put("ab" * 32, b"data")
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+    def test_small_payload_stays_inline(self):
+        payload = sealed_payload(10)
+        self.assertEqual(offload_payload(self.store, payload), payload)
+
+    def test_tampered_blob_is_rejected(self):
+        ref = json.loads(offload_payload(self.store, sealed_payload(10_000)))["payloadRef"]
+        Path(self.tmp.name, ref["sha256"]).write_bytes(b"{}")
+        with self.assertRaisesRegex(RuntimeError, "does not match"):
+            resolve_payload(self.store, ref)
+
+    def test_client_offloads_query_and_resolves_result(self):
+        client = object.__new__(NectarClient)
+        client.use_blob_store(self.store, min_bytes=100)
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
+            encrypt_mock.return_value = sealed_payload(1_000)
+            ppc_cmd = client._encrypt_query({"k": "v"}, [0])
+        self.assertIn("payloadRef", json.loads(ppc_cmd))
+
+        result_ref = offload_payload(self.store, sealed_payload(1_000), min_bytes=100)
+        with patch("nectarpy.common.encryption.hybrid_decrypt") as decrypt_mock:
+            decrypt_mock.return_value = b'{"count": 3}'
+            self.assertEqual(client._open_result(result_ref), {"count": 3})
+        decrypt_mock.assert_called_once_with(client, sealed_payload(1_000))
+
+
+class HttpBlobStoreTests(unittest.TestCase):
+    def test_each_store_keeps_its_own_session(self):
+        first = HttpBlobStore("https://blobs.example.org/")
+        second = HttpBlobStore("https://blobs.example.org")
+        self.assertIs(first._session(), first._session())
+        self.assertIsNot(first._session(), second._session())
+
+    def test_put_and_get_use_the_session(self):
+        store = HttpBlobStore("https://blobs.example.org/", timeout=5)
+        session = MagicMock()
+        session.get.return_value.content = b"sealed"
+        store._local.session = session
+
+        locator = store.put("ab12", b"sealed")
+
+        self.assertEqual(locator, "https://blobs.example.org/ab12")
+        session.put.assert_called_once_with(locator, data=b"sealed", timeout=5)
+        self.assertEqual(store.get(locator), b"sealed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from nectarpy.common import blockchain_init
+from nectarpy.common.blockchain_init import req_json
+from nectarpy.lib_v1 import NectarClient
+
+
+class ConfigCacheTests(unittest.TestCase):
+    def test_config_files_are_parsed_once(self):
+        blockchain_init._load_json.cache_clear()
+        with patch(
+            "nectarpy.common.blockchain_init.json.loads", return_value={"abi": []}
+        ) as loads:
+            first = req_json("config/USDC.json")
+            second = req_json("config/USDC.json")
+        blockchain_init._load_json.cache_clear()
+        self.assertIs(first, second)
+        loads.assert_called_once()
+
+    def test_contracts_are_built_on_first_access(self):
+        client = object.__new__(NectarClient)
+        client.web3 = MagicMock()
+        client.blockchain_config = {"eoaBond": "0xeb", "usdc": "0xusdc"}
+
+        client.web3.eth.contract.assert_not_called()
+        eoa_bond = client.EoaBond
+        self.assertIs(client.EoaBond, eoa_bond)
+        client.web3.eth.contract.assert_called_once_with(
+            address="0xeb", abi=req_json("config/EoaBond.json")["abi"]
+        )
+
+    def test_assigned_contracts_take_precedence(self):
+        client = object.__new__(NectarClient)
+        client.USDC = "usdc"
+        self.assertEqual(client.USDC, "usdc")
+        self.assertIsNone(getattr(client, "EoaBond", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
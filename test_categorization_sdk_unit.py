@@ -29,7 +29,7 @@ class NectarClientCategorizationTests(unittest.TestCase):
             "tx": "built"
         }
 
-        with patch("nectarpy.lib_v1.encryption.hybrid_encrypt_v1") as encrypt_mock:
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
             encrypt_mock.return_value = json.dumps({"cipher": "abc"})
             user_index, _ = client.pay_query(
                 query_str={"k": "v"},
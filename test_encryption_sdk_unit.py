@@ -0,0 +1,125 @@
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+import dill
+
+from nectarpy.common import encryption
+from nectarpy.common.blockchain_init import _init_keys
+from nectarpy.lib_v1 import NectarClient
+
+
+def build_client():
+    """A client that seals to its own key, so tests can open what it encrypts"""
+    client = object.__new__(NectarClient)
+    _init_keys(client, "0x" + "11" * 32)
+    client.sn_pubkey = client.skey.public_key()
+    return client
+
+
+def large_query():
+    return {"main_func": os.urandom(20_000).hex(), "is_separate_data": False}
+
+
+class EnvelopeTests(unittest.TestCase):
+    def test_v2_round_trip(self):
+        client = build_client()
+        secret = encryption.hybrid_encrypt_v2(client, {"k": "v"}, [0])
+        data = json.loads(secret)
+        self.assertEqual(data["v"], 2)
+        self.assertEqual(data["args"], [[0]])
+        self.assertEqual(dill.loads(encryption.hybrid_decrypt(client, secret)), {"k": "v"})
+
+    def test_v2_is_smaller_than_v1(self):
+        client = build_client()
+        query = large_query()
+        v1 = encryption.hybrid_encrypt_v1(client, query)
+        v2 = encryption.hybrid_encrypt_v2(client, query)
+        self.assertLess(len(v2), len(v1) * 0.7)
+
+    def test_v1_envelopes_still_decrypt(self):
+        client = build_client()
+        secret = encryption.hybrid_encrypt_v1(client, {"k": "v"})
+        self.assertEqual(dill.loads(encryption.hybrid_decrypt(client, secret)), {"k": "v"})
+
+    def test_version_selection(self):
+        client = build_client()
+        self.assertNotIn("v", json.loads(encryption.hybrid_encrypt(client, {})))
+        with patch.dict(os.environ, {"NECTAR_ENVELOPE_VERSION": "2"}):
+            self.assertEqual(json.loads(encryption.hybrid_encrypt(client, {}))["v"], 2)
+        client.envelope_version = 2
+        self.assertEqual(json.loads(encryption.hybrid_encrypt(client, {}))["v"], 2)
+
+
+class CompressionTests(unittest.TestCase):
+    def test_large_payloads_are_compressed_and_flagged(self):
+        client = build_client()
+        query = {"main_func": b"def f(x): return x\n" * 2000}
+        plain = json.loads(
+            encryption.hybrid_encrypt_v2(client, {"main_func": os.urandom(100)})
+        )
+        secret = encryption.hybrid_encrypt_v2(client, query)
+        data = json.loads(secret)
+
+        self.assertNotIn("z", plain)
+        self.assertIn(data["z"], ("zstd", "zlib"))
+        self.assertLess(len(data["cipher"]), len(dill.dumps(query)) // 4)
+        self.assertEqual(dill.loads(encryption.hybrid_decrypt(client, secret)), query)
+
+    def test_compression_can_be_disabled(self):
+        client = build_client()
+        with patch.dict(os.environ, {"NECTAR_COMPRESSION": "none"}):
+            secret = encryption.hybrid_encrypt_v2(client, b"a" * 10_000)
+        self.assertNotIn("z", json.loads(secret))
+
+    def test_zlib_round_trip(self):
+        with patch.dict(os.environ, {"NECTAR_COMPRESSION": "zlib"}):
+            codec, payload = encryption.compress_payload(b"a" * 10_000)
+        self.assertEqual(codec, "zlib")
+        self.assertEqual(encryption.decompress_payload(codec, payload), b"a" * 10_000)
+
+    def test_incompressible_payloads_are_left_alone(self):
+        data = os.urandom(10_000)
+        self.assertEqual(encryption.compress_payload(data), (None, data))
+
+
+class ChunkedResultTests(unittest.TestCase):
+    def seal(self, client, message, content_type, **kwargs):
+        return encryption.seal_chunked(
+            client, message, content_type, peer_pubkey=client.skey.public_key(), **kwargs
+        )
+
+    def test_json_result_round_trips_across_chunks(self):
+        client = build_client()
+        result = {"counts": list(range(5000))}
+        secret = self.seal(
+            client, json.dumps(result).encode(), "application/json", chunk_size=1024
+        )
+        self.assertGreater(len(json.loads(secret)["chunks"]), 1)
+        self.assertEqual(encryption.open_result(client, secret, None), result)
+
+    def test_content_type_selects_decoder(self):
+        client = build_client()
+        dilled = self.seal(client, dill.dumps({1, 2}), "application/x-dill")
+        text = self.seal(client, b'{"not": "parsed"}', "text/plain")
+        self.assertEqual(encryption.open_result(client, dilled, None), {1, 2})
+        self.assertEqual(encryption.open_result(client, text, None), '{"not": "parsed"}')
+
+    def test_truncated_chunk_list_is_rejected(self):
+        client = build_client()
+        with patch.dict(os.environ, {"NECTAR_COMPRESSION": "none"}):
+            secret = self.seal(client, os.urandom(4096), "application/octet-stream", chunk_size=1024)
+        data = json.loads(secret)
+        data["chunks"] = data["chunks"][:-1]
+        with self.assertRaises(Exception):
+            encryption.open_result(client, data, None)
+
+    def test_untyped_results_use_fallback_decoder(self):
+        client = build_client()
+        secret = encryption.hybrid_encrypt_v2(client, {"k": "v"})
+        self.assertEqual(encryption.open_result(client, secret, dill.loads), {"k": "v"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import types
+import unittest
+from unittest.mock import MagicMock
+
+from nectarpy.common.fees import FeeOracle, chain_id_from_config
+from nectarpy.common.nonce import NonceManager
+from nectarpy.common.transactions import send_transaction
+
+
+def build_web3(base_fee=100):
+    web3 = MagicMock()
+    web3.eth.get_block.return_value = {"baseFeePerGas": base_fee}
+    web3.eth.max_priority_fee = 7
+    web3.eth.gas_price = 50
+    web3.eth.get_transaction_count.return_value = 3
+    web3.eth.send_raw_transaction.return_value = b"tx_hash"
+    web3.eth.account.sign_transaction.return_value = types.SimpleNamespace(
+        rawTransaction=b"signed_tx"
+    )
+    return web3
+
+
+def contract_fn(name):
+    fn = MagicMock()
+    fn.fn_name = name
+    fn.address = "0xusdc"
+    fn.estimate_gas.return_value = 50_000
+    return fn
+
+
+class FeeOracleTests(unittest.TestCase):
+    def test_fees_are_read_once_per_ttl(self):
+        web3 = build_web3()
+        oracle = FeeOracle(web3, chain_id=1284, fee_ttl=60)
+        first = oracle.tx_params(contract_fn("payQuery"), "0xabc")
+        second = oracle.tx_params(contract_fn("payQuery"), "0xabc", {"gas": 1})
+
+        self.assertEqual(
+            first,
+            {"maxFeePerGas": 207, "maxPriorityFeePerGas": 7, "chainId": 1284},
+        )
+        self.assertEqual(second["gas"], 1)
+        web3.eth.get_block.assert_called_once()
+        oracle.invalidate()
+        oracle.fees()
+        self.assertEqual(web3.eth.get_block.call_count, 2)
+
+    def test_legacy_chains_get_a_gas_price(self):
+        oracle = FeeOracle(build_web3(base_fee=None))
+        self.assertEqual(oracle.fees(), {"gasPrice": 50})
+
+    def test_fixed_shape_gas_limits_are_memoized_with_margin(self):
+        oracle = FeeOracle(build_web3())
+        approve = contract_fn("approve")
+        self.assertEqual(oracle.gas_limit(approve, "0xabc"), 80_000)
+        self.assertEqual(oracle.gas_limit(contract_fn("approve"), "0xabc"), 80_000)
+        approve.estimate_gas.assert_called_once()
+        self.assertIsNone(oracle.gas_limit(contract_fn("payQuery"), "0xabc"))
+
+    def test_send_transaction_uses_cached_fields(self):
+        client = types.SimpleNamespace(
+            account={"address": "0xabc", "private_key": "0x123"},
+            web3=build_web3(),
+        )
+        client.nonce_manager = NonceManager(client.web3, "0xabc")
+        client._next_nonce = client.nonce_manager.allocate
+        client.fee_oracle = FeeOracle(client.web3, chain_id=1284, fee_ttl=60)
+        approve = contract_fn("approve")
+        send_transaction(client, approve)
+        send_transaction(client, approve)
+
+        built = approve.build_transaction.call_args[0][0]
+        self.assertEqual(built["nonce"], 4)
+        self.assertEqual(built["gas"], 80_000)
+        self.assertEqual(built["maxFeePerGas"], 207)
+        client.web3.eth.get_block.assert_called_once()
+
+    def test_chain_id_from_config(self):
+        self.assertEqual(chain_id_from_config({"chainId": "0x504"}), 1284)
+        self.assertIsNone(chain_id_from_config({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import json
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from web3 import Web3
+
+from nectarpy.common.blockchain_init import req_json
+from nectarpy.common.history import QueryHistory, deployment_block
+
+ME = "0x00000000000000000000000000000000000000aa"
+OTHER = "0x00000000000000000000000000000000000000bb"
+QM_ABI = json.loads(
+    (Path(__file__).parent / "nectarpy" / "config" / "QueryManager.json").read_text()
+)["abi"]
+
+
+def event(name, block, query_index, user=ME, value=None):
+    args = {"user": user, "queryIndex": query_index}
+    if value is not None:
+        args["value"] = value
+    return {
+        "event": name,
+        "args": args,
+        "blockNumber": block,
+        "transactionHash": bytes([query_index]) * 32,
+    }
+
+
+def query_row(query_index, bucket_ids, policy_indexes):
+    return (query_index, "cmd", "", 0, 10, bucket_ids, policy_indexes)
+
+
+@patch("nectarpy.common.history.decode_log", side_effect=lambda c, t, log: log)
+@patch("nectarpy.common.history.batch_call")
+class QueryHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "history.db"
+        self.web3 = MagicMock()
+        self.web3.eth.block_number = 10
+        self.web3.eth.get_block.side_effect = lambda n: {"timestamp": 1000 * n}
+        self.qm = Web3().eth.contract(address="0x" + "11" * 20, abi=QM_ABI)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self, **kwargs):
+        return QueryHistory(self.web3, self.qm, self.path, user=ME, **kwargs)
+
+    def test_queries_by_bucket_time_and_status(self, batch_mock, _):
+        batch_mock.return_value = [
+            query_row(1, [7], [0]),
+            query_row(2, [8, 7], [0, 1]),
+            query_row(4, [8], [0]),
+        ]
+        self.web3.eth.get_logs.return_value = [
+            event("PaidQuery", 2, 1, value=10),
+            event("PaidQuery", 5, 2, value=20),
+            event("PaidQuery", 5, 3, user=OTHER, value=30),
+            event("PaidQuery", 8, 4, value=40),
+            event("SuccessfulQuery", 6, 1),
+            event("RefundQuery", 9, 4, value=40),
+        ]
+        history = self.open()
+        self.assertEqual(history.sync(), 5)
+
+        on_7 = history.queries(bucket_id=7)
+        self.assertEqual([q["query_index"] for q in on_7], [1, 2])
+        self.assertEqual(on_7[1]["bucket_ids"], [8, 7])
+        self.assertEqual(on_7[1]["policy_indexes"], [0, 1])
+        self.assertEqual(on_7[0]["status"], "succeeded")
+
+        since = datetime.fromtimestamp(5000, tz=timezone.utc)
+        self.assertEqual([q["query_index"] for q in history.queries(since=since)], [2, 4])
+        self.assertEqual([q["query_index"] for q in history.pending()], [2])
+        refunded = history.queries(status="refunded")[0]
+        self.assertEqual((refunded["paid"], refunded["refunded"]), (40, 40))
+
+    def test_sync_resumes_from_checkpoint(self, batch_mock, _):
+        batch_mock.return_value = [query_row(1, [7], [0])]
+        self.web3.eth.get_logs.return_value = [event("PaidQuery", 3, 1, value=10)]
+        self.open(start_block=2).sync()
+
+        self.web3.eth.block_number = 12
+        batch_mock.return_value = []
+        self.web3.eth.get_logs.return_value = [event("SuccessfulQuery", 11, 1)]
+        history = self.open(start_block=2)
+        self.assertEqual(history.next_block, 11)
+        history.sync()
+
+        params = self.web3.eth.get_logs.call_args[0][0]
+        self.assertEqual((params["fromBlock"], params["toBlock"]), (11, 12))
+        self.assertEqual(history.queries()[0]["status"], "succeeded")
+        self.assertEqual(history.next_block, 13)
+
+    def test_each_user_keeps_its_own_checkpoint(self, batch_mock, _):
+        batch_mock.return_value = []
+        self.web3.eth.get_logs.return_value = []
+        self.open(start_block=2).sync()
+        other = QueryHistory(self.web3, self.qm, self.path, user=OTHER, start_block=2)
+        self.assertEqual(other.next_block, 2)
+        self.assertEqual(self.open(start_block=2).next_block, 11)
+
+    def test_new_index_starts_at_deployment_block(self, batch_mock, _):
+        batch_mock.return_value = []
+        self.web3.eth.get_logs.return_value = []
+        self.web3.eth.get_code.side_effect = lambda address, block: (
+            b"\x60" if block >= 7 else b""
+        )
+        history = self.open()
+        self.assertEqual(history.next_block, 7)
+        history.sync()
+        params = self.web3.eth.get_logs.call_args[0][0]
+        self.assertEqual(params["fromBlock"], 7)
+
+    def test_large_ranges_are_read_in_chunks(self, batch_mock, _):
+        batch_mock.return_value = []
+        self.web3.eth.get_logs.return_value = []
+        self.web3.eth.block_number = 4999
+        with patch.dict("os.environ", {"NECTAR_LOG_RANGE": "2000"}):
+            self.open(start_block=0).sync()
+        ranges = [
+            (c[0][0]["fromBlock"], c[0][0]["toBlock"])
+            for c in self.web3.eth.get_logs.call_args_list
+        ]
+        self.assertEqual(ranges, [(0, 1999), (2000, 3999), (4000, 4999)])
+
+
+class DeploymentBlockTests(unittest.TestCase):
+    def test_node_without_history_scans_from_genesis(self):
+        web3 = MagicMock()
+        web3.eth.block_number = 100
+        web3.eth.get_code.side_effect = ValueError("missing trie node")
+        with self.assertWarnsRegex(RuntimeWarning, "queryManagerBlock"):
+            self.assertEqual(deployment_block(web3, "0x" + "11" * 20), 0)
+
+    def test_configured_networks_have_a_start_block(self):
+        config = req_json("config/blockchain.json")
+        for network in ("moonbeam", "moonbase"):
+            self.assertIsInstance(config[network]["queryManagerBlock"], int)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from nectarpy.lib import Nectar
+
+OWNER = "0x00000000000000000000000000000000000000aa"
+OTHER = "0x00000000000000000000000000000000000000bb"
+
+
+def bucket(bucket_id, policy_ids, deactivated=False):
+    return {
+        "bucket_id": bucket_id,
+        "policy_ids": policy_ids,
+        "data_format": "std1",
+        "node_address": "node",
+        "owner": OWNER,
+        "deactivated": deactivated,
+    }
+
+
+def policy(policy_id, deactivated=False):
+    return {"policy_id": policy_id, "price": 1, "deactivated": deactivated}
+
+
+def event(name, **args):
+    return {"event": name, "args": args}
+
+
+class FakeChain:
+    """Serves batched bucket and policy reads from dicts"""
+
+    def __init__(self):
+        self.buckets = {1: bucket(1, [10]), 2: bucket(2, [10, 11])}
+        self.policies = {10: policy(10), 11: policy(11)}
+        self.reads = []
+
+    def read_buckets(self, ids):
+        self.reads.append(("buckets", sorted(ids)))
+        return [dict(self.buckets[i]) for i in ids]
+
+    def read_policies(self, ids):
+        self.reads.append(("policies", sorted(ids)))
+        return [dict(self.policies[i]) for i in ids]
+
+
+def build_client(chain):
+    client = object.__new__(Nectar)
+    client.account = {"address": OWNER, "private_key": "0x123"}
+    client.web3 = MagicMock()
+    client.EoaBond = MagicMock()
+    client._contract_supports_function = MagicMock(return_value=False)
+    fns = client.EoaBond.functions
+    fns.getAllBucketIdsByOwner.return_value.call.side_effect = lambda *_: list(chain.buckets)
+    fns.getPolicyIdByOwner.return_value.call.side_effect = lambda *_: list(chain.policies)
+    return client
+
+
+@patch("nectarpy.common.inventory.EventWatcher")
+class InventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.chain = FakeChain()
+        patches = [
+            patch(
+                "nectarpy.common.inventory.Inventory._read_buckets",
+                side_effect=self.chain.read_buckets,
+            ),
+            patch(
+                "nectarpy.common.inventory.Inventory._read_policies",
+                side_effect=self.chain.read_policies,
+            ),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def sync(self, client, events):
+        client.inventory._watcher.poll.return_value = events
+        client.inventory._last_poll = time.monotonic() - 60
+        client.inventory.sync()
+
+    def test_first_listing_loads_everything_in_one_pass(self, watcher_cls):
+        client = build_client(self.chain)
+        self.assertEqual([b["bucket_id"] for b in client.list_buckets()], [1, 2])
+        self.assertEqual([p["policy_id"] for p in client.list_policies(bucket_id=1)], [10])
+        self.assertEqual([b["bucket_id"] for b in client.list_buckets(policy_id=11)], [2])
+        self.assertEqual(self.chain.reads, [("buckets", [1, 2]), ("policies", [10, 11])])
+
+    def test_events_update_only_what_they_name(self, watcher_cls):
+        client = build_client(self.chain)
+        client.sync_inventory()
+        self.chain.reads.clear()
+
+        self.chain.buckets[3] = bucket(3, [12])
+        self.chain.policies[12] = policy(12)
+        self.chain.buckets[1] = bucket(1, [10, 12])
+        self.sync(
+            client,
+            [
+                event("BucketAdded", bucketId=3, owner=OWNER),
+                event("BucketAdded", bucketId=99, owner=OTHER),
+                event("PolicyAdded", policyId=12, owner=OWNER),
+                event("PolicyAddedToBucket", bucketId=1, policyId=12),
+                event("PolicyDeactivated", policyId=11),
+                event("BucketDeactivated", bucketId=2),
+            ],
+        )
+        self.assertEqual(self.chain.reads, [("buckets", [1, 3]), ("policies", [12])])
+        self.assertEqual([b["bucket_id"] for b in client.list_buckets()], [1, 3])
+        self.assertEqual(
+            [p["policy_id"] for p in client.list_policies(bucket_id=1)], [10, 12]
+        )
+        self.assertEqual(len(client.list_policies(include_deactivated=True)), 3)
+
+    def test_polling_failure_reloads(self, watcher_cls):
+        client = build_client(self.chain)
+        client.sync_inventory()
+        client.inventory._watcher.poll.side_effect = RuntimeError("filter not found")
+        del self.chain.buckets[2]
+        self.sync(client, [])
+        self.assertEqual([b["bucket_id"] for b in client.list_buckets()], [1])
+
+    def test_results_are_copies(self, watcher_cls):
+        client = build_client(self.chain)
+        client.list_buckets()[0]["policy_ids"].append(42)
+        self.assertEqual(client.list_buckets()[0]["policy_ids"], [10])
+
+
+if __name__ == "__main__":
+    unittest.main()
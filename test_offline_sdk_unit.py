@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import types
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from eth_account import Account
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from nectarpy.common.nonce import NonceManager
+from nectarpy.common.offline import load_transactions, replay_transactions
+from nectarpy.session import NectarSession
+
+SECRET = "0x" + "11" * 32
+FEES = {"maxFeePerGas": 200, "maxPriorityFeePerGas": 2}
+POLICY = {
+    "allowed_categories": ["*"],
+    "allowed_addresses": ["0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"],
+    "allowed_columns": ["age"],
+    "valid_days": 7,
+    "usd_price": 0.01,
+}
+
+
+def offline_session():
+    # Nothing listens here, so any RPC the signing path makes fails the test.
+    env = {"NECTAR_RPC_URLS": "http://127.0.0.1:9", "NECTAR_RPC_RETRIES": "0"}
+    with patch.dict(os.environ, env):
+        session = NectarSession("localhost")
+    assert [e.uri for e in session.web3.provider.endpoints] == ["http://127.0.0.1:9"]
+    return session
+
+
+class OfflineSigningTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "txs.jsonl"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_owner_batch_signs_without_a_node(self):
+        owner = offline_session().data_owner(SECRET, check_role=False)
+        batch = owner.offline_batch(nonce=40, fees=FEES)
+        created = batch.provision(
+            {
+                "policies": {"open": dict(POLICY)},
+                "buckets": {
+                    "cohort": {
+                        "policy_ids": ["open"],
+                        "use_allowlists": [False],
+                        "data_format": "std1",
+                        "node_address": "https://node",
+                    }
+                },
+            }
+        )
+        batch.deactivate_policy(created["policies"]["open"])
+        batch.save(self.path)
+
+        entries = load_transactions(self.path)
+        self.assertEqual([e["nonce"] for e in entries], [40, 41, 42])
+        self.assertEqual(
+            [e["action"] for e in entries], ["add_policy", "add_bucket", "deactivate_policy"]
+        )
+        for entry in entries:
+            raw = bytes.fromhex(entry["raw"][2:])
+            self.assertEqual(Web3.to_hex(Web3.keccak(raw)), entry["hash"])
+            self.assertEqual(Account.recover_transaction(raw), owner.account["address"])
+
+    def test_analyst_batch_numbers_queries(self):
+        analyst = offline_session().data_analyst(SECRET, check_role=False)
+        batch = analyst.offline_batch(nonce=0, fees=FEES)
+        batch.approve(1_000)
+
+        def main_func():
+            return 1
+
+        query = {"main_func": main_func, "bucket_ids": [1], "policy_indexes": [0]}
+        self.assertEqual(batch.pay_queries([query, query], [10, 10], user_index=7), [7, 8])
+        self.assertEqual([e["nonce"] for e in batch.transactions], [0, 1, 2])
+        with self.assertRaisesRegex(ValueError, "fees"):
+            analyst.offline_batch(nonce=0, fees={})
+
+    def test_replay_sends_in_nonce_order_and_tolerates_known_transactions(self):
+        entries = [
+            {"nonce": n, "action": "approve", "hash": "0x%064x" % n, "raw": f"0x0{n}"}
+            for n in (3, 1, 2)
+        ]
+        self.path.write_text("".join(json.dumps(e) + "\n" for e in entries))
+        client = types.SimpleNamespace(web3=MagicMock())
+        client.nonce_manager = NonceManager(client.web3, "0xabc")
+        client.nonce_manager._next = 9
+        sent = []
+
+        def send(raw):
+            sent.append(raw)
+            if raw == "0x02":
+                raise ValueError("already known")
+
+        client.web3.eth.send_raw_transaction.side_effect = send
+        hashes = replay_transactions(client, self.path, wait=False)
+
+        self.assertEqual(sent, ["0x01", "0x02", "0x03"])
+        self.assertEqual(hashes[0], "0x%064x" % 1)
+        self.assertIsNone(client.nonce_manager._next)
+
+        client.web3.eth.send_raw_transaction.side_effect = ValueError("nonce too low")
+        client.web3.eth.get_transaction_receipt.side_effect = TransactionNotFound("x")
+        with self.assertRaisesRegex(RuntimeError, "approve nonce 1"):
+            replay_transactions(client, self.path, wait=False)
+
+    def test_replaying_mined_transactions_again_succeeds(self):
+        entries = [
+            {"nonce": n, "action": "approve", "hash": "0x%064x" % n, "raw": f"0x0{n}"}
+            for n in (1, 2)
+        ]
+        self.path.write_text("".join(json.dumps(e) + "\n" for e in entries))
+        client = types.SimpleNamespace(web3=MagicMock())
+        client.web3.eth.send_raw_transaction.side_effect = ValueError("nonce too low")
+        mined = {"0x%064x" % 1}
+
+        def receipt(tx_hash):
+            if tx_hash not in mined:
+                raise TransactionNotFound(tx_hash)
+            return {"status": 1}
+
+        client.web3.eth.get_transaction_receipt.side_effect = receipt
+        # Nonce 2 was taken by another transaction, which is still an error.
+        with self.assertRaisesRegex(RuntimeError, "nonce 2") as caught:
+            replay_transactions(client, self.path, wait=False)
+        self.assertNotIn("nonce 1", str(caught.exception))
+
+        mined.add("0x%064x" % 2)
+        self.assertEqual(len(replay_transactions(client, self.path, wait=False)), 2)
+
+    def test_failed_save_leaves_no_temporary_file(self):
+        batch = offline_session().data_analyst(SECRET, check_role=False).offline_batch(
+            nonce=0, fees=FEES
+        )
+        batch.transactions.append({"nonce": 0, "raw": object()})
+        with self.assertRaises(TypeError):
+            batch.save(self.path)
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from nectarpy.common.receipts import (
+    HeadWatcher,
+    ReceiptTracker,
+    receipt_settings,
+    wait_for_mined,
+)
+
+HASH_A = "0x" + "aa" * 32
+HASH_B = "0x" + "bb" * 32
+
+
+def raw_receipt(tx_hash, block=5):
+    return {
+        "transactionHash": tx_hash,
+        "blockHash": "0x" + "cc" * 32,
+        "blockNumber": hex(block),
+        "status": "0x1",
+        "gasUsed": "0x5208",
+        "logs": [],
+    }
+
+
+class FakeNode:
+    """Mines every requested transaction once mine() is called"""
+
+    def __init__(self):
+        self.block = 4
+        self.mined = set()
+        self.receipt_calls = []
+
+    def get_transaction_receipt(self, tx_hash):
+        self.receipt_calls.append(tx_hash)
+        if tx_hash not in self.mined:
+            raise TransactionNotFound(tx_hash)
+        return {"transactionHash": tx_hash, "status": 1}
+
+    def mine(self, *hashes):
+        self.block += 1
+        self.mined.update(hashes)
+
+
+def build_web3(node):
+    web3 = MagicMock()
+    type(web3.eth).block_number = property(lambda _: node.block)
+    web3.eth.get_transaction_receipt.side_effect = node.get_transaction_receipt
+    web3.eth.get_block.side_effect = lambda n: {
+        "number": 100 if n == "latest" else n,
+        "timestamp": 600 if n == "latest" else n * 6,
+    }
+    return web3
+
+
+class ReceiptTrackerTests(unittest.TestCase):
+    def test_threads_share_one_poll_loop(self):
+        node = FakeNode()
+        tracker = ReceiptTracker(build_web3(node), poll=0.01)
+        results = {}
+
+        def wait(tx_hash):
+            results[tx_hash] = tracker.wait(tx_hash, timeout=5)
+
+        threads = [threading.Thread(target=wait, args=(h,)) for h in (HASH_A, HASH_B)]
+        for t in threads:
+            t.start()
+        while len(tracker._waiters) < 2:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        node.mine(HASH_A, HASH_B)
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results[HASH_A]["transactionHash"], HASH_A)
+        self.assertEqual(results[HASH_B]["status"], 1)
+        # One poll covers every pending hash, so both came back from the same poll.
+        self.assertEqual(sorted(node.receipt_calls[-2:]), [HASH_A, HASH_B])
+        self.assertEqual(tracker._waiters, {})
+
+    def test_polls_are_aligned_to_block_time(self):
+        node = FakeNode()
+        tracker = ReceiptTracker(build_web3(node))
+        tracker._waiters[HASH_A] = 1
+        tracker._poll_once()
+        self.assertEqual(tracker.block_time, 6)
+        self.assertEqual(tracker._delay(), 0.5)
+
+        node.mine()
+        tracker._poll_once()
+        self.assertAlmostEqual(tracker._delay(), 6, delta=0.1)
+
+    def test_late_block_backs_off_to_block_time(self):
+        node = FakeNode()
+        tracker = ReceiptTracker(build_web3(node))
+        tracker._waiters[HASH_A] = 1
+        tracker._poll_once()
+        node.mine()
+        tracker._poll_once()
+        tracker._block_seen -= 6
+
+        self.assertEqual([tracker._delay() for _ in range(5)], [0.5, 1, 2, 4, 6])
+        node.mine()
+        tracker._poll_once()
+        self.assertAlmostEqual(tracker._delay(), 6, delta=0.1)
+        tracker._block_seen -= 6
+        self.assertEqual(tracker._delay(), 0.5)
+
+    def test_missing_websockets_falls_back_to_polling(self):
+        with patch.dict("sys.modules", {"websockets.sync.client": None}), patch(
+            "builtins.print"
+        ) as print_mock:
+            watcher = HeadWatcher("wss://example.org", lambda: None)
+        self.assertFalse(watcher.alive)
+        self.assertIn("nectarpy[ws]", print_mock.call_args.args[0])
+
+    def test_timeout_names_the_transaction(self):
+        web3 = build_web3(FakeNode())
+        client = MagicMock(spec=["web3", "blockchain_config"])
+        client.web3 = web3
+        client.blockchain_config = {}
+        client.receipt_tracker = ReceiptTracker(web3, poll=0.01)
+        with patch.dict(os.environ, {"NECTAR_TX_RECEIPT_TIMEOUT": "0.05"}):
+            with self.assertRaisesRegex(TimeoutError, "add_bucket transaction 0xaa"):
+                wait_for_mined(client, [(HASH_A, "add_bucket")])
+
+    def test_batch_poll_reads_all_receipts_in_one_request(self):
+        web3 = Web3(Web3.HTTPProvider("http://127.0.0.1:1"))
+        tracker = ReceiptTracker(web3, poll=0.01)
+        tracker.block_time = 6
+        replies = [
+            {"jsonrpc": "2.0", "id": 0, "result": "0x5"},
+            {"jsonrpc": "2.0", "id": 1, "result": raw_receipt(HASH_A)},
+            {"jsonrpc": "2.0", "id": 2, "result": raw_receipt(HASH_B)},
+        ]
+        with patch(
+            "nectarpy.common.batch.make_post_request",
+            return_value=json.dumps(replies).encode(),
+        ) as post:
+            receipts = tracker.wait_many([HASH_A, bytes.fromhex("bb" * 32)], timeout=5)
+        post.assert_called_once()
+        self.assertEqual(receipts[1].blockNumber, 5)
+        self.assertEqual(Web3.to_hex(receipts[0].transactionHash), HASH_A)
+
+    def test_fractional_poll_interval(self):
+        with patch.dict(os.environ, {"NECTAR_TX_RECEIPT_POLL": "0.25"}):
+            self.assertEqual(receipt_settings(), (180.0, 0.25))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import stat
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from nectarpy.common.result_cache import ResultCache, query_fingerprint
+from nectarpy.lib_v1 import NectarClient
+
+
+def deactivated(policy_id):
+    return {"event": "PolicyDeactivated", "args": {"policyId": policy_id}}
+
+
+def build_cache(watcher_cls, start_block=100, **kwargs):
+    watcher_cls.return_value.next_block = start_block
+    watcher_cls.return_value.topics = {"0xtopic": "PolicyDeactivated"}
+    watcher_cls.return_value.poll.return_value = []
+    web3 = MagicMock()
+    web3.eth.block_number = start_block
+    web3.eth.get_logs.return_value = []
+    kwargs.setdefault("open_result", json.loads)
+    return ResultCache(web3, MagicMock(), event_poll=0, **kwargs)
+
+
+@patch("nectarpy.common.result_cache.EventWatcher")
+class ResultCacheTests(unittest.TestCase):
+    def test_hit_returns_a_copy(self, watcher_cls):
+        cache = build_cache(watcher_cls)
+        cache.store("fp", {"count": 3}, [10], [1])
+        hit, value = cache.lookup("fp")
+        self.assertTrue(hit)
+        value["count"] = 4
+        self.assertEqual(cache.lookup("fp"), (True, {"count": 3}))
+
+    def test_entries_expire(self, watcher_cls):
+        cache = build_cache(watcher_cls, ttl=0)
+        cache.store("fp", 1, [10], [1])
+        time.sleep(0.01)
+        self.assertEqual(cache.lookup("fp"), (False, None))
+
+    def test_policy_deactivation_invalidates(self, watcher_cls):
+        cache = build_cache(watcher_cls)
+        cache.store("fp", 1, [10], [1])
+        cache.store("other", 2, [11], [2])
+        watcher_cls.return_value.poll.return_value = [deactivated(10)]
+        self.assertEqual(cache.lookup("fp"), (False, None))
+        self.assertEqual(cache.lookup("other"), (True, 2))
+
+    def test_disk_entries_are_checked_against_logs_since_written(self, watcher_cls):
+        with tempfile.TemporaryDirectory() as directory:
+            build_cache(watcher_cls, directory=directory).store("a", 1, [10], [1], raw="1")
+            build_cache(watcher_cls, directory=directory).store("b", 2, [11], [2], raw="2")
+
+            later = build_cache(watcher_cls, start_block=200, directory=directory)
+            with patch(
+                "nectarpy.common.result_cache.decode_log",
+                return_value=deactivated(10),
+            ):
+                later.web3.eth.get_logs.return_value = ["log"]
+                self.assertEqual(later.lookup("a"), (False, None))
+            later.web3.eth.get_logs.return_value = []
+            self.assertEqual(later.lookup("b"), (True, 2))
+            self.assertEqual(later.web3.eth.get_logs.call_args[0][0]["fromBlock"], 100)
+
+
+    def test_disk_entries_hold_the_raw_result_for_the_owner_only(self, watcher_cls):
+        with tempfile.TemporaryDirectory() as directory:
+            opener = MagicMock(return_value={"count": 3})
+            cache = build_cache(watcher_cls, directory=directory, open_result=opener)
+            cache.store("fp", {"count": 3}, [10], [1], raw='{"sealed": "abc"}')
+
+            path = Path(directory) / "fp.json"
+            self.assertEqual(json.loads(path.read_text())["raw"], '{"sealed": "abc"}')
+            self.assertNotIn("value", json.loads(path.read_text()))
+            if os.name == "posix":
+                self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o600)
+
+            later = build_cache(watcher_cls, directory=directory, open_result=opener)
+            self.assertEqual(later.lookup("fp"), (True, {"count": 3}))
+            opener.assert_called_once_with('{"sealed": "abc"}')
+
+    def test_failed_poll_keeps_entries_until_events_catch_up(self, watcher_cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = build_cache(watcher_cls, directory=directory)
+            cache.store("fp", 1, [10], [1], raw="1")
+            watcher_cls.return_value.poll.side_effect = ValueError("node down")
+            self.assertEqual(cache.lookup("fp"), (False, None))
+            self.assertTrue((Path(directory) / "fp.json").exists())
+
+            watcher_cls.return_value.poll.side_effect = None
+            cache._retry_at = 0
+            self.assertEqual(cache.lookup("fp"), (True, 1))
+            self.assertEqual(cache._start_block, 100)
+            watcher_cls.assert_called_once()
+
+    def test_watcher_is_installed_once_the_node_answers(self, watcher_cls):
+        watcher_cls.side_effect = [ValueError("node down"), watcher_cls.return_value]
+        cache = build_cache(watcher_cls)
+        cache.store("fp", 1, [10], [1])
+        self.assertEqual(cache.lookup("fp"), (False, None))
+
+        cache._retry_at = 0
+        cache.sync()
+        self.assertEqual(watcher_cls.call_count, 2)
+        self.assertEqual(cache.lookup("fp"), (True, 1))
+
+
+class FingerprintTests(unittest.TestCase):
+    def test_function_code_is_part_of_the_key(self):
+        client = MagicMock()
+        client.account = {"address": "0xabc"}
+        client.qm_contract_addr = "0xqm"
+        spec = {
+            "pre_compute_func": None,
+            "is_separate_data": False,
+            "bucket_ids": [1],
+            "policy_indexes": [0],
+            "categorize_by_do": False,
+            "aggregate_type": None,
+        }
+
+        def main_func():
+            return 1
+
+        first = query_fingerprint(client, {**spec, "main_func": main_func})
+        # Same name, new body, as after editing an importable module.
+        main_func.__code__ = (lambda: 2).__code__
+        with patch("nectarpy.common.result_cache.dumps_function", return_value=b"ref"):
+            second = query_fingerprint(client, {**spec, "main_func": main_func})
+            main_func.__code__ = (lambda: 1).__code__
+            third = query_fingerprint(client, {**spec, "main_func": main_func})
+        self.assertNotEqual(first, second)
+        self.assertNotEqual(second, third)
+
+
+class ByocQueryCacheTests(unittest.TestCase):
+    def test_repeat_query_skips_payment(self):
+        client = object.__new__(NectarClient)
+        client.account = {"address": "0xabc", "private_key": "0x123"}
+        client.qm_contract_addr = "0xqm"
+        client.check_if_is_valid_user_role = MagicMock()
+        client.get_pay_amount = MagicMock(return_value=10)
+        client.get_allowance = MagicMock(return_value=0)
+        client.approve_payment = MagicMock()
+        client.pay_query = MagicMock(return_value=(11, {"status": 1}))
+        client._open_result = MagicMock(return_value={"count": 3})
+        with patch("nectarpy.common.result_cache.EventWatcher") as watcher_cls:
+            client.result_cache = build_cache(watcher_cls)
+
+        def main_func():
+            return 1
+
+        kwargs = {"main_func": main_func, "bucket_ids": [1], "policy_indexes": [0]}
+        with patch("nectarpy.lib_v1.get_bucket_policy_ids", return_value=[[10]]), patch(
+            "nectarpy.lib_v1.wait_for_raw_result", return_value='{"sealed": "abc"}'
+        ):
+            first = client.byoc_query(**kwargs)
+            second = client.byoc_query(**kwargs)
+            self.assertEqual(first, second)
+            client.pay_query.assert_called_once()
+
+            watcher_cls.return_value.poll.return_value = [deactivated(10)]
+            client.byoc_query(**kwargs)
+        self.assertEqual(client.pay_query.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
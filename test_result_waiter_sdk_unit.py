@@ -0,0 +1,228 @@
+import unittest
+import types
+from unittest.mock import MagicMock, patch
+
+from nectarpy.common.blockchain_init import req_json
+from nectarpy.common.events import EventWatcher, event_topics
+from nectarpy.common.query_handle import QueryHandle
+from nectarpy.common.result_waiter import (
+    QUERY_REFUNDED,
+    _poll_settings,
+    _result_feed,
+    wait_for_raw_result,
+)
+from web3.exceptions import TransactionNotFound
+from nectarpy.lib_v1 import NectarClient
+
+
+def build_client(query_results):
+    client = object.__new__(NectarClient)
+    client.account = {"address": "0xabc", "private_key": "0x123"}
+    client.web3 = MagicMock()
+    client.QueryManager = MagicMock()
+    client.QueryManager.functions.getQueryByUserIndex.return_value.call.side_effect = (
+        query_results
+    )
+    return client
+
+
+def query_row(result, query_index=42, status=0):
+    return [query_index, "cmd", result, status, 10, [1], [0]]
+
+
+def result_event(name, query_index):
+    return {"event": name, "args": {"user": "0xabc", "queryIndex": query_index}}
+
+
+@patch("nectarpy.common.result_waiter.time.sleep")
+class ResultWaiterTests(unittest.TestCase):
+    def test_returns_immediately_when_result_already_posted(self, sleep_mock):
+        client = build_client([query_row("done")])
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            self.assertEqual(wait_for_raw_result(client, 3), "done")
+            watcher_cls.return_value.uninstall.assert_called_once()
+        sleep_mock.assert_not_called()
+
+    def test_reads_query_only_after_matching_event(self, sleep_mock):
+        client = build_client([query_row(""), query_row("done")])
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.side_effect = [
+                [],
+                [result_event("SuccessfulQuery", 7)],
+                [result_event("SuccessfulQuery", 42)],
+            ]
+            self.assertEqual(wait_for_raw_result(client, 3), "done")
+        calls = client.QueryManager.functions.getQueryByUserIndex.return_value.call
+        self.assertEqual(calls.call_count, 2)
+
+    def test_refund_without_result_raises(self, sleep_mock):
+        client = build_client([query_row(""), query_row("")])
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.return_value = [
+                result_event("RefundQuery", 42)
+            ]
+            with self.assertRaises(RuntimeError):
+                wait_for_raw_result(client, 3)
+
+    def test_falls_back_to_backoff_polling_without_filters(self, sleep_mock):
+        client = build_client([query_row(""), query_row(""), query_row("done")])
+        with patch(
+            "nectarpy.common.result_waiter.EventWatcher",
+            side_effect=ValueError("no filters"),
+        ):
+            self.assertEqual(wait_for_raw_result(client, 3), "done")
+        delays = [c.args[0] for c in sleep_mock.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertGreater(delays[1], delays[0])
+
+    def test_refund_is_seen_while_polling(self, sleep_mock):
+        client = build_client([query_row(""), query_row("", status=QUERY_REFUNDED)])
+        with patch(
+            "nectarpy.common.result_waiter.EventWatcher",
+            side_effect=ValueError("no filters"),
+        ):
+            with self.assertRaisesRegex(RuntimeError, "refunded"):
+                wait_for_raw_result(client, 3)
+
+    def test_refund_reports_the_posted_error(self, sleep_mock):
+        client = build_client(
+            [query_row("Something went wrong: bad bucket", status=QUERY_REFUNDED)]
+        )
+        with patch("nectarpy.common.result_waiter.EventWatcher"):
+            with self.assertRaisesRegex(RuntimeError, "refunded: Something went wrong"):
+                wait_for_raw_result(client, 3)
+
+    def test_concurrent_waits_share_one_watcher(self, sleep_mock):
+        client = build_client([query_row(""), query_row("done")])
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.return_value = [
+                result_event("SuccessfulQuery", 42)
+            ]
+            feed = _result_feed(client)
+            feed.join()
+            self.assertEqual(wait_for_raw_result(client, 3), "done")
+            watcher_cls.assert_called_once()
+            watcher_cls.return_value.uninstall.assert_not_called()
+            feed.leave()
+            watcher_cls.return_value.uninstall.assert_called_once()
+
+    def test_polls_follow_the_block_time(self, sleep_mock):
+        client = build_client([])
+        client.receipt_tracker = MagicMock(block_time=12.0)
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertEqual(_poll_settings(client)[0], 12.0)
+            del client.receipt_tracker
+            self.assertEqual(_poll_settings(client)[0], 6.0)
+
+    @patch("nectarpy.common.result_waiter._poll_settings", return_value=(2, 15, 0))
+    def test_refund_is_seen_on_recheck_without_event(self, settings_mock, sleep_mock):
+        client = build_client([query_row(""), query_row("", status=QUERY_REFUNDED)])
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.return_value = []
+            with self.assertRaisesRegex(RuntimeError, "refunded"):
+                wait_for_raw_result(client, 3)
+
+    def test_times_out(self, sleep_mock):
+        client = build_client([query_row("")] * 10)
+        with patch("nectarpy.common.result_waiter.EventWatcher") as watcher_cls:
+            watcher_cls.return_value.poll.return_value = []
+            with self.assertRaises(TimeoutError):
+                wait_for_raw_result(client, 3, timeout=0)
+
+
+class QueryHandleTests(unittest.TestCase):
+    def build_handle(self, query_results, tx_hash=None):
+        client = build_client(query_results)
+        client._open_result = MagicMock(side_effect=lambda raw: f"decoded-{raw}")
+        return client, QueryHandle(client, 3, tx_hash)
+
+    def test_poll_is_non_blocking_and_decodes_once(self):
+        client, handle = self.build_handle(
+            [query_row(""), query_row(""), query_row("done")]
+        )
+        self.assertIsNone(handle.poll())
+        self.assertFalse(handle.done())
+        self.assertTrue(handle.done())
+        self.assertEqual(handle.poll(), "decoded-done")
+        client._open_result.assert_called_once_with("done")
+
+    def test_pending_transaction_is_not_done(self):
+        client, handle = self.build_handle([query_row("done")], tx_hash=b"\x01")
+        client.web3.eth.get_transaction_receipt.side_effect = TransactionNotFound("x")
+        self.assertFalse(handle.done())
+        client.QueryManager.functions.getQueryByUserIndex.assert_not_called()
+
+    def test_refunded_query_raises(self):
+        client, handle = self.build_handle([query_row("", status=QUERY_REFUNDED)])
+        with self.assertRaisesRegex(RuntimeError, "refunded"):
+            handle.poll()
+
+    def test_reverted_transaction_raises(self):
+        client, handle = self.build_handle([], tx_hash=b"\x01")
+        client.web3.eth.get_transaction_receipt.return_value = types.SimpleNamespace(
+            status=0
+        )
+        with self.assertRaisesRegex(RuntimeError, "reverted"):
+            handle.poll()
+
+    @patch("nectarpy.common.query_handle.wait_for_raw_result", return_value="done")
+    def test_resumed_handle_waits_for_result(self, wait_mock):
+        client = build_client([])
+        client._open_result = MagicMock(return_value={"ok": True})
+        handle = NectarClient.query_handle(client, 3)
+        self.assertEqual(handle.result(timeout=5), {"ok": True})
+        wait_mock.assert_called_once_with(client, 3, timeout=5)
+
+
+class EventWatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.contract = MagicMock()
+        self.contract.abi = req_json("config/QueryManager.json")["abi"]
+        self.contract.address = "0xqm"
+        self.topics = event_topics(self.contract, ["SuccessfulQuery", "RefundQuery"])
+
+    def test_event_topics_rejects_unknown_event(self):
+        with self.assertRaises(ValueError):
+            event_topics(self.contract, ["NoSuchEvent"])
+
+    def test_falls_back_to_get_logs_when_filter_expires(self):
+        web3 = MagicMock()
+        web3.eth.block_number = 100
+        web3.eth.filter.return_value.get_new_entries.side_effect = ValueError(
+            "filter not found"
+        )
+        success_topic = next(
+            t for t, name in self.topics.items() if name == "SuccessfulQuery"
+        )
+        web3.eth.get_logs.return_value = [{"topics": [success_topic]}]
+        watcher = EventWatcher(web3, self.contract, ["SuccessfulQuery", "RefundQuery"])
+
+        events = watcher.poll()
+
+        self.assertEqual(len(events), 1)
+        params = web3.eth.get_logs.call_args[0][0]
+        self.assertEqual(params["fromBlock"], 100)
+        self.assertEqual(watcher.next_block, 101)
+
+    def test_lost_filter_resumes_after_last_seen_block(self):
+        web3 = MagicMock()
+        web3.eth.block_number = 100
+        success_topic = next(
+            t for t, name in self.topics.items() if name == "SuccessfulQuery"
+        )
+        web3.eth.filter.return_value.get_new_entries.side_effect = [
+            [{"topics": [success_topic], "blockNumber": 130}],
+            ValueError("filter not found"),
+        ]
+        web3.eth.get_logs.return_value = []
+        watcher = EventWatcher(web3, self.contract, ["SuccessfulQuery", "RefundQuery"])
+
+        self.assertEqual(len(watcher.poll()), 1)
+        self.assertEqual(watcher.next_block, 131)
+        web3.eth.block_number = 140
+        watcher.poll()
+        self.assertEqual(web3.eth.get_logs.call_args[0][0]["fromBlock"], 131)
+
+
+if __name__ == "__main__":
+    unittest.main()
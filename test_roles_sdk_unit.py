@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from nectarpy.common.roles import RoleCache, RoleFeed
+from nectarpy.lib_v1 import NectarClient
+
+ADDRESS = "0x00000000000000000000000000000000000000aA"
+
+
+def build_client(role="DA", address=ADDRESS, feed=None):
+    client = object.__new__(NectarClient)
+    client.account = {"address": address, "private_key": "0x123"}
+    client.web3 = MagicMock()
+    client.role_feed = feed or RoleFeed(event_poll=0.01)
+    client.UserRole = MagicMock()
+    client.UserRole.functions.getUserRole.return_value.call.return_value = role
+    return client
+
+
+def role_calls(client):
+    return client.UserRole.functions.getUserRole.return_value.call.call_count
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def once(events):
+    """A poll side effect returning events on the first call and nothing after"""
+    batches = iter([events])
+    return lambda: next(batches, [])
+
+
+@patch("nectarpy.common.roles.EventWatcher")
+class RoleCacheTests(unittest.TestCase):
+    def test_role_is_read_once_while_fresh(self, watcher_cls):
+        watcher_cls.return_value.poll.return_value = []
+        client = build_client()
+        for _ in range(3):
+            self.assertEqual(client.check_if_is_valid_user_role(), "DA")
+        self.assertEqual(role_calls(client), 1)
+
+    def test_event_for_account_forces_reread(self, watcher_cls):
+        poll = watcher_cls.return_value.poll
+        poll.side_effect = once(
+            [{"event": "RoleRevoked", "args": {"account": ADDRESS, "role": b""}}]
+        )
+        client = build_client()
+        client.check_if_is_valid_user_role()
+        client.UserRole.functions.getUserRole.return_value.call.return_value = ""
+        wait_until(lambda: poll.call_count >= 2)
+        with self.assertRaises(RuntimeError):
+            client.check_if_is_valid_user_role()
+        self.assertEqual(role_calls(client), 2)
+
+    def test_events_for_other_accounts_are_ignored(self, watcher_cls):
+        poll = watcher_cls.return_value.poll
+        poll.side_effect = once([{"event": "StatusReset", "args": {"user": "0x" + "bb" * 20}}])
+        client = build_client()
+        client.check_if_is_valid_user_role()
+        wait_until(lambda: poll.call_count >= 2)
+        client.check_if_is_valid_user_role()
+        self.assertEqual(role_calls(client), 1)
+
+    def test_role_checks_do_not_wait_for_the_watcher(self, watcher_cls):
+        installing = threading.Event()
+        release = threading.Event()
+
+        def slow_install(*args):
+            installing.set()
+            release.wait(2)
+            return MagicMock()
+
+        watcher_cls.side_effect = slow_install
+        client = build_client()
+        try:
+            for _ in range(3):
+                self.assertEqual(client.check_if_is_valid_user_role(), "DA")
+            self.assertTrue(installing.wait(2))
+            self.assertEqual(role_calls(client), 1)
+            client.web3.eth.get_filter_changes.assert_not_called()
+        finally:
+            release.set()
+
+    def test_clients_share_one_watcher(self, watcher_cls):
+        other = "0x" + "bb" * 20
+        poll = watcher_cls.return_value.poll
+        poll.side_effect = once([{"event": "RoleRevoked", "args": {"account": other}}])
+        feed = RoleFeed(event_poll=0.01)
+        first = build_client(feed=feed)
+        second = build_client(address=other, feed=feed)
+        first.check_if_is_valid_user_role()
+        second.check_if_is_valid_user_role()
+        wait_until(lambda: poll.call_count >= 2)
+        first.check_if_is_valid_user_role()
+        second.check_if_is_valid_user_role()
+
+        watcher_cls.assert_called_once()
+        self.assertEqual(role_calls(first), 1)
+        self.assertEqual(role_calls(second), 2)
+
+    def test_polling_stops_with_the_last_client(self, watcher_cls):
+        watcher_cls.return_value.poll.return_value = []
+        feed = RoleFeed(event_poll=0.01)
+        build_client(feed=feed).check_if_is_valid_user_role()
+        wait_until(lambda: feed._poller is None)
+        watcher_cls.return_value.uninstall.assert_called_once()
+
+    def test_refresh_role_rereads(self, watcher_cls):
+        client = build_client()
+        client.check_if_is_valid_user_role()
+        client.UserRole.functions.getUserRole.return_value.call.return_value = "DO"
+        self.assertEqual(client.refresh_role(), "DO")
+        self.assertEqual(role_calls(client), 2)
+
+    def test_expired_role_is_reread(self, watcher_cls):
+        watcher_cls.side_effect = ValueError("no filters")
+        client = build_client()
+        client.role_cache = RoleCache(ADDRESS, ttl=0)
+        client.check_if_is_valid_user_role()
+        client.check_if_is_valid_user_role()
+        self.assertEqual(role_calls(client), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
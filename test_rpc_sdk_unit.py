@@ -0,0 +1,323 @@
+import json
+import os
+import time
+import unittest
+import unittest.mock
+from unittest.mock import patch
+
+import aiohttp
+import requests
+
+from eth_account import Account
+from web3 import Web3
+
+from nectarpy.common.nonce import NonceManager, is_nonce_error
+from nectarpy.common.rpc import (
+    AsyncFailoverHTTPProvider,
+    FailoverHTTPProvider,
+    endpoint_urls,
+    pinned,
+)
+from nectarpy.common.transactions import send_transaction
+from nectarpy.lib_v1 import NectarClient
+
+A = "https://a.example.org"
+B = "https://b.example.org"
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def fake_post(behaviour, calls):
+    """behaviour maps a URL to a callable run before answering, or an exception"""
+
+    def post(uri, data, **kwargs):
+        calls.append(uri)
+        action = behaviour.get(uri)
+        if isinstance(action, Exception):
+            raise action
+        if callable(action):
+            action()
+        request = json.loads(data)
+        return json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": uri}).encode()
+
+    return post
+
+
+class EndpointUrlTests(unittest.TestCase):
+    def test_single_url_list_and_env_override(self):
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("NECTAR_RPC_URLS", None)
+            self.assertEqual(endpoint_urls({"url": A}), [A])
+            self.assertEqual(endpoint_urls({"url": [A, B]}), [A, B])
+            self.assertEqual(endpoint_urls({"url": A, "urls": [B, A]}), [B, A])
+        with patch.dict(os.environ, {"NECTAR_RPC_URLS": f"{B}, {A}"}):
+            self.assertEqual(endpoint_urls({"url": A}), [B, A])
+
+
+class FailoverProviderTests(unittest.TestCase):
+    def provider(self, **kwargs):
+        kwargs.setdefault("hedge_after", 5)
+        kwargs.setdefault("max_retries", 0)
+        return FailoverHTTPProvider([A, B], **kwargs)
+
+    def test_rate_limited_endpoint_fails_over_and_cools_down(self):
+        calls = []
+        provider = self.provider()
+        with patch(
+            "nectarpy.common.rpc.make_post_request", fake_post({A: http_error(429)}, calls)
+        ):
+            first = provider.make_request("eth_blockNumber", [])
+            second = provider.make_request("eth_blockNumber", [])
+
+        self.assertEqual(first["result"], B)
+        self.assertEqual(second["result"], B)
+        # A is on cooldown after the 429, so the second call skips it.
+        self.assertEqual(calls, [A, B, B])
+        stats = {s["uri"]: s for s in provider.stats()}
+        self.assertFalse(stats[A]["healthy"])
+        self.assertEqual(stats[A]["errors"], 1)
+
+    def test_client_errors_are_not_retried(self):
+        calls = []
+        provider = self.provider()
+        with patch(
+            "nectarpy.common.rpc.make_post_request", fake_post({A: http_error(400)}, calls)
+        ):
+            with self.assertRaises(requests.HTTPError):
+                provider.make_request("eth_blockNumber", [])
+        self.assertEqual(calls, [A])
+
+    def test_reads_go_to_fastest_endpoint(self):
+        provider = self.provider()
+        provider.endpoints[0].latency = 0.5
+        provider.endpoints[1].latency = 0.05
+        calls = []
+        with patch("nectarpy.common.rpc.make_post_request", fake_post({}, calls)):
+            result = provider.make_request("eth_call", [])
+        self.assertEqual(result["result"], B)
+        self.assertEqual(calls, [B])
+
+    def test_slow_read_is_hedged(self):
+        calls = []
+        provider = self.provider(hedge_after=0.05)
+        slow = {A: lambda: time.sleep(0.5)}
+        with patch("nectarpy.common.rpc.make_post_request", fake_post(slow, calls)):
+            start = time.monotonic()
+            result = provider.make_request("eth_call", [])
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(result["result"], B)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(calls, [A, B])
+
+    def test_writes_are_never_hedged(self):
+        calls = []
+        provider = self.provider(hedge_after=0.05)
+        slow = {A: lambda: time.sleep(0.2)}
+        with patch("nectarpy.common.rpc.make_post_request", fake_post(slow, calls)):
+            result = provider.make_request("eth_sendRawTransaction", ["0x00"])
+        self.assertEqual(result["result"], A)
+        self.assertEqual(calls, [A])
+
+    def test_filter_methods_stay_on_first_endpoint(self):
+        provider = self.provider()
+        provider.endpoints[0].latency = 0.5
+        provider.endpoints[1].latency = 0.05
+        calls = []
+        with patch("nectarpy.common.rpc.make_post_request", fake_post({}, calls)):
+            provider.make_request("eth_getFilterChanges", ["0x1"])
+        self.assertEqual(calls, [A])
+
+    def test_pinned_reads_share_one_endpoint(self):
+        provider = self.provider(hedge_after=0.01)
+        provider.endpoints[0].latency = 0.05
+        provider.endpoints[1].latency = 0.5
+        calls = []
+        slow = {A: lambda: time.sleep(0.05)}
+        with patch("nectarpy.common.rpc.make_post_request", fake_post(slow, calls)):
+            with pinned(Web3(provider)):
+                provider.make_request("eth_blockNumber", [])
+                provider.make_request("eth_getLogs", [{}])
+        # Slow answers are not hedged to B while pinned.
+        self.assertEqual(calls, [A, A])
+
+    def test_pending_nonce_reads_follow_writes(self):
+        provider = self.provider()
+        provider.endpoints[0].latency = 0.5
+        provider.endpoints[1].latency = 0.05
+        calls = []
+        with patch("nectarpy.common.rpc.make_post_request", fake_post({}, calls)):
+            provider.make_request("eth_getTransactionCount", ["0xabc", "pending"])
+            provider.make_request("eth_sendRawTransaction", ["0x00"])
+            provider.make_request("eth_getTransactionCount", ["0xabc", "latest"])
+        self.assertEqual(calls, [A, A, B])
+
+    def test_retries_with_backoff_when_every_endpoint_fails(self):
+        calls = []
+        outcomes = iter([http_error(503), http_error(503)])
+
+        def flaky():
+            error = next(outcomes, None)
+            if error is not None:
+                raise error
+
+        provider = self.provider(max_retries=1)
+        with patch(
+            "nectarpy.common.rpc.make_post_request", fake_post({A: flaky, B: flaky}, calls)
+        ), patch("nectarpy.common.rpc.time.sleep") as sleep, patch(
+            "nectarpy.common.rpc.Endpoint.healthy", return_value=True
+        ):
+            result = provider.make_request("eth_blockNumber", [])
+
+        self.assertEqual(len(calls), 3)
+        self.assertIn(result["result"], (A, B))
+        sleep.assert_called_once()
+
+
+def async_fake_post(behaviour, calls):
+    post = fake_post(behaviour, calls)
+
+    async def async_post(uri, data, **kwargs):
+        return post(uri, data, **kwargs)
+
+    return async_post
+
+
+class AsyncFailoverProviderTests(unittest.IsolatedAsyncioTestCase):
+    async def test_unreachable_endpoint_fails_over(self):
+        calls = []
+        provider = AsyncFailoverHTTPProvider([A, B], max_retries=0)
+        error = aiohttp.ClientConnectionError("connection reset")
+        with patch(
+            "nectarpy.common.rpc.async_make_post_request",
+            async_fake_post({A: error}, calls),
+        ):
+            result = await provider.make_request("eth_blockNumber", [])
+
+        self.assertEqual(result["result"], B)
+        self.assertEqual(calls, [A, B])
+        self.assertFalse({s["uri"]: s for s in provider.stats()}[A]["healthy"])
+
+    async def test_ambiguous_write_errors_do_not_fail_over(self):
+        calls = []
+        provider = AsyncFailoverHTTPProvider([A, B], max_retries=2)
+        with patch(
+            "nectarpy.common.rpc.async_make_post_request",
+            async_fake_post({A: http_error(502)}, calls),
+        ):
+            with self.assertRaises(requests.HTTPError):
+                await provider.make_request("eth_sendRawTransaction", ["0x00"])
+        self.assertEqual(calls, [A])
+
+    async def test_retries_with_backoff_when_every_endpoint_fails(self):
+        calls = []
+        outcomes = iter([http_error(503), http_error(503)])
+
+        def flaky():
+            error = next(outcomes, None)
+            if error is not None:
+                raise error
+
+        provider = AsyncFailoverHTTPProvider([A, B], max_retries=1)
+        with patch(
+            "nectarpy.common.rpc.async_make_post_request",
+            async_fake_post({A: flaky, B: flaky}, calls),
+        ), patch(
+            "nectarpy.common.rpc.asyncio.sleep", new_callable=unittest.mock.AsyncMock
+        ) as sleep, patch("nectarpy.common.rpc.Endpoint.healthy", return_value=True):
+            result = await provider.make_request("eth_blockNumber", [])
+
+        self.assertEqual(len(calls), 3)
+        self.assertIn(result["result"], (A, B))
+        sleep.assert_awaited_once()
+
+
+class FakeChain:
+    """Endpoints sharing one transaction pool; the first send is accepted, then times out"""
+
+    def __init__(self):
+        self.pool = {}
+        self.sends = []
+
+    def post(self, uri, data, **kwargs):
+        request = json.loads(data)
+        method, params = request["method"], request["params"]
+        reply = {"jsonrpc": "2.0", "id": request["id"]}
+        if method == "eth_getTransactionCount":
+            reply["result"] = hex(5 + len(self.pool))
+        elif method == "eth_sendRawTransaction":
+            self.sends.append(uri)
+            raw = params[0]
+            tx_hash = Web3.to_hex(Web3.keccak(hexstr=raw))
+            if raw in self.pool.values():
+                reply["error"] = {"code": -32000, "message": "already known"}
+            else:
+                self.pool[tx_hash] = raw
+                if len(self.sends) == 1:
+                    raise requests.ReadTimeout("read timed out")
+                reply["result"] = tx_hash
+        elif method == "eth_getTransactionByHash":
+            reply["result"] = None
+        return json.dumps(reply).encode()
+
+
+class WriteFailoverTests(unittest.TestCase):
+    def build_client(self, provider):
+        account = Account.create()
+        client = object.__new__(NectarClient)
+        client.account = {"address": account.address, "private_key": account.key}
+        client.web3 = Web3(provider)
+        client.nonce_manager = NonceManager(client.web3, account.address)
+        return client
+
+    def contract_fn(self):
+        fn = unittest.mock.MagicMock()
+        fn.build_transaction.side_effect = lambda params: {
+            "to": "0x" + "11" * 20,
+            "value": 0,
+            "data": "0x095ea7b3",
+            "gas": 100_000,
+            "gasPrice": 1,
+            "chainId": 1284,
+            "nonce": params["nonce"],
+        }
+        return fn
+
+    def test_timed_out_send_is_not_signed_again(self):
+        chain = FakeChain()
+        provider = FailoverHTTPProvider([A, B], hedge_after=5, max_retries=0)
+        client = self.build_client(provider)
+        fn = self.contract_fn()
+        with patch("nectarpy.common.rpc.make_post_request", chain.post):
+            tx_hash = send_transaction(client, fn)
+
+        self.assertEqual(len(chain.pool), 1)
+        self.assertEqual(Web3.to_hex(tx_hash), next(iter(chain.pool)))
+        self.assertEqual(fn.build_transaction.call_count, 1)
+        # The same bytes were re-sent to the other endpoint, which already had them.
+        self.assertEqual(len(chain.sends), 2)
+        self.assertEqual(set(chain.sends), {A, B})
+        self.assertEqual(client.nonce_manager.allocate(), 6)
+
+    def test_ambiguous_write_errors_do_not_fail_over(self):
+        calls = []
+        provider = FailoverHTTPProvider([A, B], hedge_after=5, max_retries=2)
+        with patch(
+            "nectarpy.common.rpc.make_post_request",
+            fake_post({A: http_error(502)}, calls),
+        ):
+            with self.assertRaises(requests.HTTPError):
+                provider.make_request("eth_sendRawTransaction", ["0x00"])
+        self.assertEqual(calls, [A])
+
+    def test_already_known_is_not_a_nonce_error(self):
+        self.assertFalse(is_nonce_error(ValueError({"message": "already known"})))
+        self.assertTrue(is_nonce_error(ValueError({"message": "nonce too low"})))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+
+import dill
+
+from nectarpy.common import serialization
+from nectarpy.common.serialization import clear_function_cache, dumps_function
+
+SCALE = 2
+SETTINGS = {"scale": 2}
+
+
+def scaled(x):
+    return x * SCALE
+
+
+def uses_settings(x):
+    return x * SETTINGS["scale"]
+
+
+def make_adder(n):
+    def add(x):
+        return x + n
+
+    return add
+
+
+class FunctionCacheTests(unittest.TestCase):
+    def setUp(self):
+        clear_function_cache()
+
+    def dumps_calls(self, *funcs):
+        with patch.object(serialization.dill, "dumps", wraps=dill.dumps) as dumps:
+            payloads = [dumps_function(f) for f in funcs]
+        return dumps.call_count, payloads
+
+    def test_same_function_is_pickled_once(self):
+        calls, payloads = self.dumps_calls(scaled, scaled)
+        self.assertEqual(calls, 1)
+        self.assertIs(payloads[0], payloads[1])
+        self.assertEqual(dill.loads(payloads[0])(3), 6)
+
+    def test_closure_values_are_part_of_the_key(self):
+        calls, payloads = self.dumps_calls(make_adder(1), make_adder(1), make_adder(2))
+        self.assertEqual(calls, 2)
+        self.assertEqual(dill.loads(payloads[2])(1), 3)
+
+    def test_changed_global_misses_the_cache(self):
+        global SCALE
+        dumps_function(scaled)
+        SCALE = 5
+        try:
+            self.assertEqual(dill.loads(dumps_function(scaled))(1), 5)
+        finally:
+            SCALE = 2
+
+    def test_functions_reading_mutable_globals_are_not_cached(self):
+        calls, _ = self.dumps_calls(uses_settings, uses_settings)
+        self.assertEqual(calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+
+from nectarpy.common.blockchain_init import blockchain_init
+from nectarpy.lib import Nectar
+from nectarpy.lib_v1 import NectarClient
+from nectarpy.session import NectarSession
+
+SECRET_A = "0x" + "11" * 32
+SECRET_B = "0x" + "22" * 32
+
+
+class NectarSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.session = NectarSession("localhost")
+
+    def test_clients_share_web3_and_contracts(self):
+        analyst = self.session.data_analyst(SECRET_A, check_role=False)
+        owner = self.session.data_owner(SECRET_B, check_role=False)
+
+        self.assertIsInstance(analyst, NectarClient)
+        self.assertIsInstance(owner, Nectar)
+        self.assertIs(analyst.web3, owner.web3)
+        self.assertIs(analyst.QueryManager, owner.QueryManager)
+        self.assertIs(analyst.EoaBond, self.session.EoaBond)
+        self.assertIs(analyst.role_feed, owner.role_feed)
+        self.assertNotEqual(analyst.account["address"], owner.account["address"])
+        self.assertNotEqual(analyst.hex_pubkey, owner.hex_pubkey)
+
+    def test_same_key_returns_same_client(self):
+        first = self.session.data_analyst(SECRET_A, check_role=False)
+        self.assertIs(self.session.data_analyst(SECRET_A, check_role=False), first)
+        self.session.release(SECRET_A)
+        self.assertIsNot(self.session.data_analyst(SECRET_A, check_role=False), first)
+
+    def test_role_is_checked_on_request(self):
+        with patch.object(NectarClient, "check_if_is_valid_user_role") as check:
+            self.session.data_analyst(SECRET_A)
+        check.assert_called_once()
+
+    def test_metadata_cache_reaches_existing_clients(self):
+        analyst = self.session.data_analyst(SECRET_A, check_role=False)
+        cache = self.session.enable_metadata_cache(ttl=60)
+        self.assertIs(analyst.metadata_cache, cache)
+        self.assertIs(
+            self.session.data_owner(SECRET_B, check_role=False).metadata_cache, cache
+        )
+
+
+    def test_session_clients_are_set_up_like_standalone_ones(self):
+        standalone = object.__new__(NectarClient)
+        blockchain_init(standalone, SECRET_A, "localhost")
+        analyst = self.session.data_analyst(SECRET_A, check_role=False)
+
+        shared = {"contract_source", "role_feed"}
+        self.assertEqual(set(analyst.__dict__) - shared, set(standalone.__dict__))
+        self.assertEqual(analyst.account, standalone.account)
+        self.assertIs(analyst.fee_oracle, self.session.fee_oracle)
+        self.assertEqual(analyst.nonce_manager.address, analyst.account["address"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,564 @@
+import json
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+from web3.exceptions import ContractLogicError, TransactionNotFound
+
+from nectarpy.common.nonce import NonceManager
+from nectarpy.common.fees import FeeOracle
+from nectarpy.common.transactions import BatchError, pay_query_gas, send_transaction
+from nectarpy.lib import Nectar
+from nectarpy.lib_v1 import NectarClient
+
+
+def build_web3_mock():
+    web3 = MagicMock()
+    web3.eth.get_transaction_count.return_value = 5
+    web3.eth.send_raw_transaction.return_value = b"tx_hash"
+    web3.eth.wait_for_transaction_receipt.return_value = types.SimpleNamespace(status=1)
+    web3.eth.account.sign_transaction.return_value = types.SimpleNamespace(
+        rawTransaction=b"signed_tx"
+    )
+    return web3
+
+
+def build_nectar():
+    nectar = object.__new__(Nectar)
+    nectar.account = {"address": "0xabc", "private_key": "0x123"}
+    nectar.web3 = build_web3_mock()
+    nectar.nonce_manager = NonceManager(nectar.web3, "0xabc")
+    return nectar
+
+
+def built_nonces(contract_fn):
+    return [c.args[0]["nonce"] for c in contract_fn.build_transaction.call_args_list]
+
+
+class NonceManagerTests(unittest.TestCase):
+    def test_syncs_once_then_counts_locally(self):
+        web3 = build_web3_mock()
+        manager = NonceManager(web3, "0xabc")
+        self.assertEqual([manager.allocate() for _ in range(3)], [5, 6, 7])
+        self.assertEqual(manager.allocate(count=2), 8)
+        self.assertEqual(manager.allocate(), 10)
+        web3.eth.get_transaction_count.assert_called_once_with("0xabc", "pending")
+
+    def test_resync_rereads_pending_count(self):
+        web3 = build_web3_mock()
+        manager = NonceManager(web3, "0xabc")
+        manager.allocate()
+        web3.eth.get_transaction_count.return_value = 9
+        manager.resync()
+        self.assertEqual(manager.allocate(), 9)
+
+    def test_released_nonce_is_reused_first(self):
+        manager = NonceManager(build_web3_mock(), "0xabc")
+        self.assertEqual([manager.allocate() for _ in range(3)], [5, 6, 7])
+        manager.release(6)
+        self.assertEqual(manager.allocate(), 6)
+        manager.release(7)
+        self.assertEqual(manager.allocate(), 7)
+        self.assertEqual(manager.allocate(), 8)
+
+    def test_resync_never_reuses_nonces_in_flight(self):
+        web3 = build_web3_mock()
+        manager = NonceManager(web3, "0xabc")
+        self.assertEqual([manager.allocate() for _ in range(3)], [5, 6, 7])
+        manager.confirm(5)
+        # The node has not seen 6 and 7 yet; they are still in flight.
+        web3.eth.get_transaction_count.return_value = 6
+        manager.resync()
+        self.assertEqual(manager.allocate(), 8)
+
+        manager.confirm(6)
+        manager.confirm(7)
+        manager.confirm(8)
+        web3.eth.get_transaction_count.return_value = 9
+        manager.resync()
+        self.assertEqual(manager.allocate(), 9)
+
+
+class SendTransactionTests(unittest.TestCase):
+    def test_back_to_back_sends_use_consecutive_nonces(self):
+        nectar = build_nectar()
+        fn = MagicMock()
+        send_transaction(nectar, fn)
+        send_transaction(nectar, fn)
+        self.assertEqual(built_nonces(fn), [5, 6])
+        nectar.web3.eth.get_transaction_count.assert_called_once()
+
+    def test_nonce_error_resyncs_and_retries_once(self):
+        nectar = build_nectar()
+        nectar.web3.eth.send_raw_transaction.side_effect = [
+            ValueError({"message": "nonce too low"}),
+            b"tx_hash",
+        ]
+        fn = MagicMock()
+        nectar.nonce_manager.allocate()
+        nectar.web3.eth.get_transaction_count.return_value = 8
+
+        self.assertEqual(send_transaction(nectar, fn), b"tx_hash")
+        self.assertEqual(built_nonces(fn), [6, 8])
+
+    def test_other_send_errors_release_nonce_and_raise(self):
+        nectar = build_nectar()
+        nectar.web3.eth.send_raw_transaction.side_effect = ValueError("insufficient funds")
+        with self.assertRaises(ValueError):
+            send_transaction(nectar, MagicMock())
+        nectar.web3.eth.send_raw_transaction.side_effect = None
+        fn = MagicMock()
+        send_transaction(nectar, fn)
+        self.assertEqual(built_nonces(fn), [5])
+        nectar.web3.eth.get_transaction_count.assert_called_once()
+
+    def test_failed_send_keeps_other_allocations(self):
+        nectar = build_nectar()
+        in_flight = nectar.nonce_manager.allocate()
+        fn = MagicMock()
+        fn.build_transaction.side_effect = [ValueError("execution reverted"), {}]
+        with self.assertRaises(ValueError):
+            send_transaction(nectar, fn)
+        send_transaction(nectar, fn)
+
+        self.assertEqual(in_flight, 5)
+        self.assertEqual(built_nonces(fn), [6, 6])
+        nectar.web3.eth.get_transaction_count.assert_called_once()
+
+
+class PipelinedPaymentTests(unittest.TestCase):
+    def build_client(self):
+        client = object.__new__(NectarClient)
+        client.account = {"address": "0xabc", "private_key": "0x123"}
+        client.qm_contract_addr = "0xqm"
+        client.web3 = build_web3_mock()
+        client.nonce_manager = NonceManager(client.web3, "0xabc")
+        client.USDC = MagicMock()
+        client.QueryManager = MagicMock()
+        client.QueryManager.functions.getUserIndex.return_value.call.return_value = 7
+        return client
+
+    def test_sends_approve_and_pay_query_before_waiting(self):
+        client = self.build_client()
+        events = []
+
+        def send(raw):
+            events.append("send")
+            return b"tx_hash"
+
+        def wait(*args, **kwargs):
+            events.append("wait")
+            return types.SimpleNamespace(status=1)
+
+        client.web3.eth.send_raw_transaction.side_effect = send
+        client.web3.eth.wait_for_transaction_receipt.side_effect = wait
+
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
+            encrypt_mock.return_value = json.dumps({"cipher": "abc"})
+            user_index, _ = client.approve_and_pay_query(
+                {"k": "v"}, 10, bucket_ids=[1], policy_indexes=[0]
+            )
+
+        self.assertEqual(user_index, 7)
+        self.assertEqual(events, ["send", "send", "wait", "wait"])
+        approve_tx = client.USDC.functions.approve.return_value.build_transaction
+        pay_tx = client.QueryManager.functions.payQuery.return_value.build_transaction
+        self.assertEqual(approve_tx.call_args[0][0]["nonce"], 5)
+        self.assertEqual(pay_tx.call_args[0][0]["nonce"], 6)
+        self.assertIn("gas", pay_tx.call_args[0][0])
+
+    def test_reverted_approve_raises(self):
+        client = self.build_client()
+        client.web3.eth.wait_for_transaction_receipt.return_value = (
+            types.SimpleNamespace(status=0)
+        )
+        with patch("nectarpy.common.encryption.hybrid_encrypt_v1") as encrypt_mock:
+            encrypt_mock.return_value = json.dumps({"cipher": "abc"})
+            with self.assertRaisesRegex(RuntimeError, "approve"):
+                client.approve_and_pay_query(
+                    {"k": "v"}, 10, bucket_ids=[1], policy_indexes=[0]
+                )
+
+    def test_byoc_query_pipelined_skips_separate_approve(self):
+        client = object.__new__(NectarClient)
+        client.qm_contract_addr = "0xqm"
+        client.USDC = MagicMock()
+        client.check_if_is_valid_user_role = MagicMock()
+        client.get_pay_amount = MagicMock(return_value=10)
+        client.approve_payment = MagicMock()
+        client.pay_query = MagicMock(return_value=(11, {"status": 1}))
+        client.wait_for_query_result = MagicMock(return_value={"ok": True})
+
+        with patch("nectarpy.lib_v1.send_transaction", return_value=b"approve") as send:
+            result = client.byoc_query(
+                main_func=lambda: 1,
+                bucket_ids=[1],
+                policy_indexes=[0],
+                pipelined=True,
+            )
+
+        self.assertEqual(result, {"ok": True})
+        client.approve_payment.assert_not_called()
+        send.assert_called_once()
+        self.assertEqual(client.pay_query.call_args.kwargs["approve_hash"], b"approve")
+        client.wait_for_query_result.assert_called_once_with(11)
+
+
+class AllowanceTests(unittest.TestCase):
+    def build_client(self, allowance):
+        client = object.__new__(NectarClient)
+        client.account = {"address": "0xabc", "private_key": "0x123"}
+        client.qm_contract_addr = "0xqm"
+        client.USDC = MagicMock()
+        client.USDC.functions.allowance.return_value.call.return_value = allowance
+        client.check_if_is_valid_user_role = MagicMock()
+        client.get_pay_amount = MagicMock(return_value=10)
+        client.approve_payment = MagicMock()
+        client.pay_query = MagicMock(return_value=(11, {"status": 1}))
+        client.approve_and_pay_query = MagicMock(return_value=(11, {"status": 1}))
+        client.wait_for_query_result = MagicMock(return_value={"ok": True})
+        return client
+
+    def test_ensure_allowance_skips_approve_when_covered(self):
+        client = self.build_client(allowance=10)
+        self.assertIsNone(client.ensure_allowance(10))
+        client.USDC.functions.allowance.assert_called_once_with("0xabc", "0xqm")
+        client.approve_payment.assert_not_called()
+
+    def test_ensure_allowance_approves_budget_when_short(self):
+        client = self.build_client(allowance=5)
+        client.ensure_allowance(10, budget=1000)
+        client.approve_payment.assert_called_once_with(1000)
+
+    def test_approve_covers_payments_in_flight(self):
+        client = self.build_client(allowance=0)
+        client.web3 = build_web3_mock()
+        client.web3.eth.get_transaction_receipt.side_effect = TransactionNotFound("no")
+        client.ensure_allowance(10)
+        client.approve_payment.assert_called_with(10)
+
+        # The first payQuery is sent but not mined; approve overwrites, so
+        # the next approve has to leave room for it.
+        client.USDC.functions.allowance.return_value.call.return_value = 10
+        client._payment_sent(10, b"first")
+        client.ensure_allowance(20)
+        client.approve_payment.assert_called_with(30)
+
+        client.web3.eth.get_transaction_receipt.side_effect = None
+        client.USDC.functions.allowance.return_value.call.return_value = 0
+        client._payment_sent(20, b"second")
+        # Both payments are mined now and no longer count.
+        client.ensure_allowance(5, budget=100)
+        client.approve_payment.assert_called_with(100)
+
+    def test_byoc_query_reuses_existing_allowance(self):
+        client = self.build_client(allowance=50)
+        client.byoc_query(
+            main_func=lambda: 1,
+            bucket_ids=[1],
+            policy_indexes=[0],
+            pipelined=True,
+            reuse_allowance=True,
+        )
+        client.approve_payment.assert_not_called()
+        client.approve_and_pay_query.assert_not_called()
+        client.pay_query.assert_called_once()
+
+    def test_byoc_query_tops_up_to_budget(self):
+        client = self.build_client(allowance=0)
+        client.byoc_query(
+            main_func=lambda: 1,
+            bucket_ids=[1],
+            policy_indexes=[0],
+            reuse_allowance=True,
+            approve_budget=500,
+        )
+        client.approve_payment.assert_called_once_with(500)
+        client.pay_query.assert_called_once()
+
+
+class SubmitManyTests(unittest.TestCase):
+    def build_client(self):
+        client = PipelinedPaymentTests.build_client(self)
+        client.check_if_is_valid_user_role = MagicMock()
+        client.get_pay_amounts = MagicMock(return_value=[10, 20, 30])
+        client.ensure_allowance = MagicMock()
+        client._encrypt_query = MagicMock(return_value=json.dumps({"cipher": "abc"}))
+        client.wait_for_query_result = MagicMock(side_effect=lambda i: f"result-{i}")
+        return client
+
+    def specs(self):
+        return [
+            {"main_func": lambda: 1, "bucket_ids": [b], "policy_indexes": [0]}
+            for b in (1, 2, 3)
+        ]
+
+    def test_prices_once_and_sends_consecutive_indexes_and_nonces(self):
+        client = self.build_client()
+        futures = client.submit_many(self.specs(), approve_budget=1000)
+
+        self.assertEqual(
+            [f.result(timeout=5) for f in futures],
+            ["result-7", "result-8", "result-9"],
+        )
+        client.get_pay_amounts.assert_called_once_with([([1], [0]), ([2], [0]), ([3], [0])])
+        client.ensure_allowance.assert_called_once_with(60, 1000)
+        client.QueryManager.functions.getUserIndex.assert_called_once()
+        pay_query = client.QueryManager.functions.payQuery
+        self.assertEqual([c.args[0] for c in pay_query.call_args_list], [7, 8, 9])
+        nonces = [
+            c.args[0]["nonce"]
+            for c in pay_query.return_value.build_transaction.call_args_list
+        ]
+        self.assertEqual(nonces, [5, 6, 7])
+
+    def test_invalid_spec_fails_before_anything_is_sent(self):
+        client = self.build_client()
+        specs = self.specs() + [{"bucket_ids": [4], "policy_indexes": [0]}]
+        with self.assertRaises(ValueError):
+            client.submit_many(specs)
+        client.get_pay_amounts.assert_not_called()
+        client.web3.eth.send_raw_transaction.assert_not_called()
+
+    def test_send_failure_keeps_futures_of_sent_queries(self):
+        client = self.build_client()
+        client.web3.eth.send_raw_transaction.side_effect = [
+            b"tx_hash",
+            ValueError("insufficient funds"),
+        ]
+        futures = client.submit_many(self.specs())
+
+        self.assertEqual(len(futures), 3)
+        self.assertEqual(futures[0].result(timeout=5), "result-7")
+        for future in futures[1:]:
+            with self.assertRaisesRegex(ValueError, "insufficient funds"):
+                future.result(timeout=5)
+
+    def test_failed_query_does_not_free_indexes_in_flight(self):
+        client = self.build_client()
+        self.assertEqual([client._user_index() for _ in range(3)], [7, 8, 9])
+        # 7 failed while 8 and 9 are still in flight and nothing is mined yet.
+        client._resync_user_index(7)
+        self.assertEqual(client._user_index(), 10)
+        # The last index handed out is given back.
+        client._resync_user_index(10)
+        self.assertEqual(client._user_index(), 10)
+        # Another process used indexes up to 14.
+        client.QueryManager.functions.getUserIndex.return_value.call.return_value = 15
+        client._resync_user_index(10)
+        self.assertEqual(client._user_index(), 15)
+
+    def test_map_queries_yields_positions_with_results(self):
+        client = self.build_client()
+        results = dict(client.map_queries(self.specs()))
+        self.assertEqual(results, {0: "result-7", 1: "result-8", 2: "result-9"})
+
+    def test_map_queries_yields_failures_and_keeps_going(self):
+        client = self.build_client()
+
+        def wait(user_index):
+            if user_index == 7:
+                raise RuntimeError("Query 7 was refunded")
+            return f"result-{user_index}"
+
+        client.wait_for_query_result.side_effect = wait
+        results = dict(client.map_queries(self.specs()))
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual((results[1], results[2]), ("result-8", "result-9"))
+
+    def test_get_pay_amounts_prices_rejected_buckets_like_get_pay_amount(self):
+        client = object.__new__(NectarClient)
+        client.read_policies = MagicMock(
+            side_effect=lambda ids: [{"price": p} for p in ids]
+        )
+        missing = ContractLogicError("execution reverted: BucketNotFound")
+        with patch(
+            "nectarpy.lib_v1.get_bucket_policy_ids", return_value=[[100], missing]
+        ):
+            prices = client.get_pay_amounts([([1], [0]), ([2], [0]), ([1, 2], [0, 0])])
+        self.assertEqual(prices, [100, 0, 0])
+        client.read_policies.assert_called_once_with([100])
+
+    def test_get_pay_amounts_reads_shared_buckets_once(self):
+        client = object.__new__(NectarClient)
+        client.read_policies = MagicMock(
+            side_effect=lambda ids: [{"price": p} for p in ids]
+        )
+        with patch(
+            "nectarpy.lib_v1.get_bucket_policy_ids",
+            return_value=[[100, 200], [300]],
+        ) as bucket_reads:
+            prices = client.get_pay_amounts([([1, 2], [0, 0]), ([1], [1])])
+
+        bucket_reads.assert_called_once_with(client, [1, 2], return_exceptions=True)
+        client.read_policies.assert_called_once_with([100, 300, 200])
+        self.assertEqual(prices, [400, 200])
+
+
+class PayQueryGasTests(unittest.TestCase):
+    def oracle(self, gas_limit):
+        oracle = FeeOracle(MagicMock())
+        oracle.web3.eth.get_block.return_value = {"gasLimit": gas_limit}
+        return types.SimpleNamespace(fee_oracle=oracle)
+
+    def test_capped_at_block_gas_limit(self):
+        client = self.oracle(15_000_000)
+        self.assertEqual(pay_query_gas(client, "x" * 20_000, 1), 15_000_000)
+        self.assertEqual(pay_query_gas(client, "x" * 100, 1), 600_000)
+        client.fee_oracle.web3.eth.get_block.assert_called_once_with("latest")
+
+    def test_command_too_large_for_a_block_fails_early(self):
+        with self.assertRaisesRegex(ValueError, "use_blob_store"):
+            pay_query_gas(self.oracle(15_000_000), "x" * 30_000, 1)
+
+    def test_submit_query_lets_node_estimate_without_pending_approve(self):
+        client = SubmitManyTests.build_client(self)
+        client.get_pay_amount = MagicMock(return_value=10)
+        client.submit_query(main_func=lambda: 1, bucket_ids=[1], policy_indexes=[0])
+        params = client.QueryManager.functions.payQuery.return_value.build_transaction
+        self.assertNotIn("gas", params.call_args.args[0])
+
+        client.ensure_allowance.return_value = b"approve"
+        client.submit_query(
+            main_func=lambda: 1, bucket_ids=[1], policy_indexes=[0], pipelined=True
+        )
+        self.assertIn("gas", params.call_args.args[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class ProvisioningTests(unittest.TestCase):
+    def build_nectar(self):
+        nectar = build_nectar()
+        nectar.check_if_is_valid_user_role = MagicMock()
+        nectar.EoaBond = MagicMock()
+        events = []
+        nectar.web3.eth.send_raw_transaction.side_effect = (
+            lambda raw: events.append("send") or b"tx_hash"
+        )
+        nectar.web3.eth.wait_for_transaction_receipt.side_effect = (
+            lambda *a, **k: events.append("wait") or types.SimpleNamespace(status=1)
+        )
+        return nectar, events
+
+    def policy(self, **overrides):
+        policy = {
+            "allowed_categories": ["*"],
+            "allowed_addresses": ["0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"],
+            "allowed_columns": ["age"],
+            "valid_days": 7,
+            "usd_price": 0.01,
+        }
+        policy.update(overrides)
+        return policy
+
+    def test_provision_sends_everything_before_waiting(self):
+        nectar, events = self.build_nectar()
+        created = nectar.provision(
+            {
+                "policies": {"open": self.policy(), "paid": self.policy(usd_price=1)},
+                "buckets": {
+                    "sales": {
+                        "policy_ids": ["open", 42],
+                        "use_allowlists": [False, True],
+                        "data_format": "std1",
+                        "node_address": "https://node",
+                    }
+                },
+            }
+        )
+
+        self.assertEqual(events, ["send"] * 3 + ["wait"] * 3)
+        fns = nectar.EoaBond.functions
+        self.assertEqual(built_nonces(fns.addPolicy.return_value), [5, 6])
+        self.assertEqual(built_nonces(fns.addBucket.return_value), [7])
+        self.assertIn("gas", fns.addBucket.return_value.build_transaction.call_args[0][0])
+        self.assertEqual(
+            fns.addBucket.call_args[0][:2],
+            (created["buckets"]["sales"], [created["policies"]["open"], 42]),
+        )
+        self.assertEqual(sorted(created["policies"]), ["open", "paid"])
+
+    def test_invalid_entry_sends_nothing(self):
+        nectar, events = self.build_nectar()
+        with self.assertRaises(RuntimeError):
+            nectar.add_policies([self.policy(), self.policy(valid_days=0)])
+        with self.assertRaisesRegex(ValueError, "unknown policy"):
+            nectar.provision(
+                {
+                    "policies": {"open": self.policy()},
+                    "buckets": {
+                        "sales": {
+                            "policy_ids": ["closed"],
+                            "use_allowlists": [False],
+                            "data_format": "std1",
+                            "node_address": "https://node",
+                        }
+                    },
+                }
+            )
+        self.assertEqual(events, [])
+
+    def test_failed_batch_reports_every_call(self):
+        nectar, _ = self.build_nectar()
+        nectar.web3.eth.send_raw_transaction.side_effect = [
+            b"tx_1",
+            b"tx_2",
+            ValueError({"message": "insufficient funds"}),
+        ]
+        nectar.web3.eth.wait_for_transaction_receipt.side_effect = [
+            types.SimpleNamespace(status=1),
+            types.SimpleNamespace(status=0),
+        ]
+        nectar.EoaBond.functions.addPolicy.side_effect = lambda *args: MagicMock(
+            args=args
+        )
+        with self.assertRaises(BatchError) as caught:
+            nectar.add_policies([self.policy() for _ in range(4)])
+
+        outcomes = caught.exception.outcomes
+        self.assertEqual([o["tx_hash"] for o in outcomes], [b"tx_1", b"tx_2", None, None])
+        self.assertEqual([o["status"] for o in outcomes], [1, 0, None, None])
+        self.assertEqual(outcomes[1]["error"], "reverted")
+        self.assertIn("insufficient funds", outcomes[2]["error"])
+        self.assertEqual(outcomes[3]["error"], "not sent")
+        self.assertEqual(
+            [o["id"] for o in outcomes],
+            [c.args[0] for c in nectar.EoaBond.functions.addPolicy.call_args_list],
+        )
+
+    def test_add_buckets_checks_the_role(self):
+        nectar, events = self.build_nectar()
+        nectar.check_if_is_valid_user_role.side_effect = RuntimeError("not DO")
+        with self.assertRaises(RuntimeError):
+            nectar.add_buckets(
+                [
+                    {
+                        "policy_ids": [1],
+                        "use_allowlists": [False],
+                        "data_format": "std1",
+                        "node_address": "https://node",
+                    }
+                ]
+            )
+        self.assertEqual(events, [])
+
+    def test_buckets_on_existing_policies_are_gas_estimated(self):
+        nectar, _ = self.build_nectar()
+        bucket_ids = nectar.add_buckets(
+            [
+                {
+                    "policy_ids": [1],
+                    "use_allowlists": [False],
+                    "data_format": "std1",
+                    "node_address": "https://node",
+                }
+            ]
+            * 2
+        )
+        self.assertEqual(len(set(bucket_ids)), 2)
+        add_bucket = nectar.EoaBond.functions.addBucket.return_value
+        self.assertEqual(built_nonces(add_bucket), [5, 6])
+        self.assertNotIn("gas", add_bucket.build_transaction.call_args[0][0])